@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Bytes on disk and hit latency of FsCache for each compression codec.
+
+Run from the repository root :
+
+    python bench/bench_fscache_compression.py [entries]
+
+Entries are compressible pickled results : lists of records. Set TMPDIR
+to measure a given volume, like a network one.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'modularcache'))
+
+import serializers
+from fscache import FsCache
+
+
+def record(i):
+    return {'id': i, 'name': 'customer %d' % (i % 100), 'country': 'FR',
+            'tags': ['active', 'newsletter'], 'balance': i * 0.25}
+
+
+def diskUsage(directory):
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for name in os.listdir(directory))
+
+
+def bench(entries, compression):
+    """
+    Return (bytes on disk, ms per hit).
+    """
+    directory = tempfile.mkdtemp(prefix='fscache-bench-')
+    try:
+        config = {'dir': directory, 'freq': '60', 'expirationdelay': '3600'}
+        if compression is not None:
+            config['compression'] = compression
+            config['compressminbytes'] = '512'
+        f = FsCache(config)
+        keys = [('f', (i,), ()) for i in range(entries)]
+        for key in keys:
+            f.putInCache(key, [record(i) for i in range(1000)])
+
+        start = time.time()
+        for key in keys:
+            f.get(key)
+        return diskUsage(directory), (time.time() - start) * 1000 / entries
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    print('%-8s %14s %12s' % ('codec', 'bytes on disk', 'ms per hit'))
+    for compression in [None] + sorted(serializers.COMPRESSIONS):
+        size, hit = bench(entries, compression)
+        print('%-8s %14d %12.3f' % (compression or 'none', size, hit))
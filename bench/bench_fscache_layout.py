@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Put/get latency of FsCache, flat layout against sharded layout.
+
+Run from the repository root :
+
+    python bench/bench_fscache_layout.py [entries ...]
+
+For each number of entries (10k, 1M and 5M by default) a fresh cache dir
+is filled, then the mean put and get latency is measured on a sample of
+keys. Set TMPDIR to put the cache dirs on the filesystem to measure;
+5M entries need a few GB and a long time to fill.
+"""
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'modularcache'))
+
+from fscache import FsCache
+
+SAMPLE = 2000
+
+
+def bench(entries, shardDepth):
+    """
+    Return (put, get) mean latencies in microseconds.
+    """
+    directory = tempfile.mkdtemp(prefix='fscache-bench-')
+    try:
+        f = FsCache({'dir': directory, 'freq': '60', 'expirationdelay': '3600',
+                     'sharddepth': str(shardDepth)})
+        for i in range(entries):
+            f.putInCache(('f', (i,), ()), i)
+
+        keys = [('f', (random.randrange(entries),), ()) for _ in range(SAMPLE)]
+
+        start = time.time()
+        for key in keys:
+            f.putInCache(key, 0)
+        put = (time.time() - start) * 1e6 / SAMPLE
+
+        start = time.time()
+        for key in keys:
+            f.get(key)
+        get = (time.time() - start) * 1e6 / SAMPLE
+
+        return put, get
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    sizes = [int(i) for i in sys.argv[1:]] or [10000, 1000000, 5000000]
+    print('%10s %10s %12s %12s' % ('entries', 'shardDepth', 'put us', 'get us'))
+    for entries in sizes:
+        for shardDepth in (0, 2):
+            put, get = bench(entries, shardDepth)
+            print('%10d %10d %12.1f %12.1f' % (entries, shardDepth, put, get))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Hit latency and RSS of FsCache on a large entry, copying reads against
+mmap reads.
+
+Run from the repository root :
+
+    python bench/bench_fscache_mmap.py [megabytes]
+
+A large array (200 MB by default) is cached with the buffers serializer,
+then hit 10 times while every result is kept alive, as concurrent
+requests would. Copying reads allocate one copy per hit, mapped reads
+share the page cache.
+"""
+from __future__ import print_function
+
+import array
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'modularcache'))
+
+from fscache import FsCache
+
+HITS = 10
+
+
+def rss():
+    """
+    (resident, anonymous resident) sizes in MB, from /proc. Mapped file
+    pages are counted in the resident size of each mapping but are shared
+    page cache, the anonymous size is what the hits really allocate.
+    """
+    with open('/proc/self/statm') as statm:
+        fields = [int(i) for i in statm.read().split()]
+    page = os.sysconf('SC_PAGE_SIZE') / 2.0 ** 20
+    return fields[1] * page, (fields[1] - fields[2]) * page
+
+
+def bench(directory, value, mmapMinBytes):
+    """
+    Return (ms per hit, RSS growth, anonymous RSS growth in MB) for HITS
+    hits kept alive.
+    """
+    config = {'dir': directory, 'freq': '60', 'expirationdelay': '3600',
+              'serializer': 'buffers'}
+    if mmapMinBytes is not None:
+        config['mmapminbytes'] = str(mmapMinBytes)
+    f = FsCache(config)
+    key = ('big', (), ())
+    f.putInCache(key, value)
+    f.get(key)
+
+    before = rss()
+    start = time.time()
+    results = [f.get(key) for i in range(HITS)]
+    elapsed = (time.time() - start) * 1000 / HITS
+    # touch every page, like a reader would
+    for r in results:
+        step = 4096 // getattr(r, 'itemsize', 1)
+        for i in range(0, len(r), step):
+            r[i]
+    after = rss()
+    return elapsed, after[0] - before[0], after[1] - before[1]
+
+
+if __name__ == "__main__":
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    value = array.array('d', [0.5]) * (megabytes * 2 ** 20 // 8)
+    directory = tempfile.mkdtemp(prefix='fscache-bench-')
+    try:
+        print('%-8s %12s %14s %14s' % ('read', 'ms per hit', 'RSS MB', 'anon RSS MB'))
+        for label, threshold in (('copy', None), ('mmap', 1 << 20)):
+            elapsed, growth, anonymous = bench(directory, value, threshold)
+            print('%-8s %12.2f %14.1f %14.1f' % (label, elapsed, growth, anonymous))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Batch lookups against one key at a time, for RamCache, RamLRUCache and
+FsCache.
+
+Run from the repository root :
+
+    python bench/bench_getmany.py [keys]
+
+Set TMPDIR to measure FsCache on a given volume, parallel reads pay off
+most on network or cold storage.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'modularcache'))
+
+from fscache import FsCache
+from ramcache import RamCache
+from ramlrucache import RamLRUCache
+
+
+def bench(cache, keys, repeat):
+    """
+    Return (us per key one at a time, us per key in a batch).
+    """
+    cache.putMany([(key, range(100)) for key in keys])
+
+    start = time.time()
+    for i in range(repeat):
+        for key in keys:
+            cache.get(key)
+    single = time.time() - start
+
+    start = time.time()
+    for i in range(repeat):
+        cache.getMany(keys)
+    batch = time.time() - start
+
+    scale = 1e6 / (repeat * len(keys))
+    return single * scale, batch * scale
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    keys = [('f', (i,), ()) for i in range(count)]
+    directory = tempfile.mkdtemp(prefix='getmany-bench-')
+    try:
+        caches = [('RamCache', RamCache(), 200),
+                  ('RamLRUCache', RamLRUCache({'size': str(count)}), 200),
+                  ('FsCache', FsCache({'dir': directory, 'freq': '60',
+                                       'expirationdelay': '3600'}), 5)]
+        print('%-12s %14s %14s' % ('backend', 'us/key single', 'us/key batch'))
+        for name, cache, repeat in caches:
+            single, batch = bench(cache, keys, repeat)
+            print('%-12s %14.2f %14.2f' % (name, single, batch))
+    finally:
+        shutil.rmtree(directory)
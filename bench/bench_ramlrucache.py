@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""
+Hit latency of RamLRUCache for growing cache sizes.
+
+Run from the repository root :
+
+    python bench/bench_ramlrucache.py [size ...]
+
+Lookup, promotion and eviction are O(1), so the time per hit should stay
+flat from 1k to 1M entries.
+"""
+from __future__ import print_function
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'modularcache'))
+
+from abstractcache import MISS
+from cachekey import computeKey
+from ramlrucache import RamLRUCache
+
+
+def benchHits(size, hits=200000):
+    """
+    Fill a cache of `size` entries then time `hits` random hits.
+    Return the mean time per hit in microseconds.
+    """
+    r = RamLRUCache({'size': size})
+    stored = [computeKey('f', (i,), {}) for i in range(size)]
+    for i, key in enumerate(stored):
+        r.putInCache(key, i)
+
+    keys = [stored[random.randrange(size)] for _ in range(hits)]
+
+    start = time.time()
+    for key in keys:
+        if r.get(key) is MISS:
+            raise AssertionError('miss on %r' % (key,))
+    return (time.time() - start) * 1e6 / hits
+
+
+if __name__ == "__main__":
+    sizes = [int(i) for i in sys.argv[1:]] or [1000, 10000, 100000, 1000000]
+    print('%10s %12s' % ('entries', 'us/hit'))
+    for size in sizes:
+        print('%10d %12.3f' % (size, benchHits(size)))
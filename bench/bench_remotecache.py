@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+RemoteCache lookups one key at a time against pipelined batches, on a
+cacheserver started in this process.
+
+Run from the repository root :
+
+    python bench/bench_remotecache.py [keys] [address]
+
+address defaults to a free localhost port, give a Unix socket path to
+compare.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'modularcache'))
+
+from cacheserver import CacheServer
+from ramcache import RamCache
+from remotecache import RemoteCache
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    address = sys.argv[2] if len(sys.argv) > 2 else '127.0.0.1:0'
+
+    server = CacheServer(address, RamCache())
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        cache = RemoteCache({'address': server.address})
+        keys = [('f', (i,), ()) for i in range(count)]
+        cache.putMany([(key, range(100)) for key in keys])
+
+        start = time.time()
+        for key in keys:
+            cache.get(key)
+        single = time.time() - start
+
+        start = time.time()
+        cache.getMany(keys)
+        batch = time.time() - start
+
+        print('%-8s %14s' % ('', 'us/key'))
+        print('%-8s %14.2f' % ('single', single * 1e6 / count))
+        print('%-8s %14.2f' % ('batch', batch * 1e6 / count))
+        cache.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
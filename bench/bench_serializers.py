@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Size and speed of the FsCache serializers.
+
+Run from the repository root :
+
+    python bench/bench_serializers.py
+
+The 'protocol 0' column is the former FsCache format, cPickle.dump with
+its default protocol.
+"""
+from __future__ import print_function
+
+import array
+import cPickle
+import cStringIO
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'modularcache'))
+
+import serializers
+
+VALUES = [
+    ('bytes 1MB', os.urandom(1 << 20)),
+    ('list 100k floats', [i * 0.5 for i in range(100000)]),
+    ('array 100k doubles', array.array('d', range(100000))),
+    ('dict 10k', dict(('key%d' % i, [i, str(i)]) for i in range(10000))),
+]
+
+ROUNDS = 20
+
+
+def measure(write, read):
+    """
+    Return (size, write ms, read ms).
+    """
+    start = time.time()
+    for i in range(ROUNDS):
+        out = cStringIO.StringIO()
+        write(out)
+    writeMs = (time.time() - start) * 1000 / ROUNDS
+    data = out.getvalue()
+
+    start = time.time()
+    for i in range(ROUNDS):
+        read(cStringIO.StringIO(data))
+    readMs = (time.time() - start) * 1000 / ROUNDS
+    return len(data), writeMs, readMs
+
+
+if __name__ == "__main__":
+    print('%-20s %-12s %10s %10s %10s' % ('value', 'serializer', 'bytes', 'write ms', 'read ms'))
+    for label, value in VALUES:
+        rows = [('protocol 0', measure(lambda out: cPickle.dump(value, out), cPickle.load))]
+        for name in ('pickle', 'marshal', 'buffers'):
+            serializer = serializers.getSerializer(name)
+            rows.append((name, measure(lambda out: serializers.dump(value, out, serializer),
+                                       serializers.load)))
+        for name, (size, writeMs, readMs) in rows:
+            print('%-20s %-12s %10d %10.2f %10.2f' % (label, name, size, writeMs, readMs))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Put throughput of SqliteCache with batched writes against one commit per
+put, and of FsCache for reference.
+
+Run from the repository root :
+
+    python bench/bench_sqlitecache.py [puts]
+
+Set TMPDIR to measure a given volume.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'modularcache'))
+
+from fscache import FsCache
+from sqlitecache import SqliteCache
+
+
+def benchSqlite(puts, batchSize):
+    """
+    Return puts per second, until all are written.
+    """
+    directory = tempfile.mkdtemp(prefix='sqlitecache-bench-')
+    try:
+        s = SqliteCache({'file': os.path.join(directory, 'cache.db'), 'freq': '60',
+                         'expirationdelay': '3600', 'batchsize': str(batchSize)})
+        start = time.time()
+        for i in range(puts):
+            s.putInCache(('f', (i,), ()), {'id': i})
+            if len(s._pending) >= batchSize:
+                s.flush()
+        s.flush()
+        return puts / (time.time() - start)
+    finally:
+        shutil.rmtree(directory)
+
+
+def benchFs(puts):
+    directory = tempfile.mkdtemp(prefix='fscache-bench-')
+    try:
+        f = FsCache({'dir': directory, 'freq': '60', 'expirationdelay': '3600'})
+        start = time.time()
+        for i in range(puts):
+            f.putInCache(('f', (i,), ()), {'id': i})
+        return puts / (time.time() - start)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    puts = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    print('%-24s %12s' % ('backend', 'puts/s'))
+    print('%-24s %12.0f' % ('sqlite, commit per put', benchSqlite(puts, 1)))
+    print('%-24s %12.0f' % ('sqlite, batches of 500', benchSqlite(puts, 500)))
+    print('%-24s %12.0f' % ('fscache', benchFs(puts)))
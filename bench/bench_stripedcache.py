@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Multi-threaded stress of the RAM backends, with and without striping.
+
+Run from the repository root :
+
+    python bench/bench_stripedcache.py [threads ...]
+
+Each thread does a 90% get / 10% put mix on a shared cache; the total
+ops/sec is reported per thread count for one lock (stripes = 1) and for
+lock striping.
+"""
+from __future__ import print_function
+
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'modularcache'))
+
+from ramcache import RamCache
+from ramlrucache import RamLRUCache
+from timelimitedramcache import TimeLimitedRamCache
+from stripedcache import StripedCache
+
+OPS = 50000
+KEYS = 10000
+
+BACKENDS = [
+    (RamCache, {'module': 'RamCache'}),
+    (RamLRUCache, {'module': 'RamLRUCache', 'size': '5000'}),
+    (TimeLimitedRamCache, {'module': 'TimeLimitedRamCache', 'duration': '60'}),
+]
+
+
+def worker(cache, seed):
+    rnd = random.Random(seed)
+    for i in range(OPS):
+        key = ('f', (rnd.randrange(KEYS),), ())
+        if rnd.random() < 0.9:
+            cache.get(key)
+        else:
+            cache.putInCache(key, i)
+
+
+def run(cache, nThreads):
+    """
+    Return the ops/sec of nThreads threads hammering cache.
+    """
+    threads = [threading.Thread(target=worker, args=(cache, i))
+               for i in range(nThreads)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return OPS * nThreads / (time.time() - start)
+
+
+if __name__ == "__main__":
+    counts = [int(i) for i in sys.argv[1:]] or [1, 2, 4, 8, 16]
+    print('%-20s %8s %14s %14s' % ('backend', 'threads', '1 stripe', '16 stripes'))
+    for backend, config in BACKENDS:
+        for n in counts:
+            single = StripedCache(backend, dict(config, stripes='1'))
+            striped = StripedCache(backend, dict(config, stripes='16'))
+            print('%-20s %8d %14.0f %14.0f' % (backend.__name__, n,
+                                               run(single, n), run(striped, n)))
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+Hit latency of a RamLRUCache over FsCache TieredCache, against each tier.
+
+Run from the repository root :
+
+    python bench/bench_tieredcache.py [hits]
+
+Once promoted, a key is served by the RAM tier, so a tiered hit should
+cost about a RAM hit, far below a disk hit.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'modularcache'))
+
+from cachedict import CacheDict
+from fscache import FsCache
+from ramlrucache import RamLRUCache
+from tieredcache import TieredCache
+
+
+def benchHits(get, hits):
+    """
+    Return the best mean time per hit of get, in microseconds.
+    """
+    return min(timeit.repeat(get, number=hits, repeat=3)) * 1e6 / hits
+
+
+if __name__ == "__main__":
+    hits = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    cd = CacheDict()
+    cd['ramlru'] = RamLRUCache({'size': '100'})
+    cd['fscache'] = FsCache({'dir': tempfile.mkdtemp(), 'freq': '60',
+                             'expirationdelay': '600'})
+    tiered = TieredCache({'tiers': 'ramlru, fscache'})
+    key = ('f', (1, 2), ())
+    cd['fscache'].putInCache(key, list(range(100)))
+    tiered.get(key)
+
+    print('%-10s %12s' % ('cache', 'us/hit'))
+    for name, get in [('disk', lambda: cd['fscache'].get(key)),
+                      ('ram', lambda: cd['ramlru'].get(key)),
+                      ('tiered', lambda: tiered.get(key))]:
+        print('%-10s %12.3f' % (name, benchHits(get, hits)))
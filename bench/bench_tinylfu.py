@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Hit ratio of RamTinyLFUCache against RamLRUCache, replaying a key trace.
+
+Run from the repository root :
+
+    python bench/bench_tinylfu.py [size] [trace file]
+
+A trace file has one key per line, as recorded from production lookups.
+Without one, a synthetic trace is replayed : zipf distributed lookups over
+a working set, interrupted by scans of one-off keys like a batch job.
+"""
+from __future__ import print_function
+
+import bisect
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'modularcache'))
+
+from abstractcache import MISS
+from ramlrucache import RamLRUCache
+from ramtinylfucache import RamTinyLFUCache
+
+
+def zipfTrace(lookups, keys, scanEvery, scanLength, skew=0.9, seed=1):
+    random.seed(seed)
+    total = 0.0
+    cumulative = []
+    for rank in range(1, keys + 1):
+        total += 1.0 / rank ** skew
+        cumulative.append(total)
+
+    scanned = 0
+    for i in range(lookups):
+        if scanEvery and i % scanEvery == 0 and i:
+            for j in range(scanLength):
+                yield 'scan-%d' % scanned
+                scanned += 1
+        yield 'key-%d' % bisect.bisect(cumulative, random.random() * total)
+
+
+def fileTrace(path):
+    with open(path) as trace:
+        for line in trace:
+            yield line.strip()
+
+
+def replay(cache, trace):
+    hits = lookups = 0
+    for key in trace:
+        lookups += 1
+        if cache.get(key) is MISS:
+            cache.putInCache(key, True)
+        else:
+            hits += 1
+    return float(hits) / lookups
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    if len(sys.argv) > 2:
+        traces = [(sys.argv[2], lambda: fileTrace(sys.argv[2]))]
+    else:
+        traces = [('zipf', lambda: zipfTrace(200000, 20 * size, 0, 0)),
+                  ('zipf + scans', lambda: zipfTrace(200000, 20 * size, 20000, 5 * size))]
+
+    print('%-14s %12s %16s' % ('trace', 'RamLRUCache', 'RamTinyLFUCache'))
+    for name, trace in traces:
+        lru = replay(RamLRUCache({'size': size}), trace())
+        tinyLfu = replay(RamTinyLFUCache({'size': size}), trace())
+        print('%-14s %12.3f %16.3f' % (name, lru, tinyLfu))
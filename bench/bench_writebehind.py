@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Caller side latency of FsCache puts, written in the caller thread or by
+write behind workers.
+
+Run from the repository root :
+
+    python bench/bench_writebehind.py [puts]
+
+Set TMPDIR to measure a given volume, add fsync to pay a durable write.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'modularcache'))
+
+from fscache import FsCache
+from writebehind import WriteBehindCache
+
+
+def bench(puts, writeBehind, fsync):
+    """
+    Return (us per put in the caller, us per put until all are written).
+    """
+    directory = tempfile.mkdtemp(prefix='writebehind-bench-')
+    try:
+        config = {'dir': directory, 'freq': '60', 'expirationdelay': '3600',
+                  'fsync': str(fsync)}
+        cache = FsCache(config)
+        if writeBehind:
+            config.update({'writebehind': 'yes', 'writebehindsize': str(puts),
+                           'writebehindworkers': '4'})
+            cache = WriteBehindCache(cache, config)
+
+        start = time.time()
+        for i in range(puts):
+            cache.putInCache(('f', (i,), ()), range(100))
+        caller = time.time() - start
+        if writeBehind:
+            cache.flush()
+        return caller * 1e6 / puts, (time.time() - start) * 1e6 / puts
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    puts = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    fsync = 'fsync' in sys.argv[2:]
+    print('%-14s %16s %16s' % ('put', 'us in caller', 'us until written'))
+    for writeBehind in (False, True):
+        caller, written = bench(puts, writeBehind, fsync)
+        print('%-14s %16.1f %16.1f' % (writeBehind and 'write behind' or 'synchronous',
+                                       caller, written))
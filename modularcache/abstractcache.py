@@ -1,23 +1,113 @@
 #!/usr/bin/env path
 
+from singleflight import SingleFlight
+from stats import Stats
+
+class _Miss(object):
+    """
+    Sentinel returned by AbstractCache.get on a miss.
+
+    >>> MISS
+    MISS
+    """
+
+    def __repr__(self):
+        return 'MISS'
+
+MISS = _Miss()
+
+
 class AbstractCache(object):
     """
-    TODO
+    Base class of cache backends.
+
+    Backends take a key prebuilt once per call by cachekey.computeKey.
     """
 
-    def __init__(self):
-        pass
+    # True for backends doing I/O, run in an executor by coroutine callers
+    blocking = False
+
+    def __init__(self, config=None):
+        """
+        config : the Cache_* section, for the options shared by every
+        backend.
 
-    def isCached(self, func, *args, **kwargs):
+        >>> AbstractCache().singleFlight is None
+        True
+        >>> AbstractCache({'singleflight': 'true'}).singleFlight #doctest: +ELLIPSIS
+        <singleflight.SingleFlight object at 0x...>
+        >>> AbstractCache().stats #doctest: +ELLIPSIS
+        <stats.Stats object at 0x...>
+        >>> AbstractCache({'stats': 'off'}).stats is None
+        True
+        """
+        self.singleFlight = SingleFlight.fromConfig(config)
+        self.stats = Stats.fromConfig(config)
+
+    def get(self, key, default=MISS):
+        """
+        Return the cached result or default, in a single lookup.
+
+        Backends override it; this fallback goes through isCached and
+        cached.
+
+        >>> a = AbstractCache()
+        >>> a.get(('a', (), ()))
+        MISS
+        >>> a.get(('a', (), ()), None) is None
+        True
+        """
+        if self.isCached(key):
+            return self.cached(key)
+        return default
+
+    def isCached(self, key):
         pass
 
-    def cached(self, func, *args, **kwargs):
+    def cached(self, key):
         pass
 
-    def putInCache(self, func, result, *args, **kwargs):
+    def putInCache(self, key, result, ttl=None):
+        """
+        Put result in cache and return it. ttl, in seconds, overrides the
+        expiry of the section for this entry when the backend has one.
+        """
         pass
     
+    def getMany(self, keys, default=MISS):
+        """
+        Return the results of keys, in order, default for the missing ones.
+
+        Backends with a faster batch path override it.
+
+        >>> class Stub(AbstractCache):
+        ...     def get(self, key, default=MISS):
+        ...         return {('a', (1,), ()): 3}.get(key, default)
+        >>> Stub().getMany([('a', (1,), ()), ('a', (2,), ())])
+        [3, MISS]
+        """
+        return [self.get(key, default) for key in keys]
+
+    def putMany(self, items, ttl=None):
+        """
+        Put (key, result) pairs in cache.
+
+        >>> puts = []
+        >>> class Stub(AbstractCache):
+        ...     def putInCache(self, key, result, ttl=None):
+        ...         puts.append((key, result, ttl))
+        >>> Stub().putMany([(('a', (1,), ()), 3), (('a', (2,), ()), 4)], 10)
+        >>> puts
+        [(('a', (1,), ()), 3, 10), (('a', (2,), ()), 4, 10)]
+        """
+        for key, result in items:
+            self.putInCache(key, result, ttl)
+
     @staticmethod
     def checkConf(config):
         pass
     
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
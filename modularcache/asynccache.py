@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+"""
+Cache decorator for coroutine functions, used by modularcache.cache.
+
+Written with callbacks rather than async/await so the package still
+compiles on python 2, where there is no asyncio and this module is unused.
+The doctests of this module run on python 3, from a configuration file.
+"""
+
+import functools
+import time
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+from abstractcache import MISS
+from cachedict import CacheDict
+from cachekey import computeKey
+from revalidate import Stamped
+
+
+# (loop, selector, key) -> future shared by the awaiters of a lookup
+_flights = {}
+# (loop, selector, key) of the stale results being refreshed
+_refreshes = set()
+
+
+def isCoroutineFunction(fctn):
+    """
+    True for an async def function.
+
+    >>> isCoroutineFunction(len)
+    False
+    """
+    return asyncio is not None and asyncio.iscoroutinefunction(fctn)
+
+
+def cacheCoroutine(selector, fctn, ttl=None, staleTtl=None):
+    """
+    Wrap a coroutine function : calls return an awaitable of the cached
+    result.
+
+    Concurrent calls with the same arguments share one lookup, and one
+    computation on a miss. Backends with blocking I/O, like FsCache, run
+    in the default executor of the loop.
+
+    >>> import threading
+    >>> from ramcache import RamCache
+    >>> class DiskCache(RamCache):
+    ...     blocking = True
+    ...     def get(self, key, default=MISS):
+    ...         threads.add(threading.current_thread().name)
+    ...         return RamCache.get(self, key, default)
+    >>> threads = set()
+    >>> cd = CacheDict()
+    >>> cd['disk'] = DiskCache()
+    >>> calls = []
+    >>> async def slow(a):
+    ...     calls.append(a)
+    ...     await asyncio.sleep(0.1)
+    ...     return a * 2
+    >>> cached = cacheCoroutine('disk', slow)
+    >>> async def call(fctn, *args):
+    ...     return await fctn(*args)
+    >>> async def main():
+    ...     return await asyncio.gather(*[cached(21) for i in range(50)])
+    >>> asyncio.run(main()) == [42] * 50
+    True
+    >>> calls
+    [21]
+    >>> threading.main_thread().name in threads
+    False
+    >>> asyncio.run(call(cached, 21))
+    42
+    >>> calls
+    [21]
+    >>> _flights
+    {}
+    >>> stats = cd['disk'].stats.snapshot()
+    >>> stats['hits'], stats['misses'], stats['puts']
+    (1, 1, 1)
+
+    Errors reach every awaiter and are not cached.
+
+    >>> async def fail():
+    ...     calls.append('fail')
+    ...     raise ValueError('boom')
+    >>> cached = cacheCoroutine('disk', fail)
+    >>> asyncio.run(call(cached))
+    Traceback (most recent call last):
+    ...
+    ValueError: boom
+    >>> asyncio.run(call(cached))
+    Traceback (most recent call last):
+    ...
+    ValueError: boom
+    >>> calls.count('fail')
+    2
+
+    With a ttl, a stale result is returned at once while it is refreshed.
+
+    >>> cd['ram'] = RamCache()
+    >>> values = iter(range(10))
+    >>> async def counter():
+    ...     return next(values)
+    >>> cached = cacheCoroutine('ram', counter, ttl=0.1, staleTtl=1)
+    >>> async def twice():
+    ...     first = await cached()
+    ...     await asyncio.sleep(0.2)
+    ...     stale = await cached()
+    ...     await asyncio.sleep(0.05)
+    ...     return first, stale, await cached()
+    >>> asyncio.run(twice())
+    (0, 0, 1)
+
+    The sections of a configuration file, through modularcache.cache.
+
+    >>> from modularcache import cache
+    >>> from modularcacheconfig import ModularCacheConfig
+    >>> m = ModularCacheConfig('test/tiered.ini')
+    >>> cd = CacheDict.getInstance()
+    >>> @cache('tiered')
+    ... async def triple(a):
+    ...     calls.append(a)
+    ...     return a * 3
+    >>> asyncio.run(call(triple, 2)), asyncio.run(call(triple, 2)), calls.count(2)
+    (6, 6, 1)
+    >>> cd['fscache'].get(computeKey('triple', (2,), {}))
+    6
+    >>> cd['fscache'].stop()
+    >>> cd['fscache'].join()
+    """
+    @functools.wraps(fctn)
+    def __cache(*args, **kwargs):
+        cd = CacheDict.getInstance()
+        if cd is None or selector not in cd:
+            return fctn(*args, **kwargs)
+        return _Awaitable(functools.partial(_start, cd[selector], selector, fctn,
+                                            args, kwargs, ttl, staleTtl))
+
+    return __cache
+
+
+class _Awaitable(object):
+    """
+    Like a coroutine, starts when awaited.
+    """
+
+    def __init__(self, start):
+        self._start = start
+
+    def __await__(self):
+        return self._start().__await__()
+
+
+def _start(c, selector, fctn, args, kwargs, ttl, staleTtl):
+    """
+    Return a future of the result, joining the flight of the same call.
+    """
+    loop = asyncio.get_event_loop()
+    key = computeKey(fctn.__name__, args, kwargs)
+    flightKey = (loop, selector, key)
+
+    future = _flights.get(flightKey)
+    if future is None:
+        future = _flights[flightKey] = loop.create_future()
+        future.add_done_callback(lambda f: _flights.pop(flightKey, None))
+        _Flight(loop, c, flightKey, fctn, args, kwargs, ttl, staleTtl, future).lookup()
+    # an awaiter cancelled does not cancel the others
+    return asyncio.shield(future)
+
+
+class _Flight(object):
+    """
+    One lookup, and computation on a miss, chained by callbacks.
+    """
+
+    def __init__(self, loop, c, flightKey, fctn, args, kwargs, ttl, staleTtl, future):
+        self.loop = loop
+        self.c = c
+        self.flightKey = flightKey
+        self.key = flightKey[2]
+        self.fctn = fctn
+        self.args = args
+        self.kwargs = kwargs
+        self.ttl = ttl
+        self.staleTtl = staleTtl
+        self.future = future
+
+    def _call(self, method, args, then):
+        """
+        then(method(*args)), in the executor for a blocking backend.
+        """
+        if not self.c.blocking:
+            try:
+                result = method(*args)
+            except Exception as e:
+                return self._fail(e)
+            return then(result)
+
+        def done(f):
+            if f.exception() is not None:
+                return self._fail(f.exception())
+            then(f.result())
+        self.loop.run_in_executor(None, functools.partial(method, *args)).add_done_callback(done)
+
+    def _succeed(self, result):
+        if not self.future.done():
+            self.future.set_result(result)
+
+    def _fail(self, error):
+        if not self.future.done():
+            self.future.set_exception(error)
+
+    def _observe(self, timer, start):
+        if self.c.stats is not None:
+            self.c.stats.observe(timer, time.time() - start)
+
+    def _incr(self, counter):
+        if self.c.stats is not None:
+            self.c.stats.incr(counter)
+
+    def lookup(self):
+        self.start = time.time()
+        self._call(self.c.get, (self.key,), self._looked)
+
+    def _looked(self, result):
+        self._observe('lookup', self.start)
+        if result is not MISS and self.ttl is not None:
+            now = time.time()
+            if result.isFresh(now):
+                self._incr('hits')
+                return self._succeed(result.value)
+            if now < result.freshUntil + (self.staleTtl or 0):
+                self._incr('hits')
+                self._succeed(result.value)
+                return self._refresh()
+            result = MISS
+        if result is MISS:
+            self._incr('misses')
+            return self.compute()
+        self._incr('hits')
+        self._succeed(result)
+
+    def _refresh(self):
+        """
+        Compute again in background, once per key at a time.
+        """
+        if self.flightKey in _refreshes:
+            return
+        _refreshes.add(self.flightKey)
+        future = self.loop.create_future()
+
+        def done(f):
+            _refreshes.discard(self.flightKey)
+            # the stale value is served until it expires
+            f.exception()
+        future.add_done_callback(done)
+        _Flight(self.loop, self.c, self.flightKey, self.fctn, self.args, self.kwargs,
+                self.ttl, self.staleTtl, future).compute()
+
+    def compute(self):
+        self.start = time.time()
+        task = asyncio.ensure_future(self.fctn(*self.args, **self.kwargs), loop=self.loop)
+        task.add_done_callback(self._computed)
+
+    def _computed(self, task):
+        if task.cancelled():
+            return self._fail(asyncio.CancelledError())
+        if task.exception() is not None:
+            self._incr('errors')
+            return self._fail(task.exception())
+
+        self._observe('compute', self.start)
+        self.start = time.time()
+        result = task.result()
+        if self.ttl is None:
+            args = (self.key, result)
+        else:
+            args = (self.key, Stamped(result, time.time() + self.ttl),
+                    self.ttl + (self.staleTtl or 0))
+        self._call(self.c.putInCache, args, lambda stored: self._stored(result))
+
+    def _stored(self, result):
+        self._observe('store', self.start)
+        self._incr('puts')
+        self._succeed(result)
+
+
+if __name__ == "__main__":
+    if asyncio is not None:
+        import doctest
+        doctest.testmod()
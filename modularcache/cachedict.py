@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import stats as _stats
+
 
 class CacheDict(dict, object):
     """
@@ -36,6 +38,51 @@ class CacheDict(dict, object):
         """
         return CacheDict._instance
 
+    def stats(self):
+        """
+        Return {section: counters and latencies} of the sections recording
+        stats.
+
+        >>> from ramcache import RamCache
+        >>> cd = CacheDict()
+        >>> cd['ram'] = RamCache()
+        >>> cd['quiet'] = RamCache({'stats': 'off'})
+        >>> cd['ram'].stats.incr('hits')
+        >>> cd.stats().keys()
+        ['ram']
+        >>> cd.stats()['ram']['hits']
+        1
+
+        Sections with a byte budget report their memory use.
+
+        >>> cd['ram'] = RamCache({'maxbytes': '1000000', 'sizer': 'getsizeof'})
+        >>> _ = cd['ram'].putInCache(('a', (), ()), 'x' * 1000)
+        >>> cd.stats()['ram']['bytes'] > 1000
+        True
+        """
+        sections = {}
+        for section, cache in self.items():
+            if getattr(cache, 'stats', None) is None:
+                continue
+            sections[section] = cache.stats.snapshot()
+            memoryBytes = getattr(cache, 'memoryBytes', None)
+            if memoryBytes is not None and memoryBytes() is not None:
+                sections[section]['bytes'] = memoryBytes()
+        return sections
+
+    def dumpStats(self, format='text'):
+        """
+        Return the stats as 'text' or 'json'.
+
+        >>> from ramcache import RamCache
+        >>> cd = CacheDict()
+        >>> cd['ram'] = RamCache()
+        >>> print(cd.dumpStats())
+        [ram]
+          hits 0  misses 0  puts 0  evictions 0  expirations 0  errors 0
+        """
+        return _stats.dumps(self.stats(), format)
+
  
     
 if __name__ == "__main__":
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import hashlib
+
+
+def computeKey(func, args, kwargs):
+    """
+    Build the cache key of a call, once per decorated call.
+
+    Hashable arguments give a plain tuple, kwargs sorted by name, then the
+    types of the arguments.
+
+    >>> computeKey('a', (1, 2), {})
+    ('a', (1, 2), (), (<type 'int'>, <type 'int'>))
+    >>> computeKey('a', (1,), {'c': 3, 'b': 2})
+    ('a', (1,), (('b', 2), ('c', 3)), (<type 'int'>, <type 'int'>, <type 'int'>))
+    >>> computeKey('a', (1,), {'c': 3, 'b': 2}) == computeKey('a', (1,), {'b': 2, 'c': 3})
+    True
+
+    Equal values of different types, like 1, 1.0 and True, give different
+    keys : the result may depend on the type.
+
+    >>> len(set([computeKey('a', (1,), {}), computeKey('a', (1.0,), {}),
+    ...          computeKey('a', (True,), {})]))
+    3
+    >>> computeKey('a', (), {'b': 1}) == computeKey('a', (), {'b': 1.0})
+    False
+
+    Unhashable arguments fall back on a stable serialization.
+
+    >>> computeKey('a', ([1, 2], {'y': 2, 'x': 1}), {})
+    ('a', "([1, 2], {'x': 1, 'y': 2})", '()')
+    >>> hash(computeKey('a', ([1, 2],), {'b': [3]})) is not None
+    True
+    """
+    kwargs = tuple(sorted(kwargs.items()))
+    key = (func, args, kwargs,
+           tuple(map(type, args)) + tuple(type(value) for name, value in kwargs))
+    try:
+        hash(key)
+    except TypeError:
+        key = (func, serialize(args), serialize(kwargs))
+    return key
+
+
+def digestKey(key):
+    """
+    Return a stable sha1 hexdigest of a key, usable as a filename.
+
+    >>> digestKey(('a', (1, 2), ()))
+    '19aecb3c9bf4be4a4a7d0d5735b0c33cc08b605a'
+    >>> digestKey(computeKey('a', (1,), {})) == digestKey(computeKey('a', (1.0,), {}))
+    False
+    """
+    text = serialize(key)
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
+
+
+def serialize(obj):
+    """
+    Stable text serialization : dicts and sets are sorted so that equal
+    values always give the same text, whatever the hash order.
+
+    >>> serialize({'b': 1, 'a': [1, (2, 3)]})
+    "{'a': [1, (2, 3)], 'b': 1}"
+    >>> serialize(set([3, 1, 2]))
+    'set([1, 2, 3])'
+    >>> serialize((1,))
+    '(1,)'
+    """
+    if isinstance(obj, dict):
+        items = sorted((serialize(k), serialize(v)) for k, v in obj.items())
+        return '{%s}' % ', '.join('%s: %s' % item for item in items)
+    if isinstance(obj, (set, frozenset)):
+        return '%s([%s])' % (type(obj).__name__,
+                             ', '.join(sorted(serialize(i) for i in obj)))
+    if isinstance(obj, list):
+        return '[%s]' % ', '.join(serialize(i) for i in obj)
+    if isinstance(obj, tuple):
+        if len(obj) == 1:
+            return '(%s,)' % serialize(obj[0])
+        return '(%s)' % ', '.join(serialize(i) for i in obj)
+    return repr(obj)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+Cache server, shared by the RemoteCache sections of several hosts.
+
+    python cacheserver.py <config file> <section> <address>
+
+The server stores in the Cache_<section> section of the config file,
+a TimeLimitedRamCache with maxBytes for instance, and listens on
+address : host:port, or the path of a Unix socket.
+
+Protocol : a request is a header (opcode, count, ttl) followed by count
+items, the reply a header (status, count) followed by count items for a
+get. Requests of a connection are answered in order, so a client can
+send several before reading the replies.
+
+    get  request items : key sha1 (20 bytes)
+         reply items   : payload length, MISSING when not cached, payload
+    put  request items : key sha1, payload length, payload
+         ttl           : seconds, negative for the expiry of the section
+
+Payloads are the serialized results : the server never loads them. A
+request with more than MAX_COUNT items or a payload longer than
+MAX_LENGTH gets an ERROR reply, before the server reads its items, and
+ends the connection.
+"""
+
+import os
+import socket
+import struct
+import sys
+
+try:
+    import SocketServer
+except ImportError:
+    import socketserver as SocketServer
+
+from abstractcache import MISS
+
+
+GET = 1
+PUT = 2
+
+OK = 0
+ERROR = 1
+
+_REQUEST = struct.Struct('<BId')
+_REPLY = struct.Struct('<BI')
+_LENGTH = struct.Struct('<I')
+MISSING = 0xffffffff
+DIGEST_SIZE = 20
+
+MAX_COUNT = 10000
+MAX_LENGTH = 64 * 1024 * 1024
+
+
+def parseAddress(address):
+    """
+    Return (family, address) of host:port or a Unix socket path.
+
+    >>> parseAddress('127.0.0.1:11311') == (socket.AF_INET, ('127.0.0.1', 11311))
+    True
+    >>> parseAddress('/tmp/cache.sock') == (socket.AF_UNIX, '/tmp/cache.sock')
+    True
+    >>> parseAddress('localhost:port')
+    Traceback (most recent call last):
+    ...
+    BadAddress: localhost:port
+    """
+    if address.startswith('/') or ':' not in address:
+        return socket.AF_UNIX, address
+    host, _, port = address.rpartition(':')
+    try:
+        return socket.AF_INET, (host, int(port))
+    except ValueError:
+        raise BadAddress(address)
+
+
+def readExactly(stream, size):
+    """
+    Read size bytes, EOFError when the connection ends before.
+    """
+    data = stream.read(size)
+    if len(data) < size:
+        raise EOFError('connection closed')
+    return data
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+    """
+    Answer the requests of one connection.
+    """
+
+    def setup(self):
+        SocketServer.StreamRequestHandler.setup(self)
+        if self.server.address_family == socket.AF_INET:
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        try:
+            while True:
+                header = self.rfile.read(_REQUEST.size)
+                if not header:
+                    return
+                if len(header) < _REQUEST.size:
+                    raise EOFError('connection closed')
+                opcode, count, ttl = _REQUEST.unpack(header)
+                if count > self.server.maxCount:
+                    raise BadRequest('%d items' % count)
+                if opcode == GET:
+                    self._get(count)
+                elif opcode == PUT:
+                    self._put(count, None if ttl < 0 else ttl)
+                else:
+                    raise BadRequest('opcode %d' % opcode)
+        except BadRequest:
+            self.wfile.write(_REPLY.pack(ERROR, 0))
+        except (EOFError, socket.error):
+            return
+
+    def _get(self, count):
+        data = readExactly(self.rfile, DIGEST_SIZE * count)
+        digests = [data[i:i + DIGEST_SIZE] for i in range(0, len(data), DIGEST_SIZE)]
+        cache = self.server.cache
+
+        reply = [_REPLY.pack(OK, count)]
+        hits = 0
+        for payload in cache.getMany(digests, MISS):
+            if payload is MISS:
+                reply.append(_LENGTH.pack(MISSING))
+            else:
+                hits += 1
+                reply.append(_LENGTH.pack(len(payload)))
+                reply.append(payload)
+        if cache.stats is not None:
+            cache.stats.incr('hits', hits)
+            cache.stats.incr('misses', count - hits)
+        self.wfile.write(b''.join(reply))
+
+    def _put(self, count, ttl):
+        items = []
+        for i in range(count):
+            digest = readExactly(self.rfile, DIGEST_SIZE)
+            length = _LENGTH.unpack(readExactly(self.rfile, _LENGTH.size))[0]
+            if length > self.server.maxLength:
+                raise BadRequest('payload of %d bytes' % length)
+            items.append((digest, readExactly(self.rfile, length)))
+        cache = self.server.cache
+        cache.putMany(items, ttl)
+        if cache.stats is not None:
+            cache.stats.incr('puts', count)
+        self.wfile.write(_REPLY.pack(OK, count))
+
+
+class CacheServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """
+    Serve cache on address, one thread per connection.
+
+    >>> from ramcache import RamCache
+    >>> import threading
+    >>> server = CacheServer('127.0.0.1:0', RamCache())
+    >>> server.address #doctest: +ELLIPSIS
+    '127.0.0.1:...'
+    >>> thread = threading.Thread(target=server.serve_forever)
+    >>> thread.start()
+
+    A put then a get, sent before reading any reply.
+
+    >>> client = socket.create_connection(server.server_address)
+    >>> client.sendall(_REQUEST.pack(PUT, 1, -1) + 'k' * 20 + _LENGTH.pack(5) + 'hello'
+    ...                + _REQUEST.pack(GET, 2, -1) + 'k' * 20 + 'x' * 20)
+    >>> replies = client.makefile('rb')
+    >>> _REPLY.unpack(replies.read(_REPLY.size))
+    (0, 1)
+    >>> _REPLY.unpack(replies.read(_REPLY.size))
+    (0, 2)
+    >>> length = _LENGTH.unpack(replies.read(4))[0]
+    >>> replies.read(length), _LENGTH.unpack(replies.read(4))[0] == MISSING
+    ('hello', True)
+
+    An unknown opcode ends the connection.
+
+    >>> client.sendall(_REQUEST.pack(9, 0, -1))
+    >>> _REPLY.unpack(replies.read(_REPLY.size)), replies.read(1)
+    ((1, 0), '')
+    >>> client.close()
+
+    So do too many items or a too long payload, before their bytes are
+    read.
+
+    >>> server.maxCount, server.maxLength = 2, 5
+    >>> rejected = []
+    >>> for request in [_REQUEST.pack(GET, 3, -1),
+    ...                 _REQUEST.pack(PUT, 1, -1) + 'k' * 20 + _LENGTH.pack(6)]:
+    ...     client = socket.create_connection(server.server_address)
+    ...     client.sendall(request)
+    ...     replies = client.makefile('rb')
+    ...     rejected.append((_REPLY.unpack(replies.read(_REPLY.size)), replies.read(1)))
+    ...     client.close()
+    >>> rejected
+    [((1, 0), ''), ((1, 0), '')]
+    >>> server.shutdown()
+    >>> server.server_close()
+    >>> thread.join()
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, cache, maxCount=MAX_COUNT, maxLength=MAX_LENGTH):
+        self.address_family, serverAddress = parseAddress(address)
+        if self.address_family == socket.AF_UNIX and os.path.exists(serverAddress):
+            os.remove(serverAddress)
+        SocketServer.TCPServer.__init__(self, serverAddress, _Handler)
+        self.cache = cache
+        self.maxCount = maxCount
+        self.maxLength = maxLength
+
+    @property
+    def address(self):
+        """
+        The address listened on, with the actual port when 0 was asked.
+        """
+        if self.address_family == socket.AF_UNIX:
+            return self.server_address
+        return '%s:%d' % self.server_address[:2]
+
+
+class BadAddress(Exception):
+    """
+    >>> BadAddress('foo')
+    BadAddress('foo',)
+    """
+    pass
+
+
+class BadRequest(Exception):
+    """
+    >>> BadRequest('foo')
+    BadRequest('foo',)
+    """
+    pass
+
+
+def main(argv):
+    from cachedict import CacheDict
+    from modularcacheconfig import ModularCacheConfig
+
+    if len(argv) != 4:
+        sys.stderr.write('usage : %s <config file> <section> <address>\n' % argv[0])
+        return 2
+    ModularCacheConfig(argv[1])
+    server = CacheServer(argv[3], CacheDict.getInstance()[argv[2]])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main(sys.argv))
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+monotonic() : seconds of a clock that never goes backward, for expiry
+deadlines.
+
+>>> a = monotonic()
+>>> b = monotonic()
+>>> b >= a
+True
+"""
+
+import sys
+import time
+
+
+def _linuxMonotonic():
+    """
+    Return a monotonic clock built on clock_gettime(CLOCK_MONOTONIC).
+    """
+    import ctypes
+    import ctypes.util
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    lib = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'))
+    clock_gettime = lib.clock_gettime
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    CLOCK_MONOTONIC = 1
+
+    def monotonic():
+        t = timespec()
+        clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t))
+        return t.tv_sec + t.tv_nsec * 1e-9
+
+    return monotonic
+
+
+try:
+    from time import monotonic
+except ImportError:
+    # python 2 : no monotonic clock in the standard library
+    monotonic = time.time
+    if sys.platform.startswith('linux'):
+        try:
+            monotonic = _linuxMonotonic()
+        except (OSError, AttributeError, TypeError):
+            pass
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
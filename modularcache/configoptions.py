@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+from exceptionconfig import BadOptionValue
+
+_BOOLEANS = {'1': True, 'yes': True, 'true': True, 'on': True,
+             '0': False, 'no': False, 'false': False, 'off': False}
+
+
+def getBoolean(config, option, default=False):
+    """
+    Read a boolean option of a Cache_* section.
+
+    >>> getBoolean({'singleflight': 'True'}, 'singleflight')
+    True
+    >>> getBoolean({'singleflight': 'off'}, 'singleflight')
+    False
+    >>> getBoolean({}, 'singleflight')
+    False
+    >>> getBoolean({'singleflight': 'maybe'}, 'singleflight')
+    Traceback (most recent call last):
+    ...
+    BadOptionValue: singleflight must be a boolean
+    """
+    if config is None or option not in config:
+        return default
+    value = config[option]
+    if isinstance(value, bool):
+        return value
+    try:
+        return _BOOLEANS[str(value).strip().lower()]
+    except KeyError:
+        raise BadOptionValue('%s must be a boolean' % option)
+
+
+def getInteger(config, option, default=None):
+    """
+    Read an integer option of a Cache_* section.
+
+    >>> getInteger({'stripes': '16'}, 'stripes')
+    16
+    >>> getInteger({}, 'stripes', 1)
+    1
+    >>> getInteger({'stripes': 'a'}, 'stripes')
+    Traceback (most recent call last):
+    ...
+    BadOptionValue: stripes must be an integer
+    """
+    if config is None or option not in config:
+        return default
+    try:
+        return int(config[option])
+    except (TypeError, ValueError):
+        raise BadOptionValue('%s must be an integer' % option)
+
+
+def getNumber(config, option, default=None):
+    """
+    Read a number option of a Cache_* section.
+
+    >>> getNumber({'singleflighttimeout': '2.5'}, 'singleflighttimeout')
+    2.5
+    >>> getNumber({}, 'singleflighttimeout') is None
+    True
+    >>> getNumber({'singleflighttimeout': 'a'}, 'singleflighttimeout')
+    Traceback (most recent call last):
+    ...
+    BadOptionValue: singleflighttimeout must be a number
+    """
+    if config is None or option not in config:
+        return default
+    try:
+        return float(config[option])
+    except (TypeError, ValueError):
+        raise BadOptionValue('%s must be a number' % option)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -9,14 +9,14 @@ class DummyCache(AbstractCache):
     Fake Cache.
     """
     
-    def __init__(self):
+    def __init__(self, config=None):
         """
         Fake Cache.
 
         >>> DummyCache() #doctest: +ELLIPSIS
         <__main__.DummyCache object at 0x...>
         """
-        AbstractCache.__init__(self)
+        AbstractCache.__init__(self, config)
     
     @staticmethod
     def checkConf(config):
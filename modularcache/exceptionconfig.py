@@ -15,3 +15,6 @@ class IncoherentSectionConfig(Exception):
 
 class MissingConfigException(Exception):
     pass
+
+class BadOptionValue(Exception):
+    pass
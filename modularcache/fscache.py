@@ -1,22 +1,38 @@
 #!/usr/bin/env python
 
-import hashlib
+import errno
 import os
 import threading
-import glob
-import datetime
+import heapq
+import mmap
+import stat
+import tempfile
 import time
-import cPickle
 
-from abstractcache import AbstractCache
+from multiprocessing.pool import ThreadPool
+
+from abstractcache import AbstractCache, MISS
+from cachekey import digestKey
+from configoptions import getBoolean, getInteger
+import serializers
 from exceptionconfig import *
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
 
-class FsCache(threading.Thread, object):
+class FsCache(threading.Thread, AbstractCache):
     """
     Cache on filesytem.
     """
 
+    blocking = True
+
     def __init__(self, config):
        """
        Cache on filesytem.
@@ -26,61 +42,184 @@ class FsCache(threading.Thread, object):
        <FsCache(Thread-1, ...)>
        >>> f._dir
        'test/cache'
+       >>> f._index
+       []
        """ 
        threading.Thread.__init__(self)
+       AbstractCache.__init__(self, config)
 
        self.setDaemon(True)
 
        self._dir = config['dir']
        self._freq = int(config['freq'])
-       self._expirationdelay = datetime.timedelta(seconds=int(config['expirationdelay']))
-       self._go = True
-	
+       self._expirationdelay = int(config['expirationdelay'])
+       self._shardDepth = int(config.get('sharddepth', 0))
+       self._fsync = getBoolean(config, 'fsync')
+       self._serializer = serializers.getSerializer(config.get('serializer', 'pickle'))
+       self._mmapMinBytes = getInteger(config, 'mmapminbytes')
+       self._compression = config.get('compression')
+       self._compressMinBytes = getInteger(config, 'compressminbytes', 0)
+       self._readThreads = getInteger(config, 'readthreads', 8)
+       self._pool = None
+       self._poolLock = threading.Lock()
+       self._stopEvent = threading.Event()
+       # heap of (deadline, path relative to dir), deadlines are also the
+       # files mtime
+       self._index = []
+       self._indexLock = threading.Lock()
       
     def stop(self):
         """
-	Stop loop.
-	>>> f = FsCache({'dir' : 'test/cache', 'freq' :'2' ,'expirationdelay': '3'})
-	>>> f._go
-	True
-	>>> f.stop()
-	>>> f._go
-	False
-	"""
-	self._go = False
+        Stop loop.
+
+        >>> f = FsCache({'dir' : 'test/cache', 'freq' :'2' ,'expirationdelay': '3'})
+        >>> f.start()
+        >>> f.isAlive()
+        True
+        >>> f.stop()
+        >>> f.join(1)
+        >>> f.isAlive()
+        False
+        """
+        self._stopEvent.set()
+
     def run(self):
         """
-        Cleaning loop.
+        Cleaning loop : rebuild the expiry index once, then remove the due
+        files every freq seconds.
+        """
+        self._rebuildIndex()
+        while not self._stopEvent.wait(self._freq):
+            self._sweep(time.time())
+
+    def _rebuildIndex(self):
+        """
+        Fill the expiry index from the files of the cache dir. Files found
+        at another shard depth, like the ones of a flat layout, are moved
+        to their place.
+
+        >>> f = FsCache({'dir' : 'test/cache', 'freq' :'2' ,'expirationdelay': '3'})
+        >>> f.putInCache(('a', (1, 2), ()), 'bar')
+        'bar'
+        >>> f._index = []
+        >>> f._rebuildIndex()
+        >>> '19aecb3c9bf4be4a4a7d0d5735b0c33cc08b605a' in [i[1] for i in f._index]
+        True
+
+        Migration from the flat layout.
+
+        >>> s = FsCache({'dir' : 'test/cache', 'freq' :'2' ,'expirationdelay': '3', 'sharddepth': '2'})
+        >>> s.get(('a', (1, 2), ()))
+        MISS
+        >>> s._rebuildIndex()
+        >>> os.path.isfile('test/cache/19/ae/19aecb3c9bf4be4a4a7d0d5735b0c33cc08b605a')
+        True
+        >>> s.get(('a', (1, 2), ()))
+        'bar'
+        >>> f._rebuildIndex()
+        >>> os.path.isdir('test/cache/19')
+        False
+        >>> f.get(('a', (1, 2), ()))
+        'bar'
         """
+        index = []
+        movedFrom = set()
+        now = time.time()
+        for path, deadline in _walkFiles(self._dir):
+            name = os.path.basename(path)
+            if name.startswith(_TMP_PREFIX) and deadline < now - _TMP_MAX_AGE:
+                # left over by a crashed writer
+                self._removeQuietly(os.path.join(self._dir, path))
+                continue
+            if not _isDigest(name):
+                continue
+            target = self._shardPath(name)
+            if path != target:
+                try:
+                    self._makeDirs(target)
+                    os.rename(os.path.join(self._dir, path),
+                              os.path.join(self._dir, target))
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                    continue
+                movedFrom.add(os.path.dirname(path))
+            index.append((deadline, target))
+        heapq.heapify(index)
+
+        # remove the shard dirs emptied by the migration
+        for directory in sorted(movedFrom, reverse=True):
+            while directory:
+                try:
+                    os.rmdir(os.path.join(self._dir, directory))
+                except OSError:
+                    break
+                directory = os.path.dirname(directory)
+
+        self._indexLock.acquire()
+        try:
+            for entry in self._index:
+                heapq.heappush(index, entry)
+            self._index = index
+        finally:
+            self._indexLock.release()
 
-        while(self._go):
-            cacheFiles = glob.glob(os.path.join(self._dir,'*'))
-            now = datetime.datetime.now()
-            for i in cacheFiles:
-                if self._isExpired(i, now):
-                    self._cleanFile(i)
-            time.sleep(self._freq)
+    def _sweep(self, now):
+        """
+        Remove the files whose deadline is passed, touching only the due
+        entries of the index.
+
+        >>> f = FsCache({'dir' : 'test/cache', 'freq' :'2' ,'expirationdelay': '3'})
+        >>> f.putInCache(('d', (1, 2), ()), 'bar', ttl=0)
+        'bar'
+        >>> f.putInCache(('e', (1, 2), ()), 'bar')
+        'bar'
+        >>> f._sweep(time.time())
+        >>> f.get(('d', (1, 2), ()))
+        MISS
+        >>> f.get(('e', (1, 2), ()))
+        'bar'
+        >>> len(f._index)
+        1
+        """
+        while True:
+            self._indexLock.acquire()
+            try:
+                if not self._index or self._index[0][0] > now:
+                    return
+                deadline, filename = heapq.heappop(self._index)
+            finally:
+                self._indexLock.release()
+
+            cacheFile = os.path.join(self._dir, filename)
+            try:
+                if self._isExpired(cacheFile, now):
+                    self._cleanFile(cacheFile)
+                    if self.stats is not None:
+                        self.stats.incr('expirations')
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
 
     def _isExpired(self, cacheFile, timeRef):
         """
-        the file is expired ?
+        the file is expired ? Its mtime is its deadline, so a file written
+        again since it was indexed is not.
 
         >>> f = FsCache({'dir' : 'test/cache', 'freq' :'2' ,'expirationdelay': '1'})
         >>> foo = open('test/expiredfile', 'wb')
         >>> foo.write('bar')
         >>> foo.close()
-        >>> import datetime
-        >>> f._isExpired('test/expiredfile', datetime.datetime.now())
+        >>> os.utime('test/expiredfile', (time.time(), time.time() + 1))
+        >>> f._isExpired('test/expiredfile', time.time())
         False
-        >>> import time
         >>> time.sleep(2)
-        >>> f._isExpired('test/expiredfile', datetime.datetime.now())
+        >>> f._isExpired('test/expiredfile', time.time())
         True
         >>> os.remove('test/expiredfile')
         """
 
-        accessTime = datetime.datetime.fromtimestamp(os.stat(cacheFile).st_atime)
-        return accessTime + self._expirationdelay <= timeRef
+        return os.stat(cacheFile).st_mtime <= timeRef
 
     def _cleanFile(self, cacheFile):
         """
@@ -100,71 +239,314 @@ class FsCache(threading.Thread, object):
 
     
             
-    def isCached(self, func, *args, **kwargs):
+    def get(self, key, default=MISS):
+        """
+        Return cache result or default, opening the file only once : a file
+        removed by the cleaner between the lookup and the read is a miss.
+        A truncated or unreadable file is a miss too, and is removed, as is
+        a file whose deadline is passed but that is not swept yet.
+
+        >>> f = FsCache({'dir' : 'test/cache', 'freq' :'2' ,'expirationdelay': '3'})
+        >>> f.get(('b', (1, 2), ()))
+        MISS
+        >>> f.putInCache(('a', (1, 2), ()), 'bar')
+        'bar'
+        >>> f.get(('a', (1, 2), ()))
+        'bar'
+        >>> foo = open('test/cache/19aecb3c9bf4be4a4a7d0d5735b0c33cc08b605a', 'wb')
+        >>> import cPickle
+        >>> foo.write('P' + cPickle.dumps(range(100), 2)[:50])
+        >>> foo.close()
+        >>> os.utime(foo.name, (time.time(), time.time() + 3))
+        >>> f.get(('a', (1, 2), ()))
+        MISS
+        >>> os.path.isfile('test/cache/19aecb3c9bf4be4a4a7d0d5735b0c33cc08b605a')
+        False
+        >>> f.putInCache(('a', (1, 2), ()), 'bar', ttl=0)
+        'bar'
+        >>> f.get(('a', (1, 2), ()))
+        MISS
+
+        With mmapMinBytes, large raw or out of band entries are mapped and
+        come back as read-only views sharing the page cache.
+
+        >>> import array
+        >>> f = FsCache({'dir' : 'test/cache', 'freq' :'2' ,'expirationdelay': '3',
+        ...              'serializer': 'buffers', 'mmapminbytes': '4096'})
+        >>> f.putInCache(('a', (1, 2), ()), 'x' * 5000) == 'x' * 5000
+        True
+        >>> view = f.get(('a', (1, 2), ()))
+        >>> type(view) in (buffer, memoryview), len(view)
+        (True, 5000)
+        >>> numbers = array.array('d', range(1000))
+        >>> f.putInCache(('a', (1, 2), ()), {'numbers': numbers}) == {'numbers': numbers}
+        True
+        >>> view = f.get(('a', (1, 2), ()))['numbers']
+        >>> array.array('d', bytes(bytearray(view))) == numbers
+        True
+        >>> f.putInCache(('a', (1, 2), ()), 'small')
+        'small'
+        >>> f.get(('a', (1, 2), ()))
+        'small'
+        """
+        path = os.path.join(self._dir, self._computeFilename(key))
+        try:
+            cachedFile = open(path, 'rb')
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return default
+            raise
+        try:
+            if os.fstat(cachedFile.fileno()).st_mtime <= time.time():
+                # due, not swept yet
+                return default
+            try:
+                if self._mmapMinBytes is not None:
+                    mapped = self._loadMapped(cachedFile)
+                    if mapped is not MISS:
+                        return mapped
+                return serializers.load(cachedFile)
+            except Exception:
+                # truncated or corrupted by a crash : drop it
+                self._removeQuietly(path)
+                if self.stats is not None:
+                    self.stats.incr('errors')
+                return default
+        finally:
+            cachedFile.close()
+
+    def _loadMapped(self, cachedFile):
+        """
+        Map a large entry whose payload can be viewed without copy and load
+        it, MISS if the entry is small or of another serializer.
+        """
+        size = os.fstat(cachedFile.fileno()).st_size
+        if size < self._mmapMinBytes:
+            return MISS
+        mapped = mmap.mmap(cachedFile.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:1] not in serializers.MAPPED_TAGS:
+            mapped.close()
+            return MISS
+        # the views keep the mapping alive, the file can be closed
+        return serializers.loadMapped(mapped)
+
+    def isCached(self, key):
         """
         Is in Cache ?
         
         >>> f = FsCache({'dir' : 'test/cache', 'freq' :'2' ,'expirationdelay': '3'})
-        >>> f.isCached('b',[1, 2], {})
+        >>> f.isCached(('b', (1, 2), ()))
         False
-        >>> foo = open('test/cache/455bdde8de3f1b5ddbeac7ba0af07ba23f8b725c', 'wb')
+        >>> foo = open('test/cache/19aecb3c9bf4be4a4a7d0d5735b0c33cc08b605a', 'wb')
         >>> foo.write('bar')
         >>> foo.close()
-        >>> f.isCached('c',[1, 2], {})
+        >>> f.isCached(('a', (1, 2), ()))
+        False
+        >>> os.utime('test/cache/19aecb3c9bf4be4a4a7d0d5735b0c33cc08b605a',
+        ...          (time.time(), time.time() + 3))
+        >>> f.isCached(('a', (1, 2), ()))
         True
         """
-        return os.path.isfile(os.path.join(self._dir,
-                                           self._computeFilename(func, *args, **kwargs)))
+        try:
+            st = os.stat(os.path.join(self._dir, self._computeFilename(key)))
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return False
+            raise
+        return stat.S_ISREG(st.st_mode) and st.st_mtime > time.time()
 
-    def cached(self, func, *args, **kwargs):
+    def cached(self, key):
         """
         Return cache result.
         
         >>> f = FsCache({'dir' : 'test/cache', 'freq' :'2' ,'expirationdelay': '3'})
-        >>> foo = open('test/cache/455bdde8de3f1b5ddbeac7ba0af07ba23f8b725c', 'wb')
-        >>> import cPickle
-        >>> cPickle.dump('bar', foo)
-        >>> foo.close()
-        >>> f.cached('c',[1, 2], {})
+        >>> f.putInCache(('a', (1, 2), ()), 'bar')
+        'bar'
+        >>> f.cached(('a', (1, 2), ()))
         'bar'
         """
         cachedFile = open(os.path.join(self._dir,
-                                       self._computeFilename(func, *args, **kwargs)),'rb')
-        tmp = cPickle.load(cachedFile)
+                                       self._computeFilename(key)),'rb')
+        tmp = serializers.load(cachedFile)
         cachedFile.close()
         return tmp
-    
 
-    def putInCache(self, func, result, *args, **kwargs):
+    def _map(self, fctn, items):
+        """
+        map over the pool of readThreads threads, started on first use.
         """
-        Put file in cache.
+        if self._readThreads <= 1 or len(items) < 2:
+            return list(map(fctn, items))
+        self._poolLock.acquire()
+        try:
+            if self._pool is None:
+                self._pool = ThreadPool(self._readThreads)
+        finally:
+            self._poolLock.release()
+        return self._pool.map(fctn, items)
+
+    def getMany(self, keys, default=MISS):
+        """
+        Return the results of keys, read in parallel.
+
+        >>> f = FsCache({'dir' : 'test/cache', 'freq' :'2' ,'expirationdelay': '3', 'readthreads': '4'})
+        >>> f.putMany([(('a', (i,), ()), i * 2) for i in range(10)])
+        >>> f.getMany([('a', (i,), ()) for i in range(12)])
+        [0, 2, 4, 6, 8, 10, 12, 14, 16, 18, MISS, MISS]
+        """
+        return self._map(lambda key: self.get(key, default), list(keys))
+
+    def putMany(self, items, ttl=None):
+        """
+        Put (key, result) pairs, written in parallel.
+        """
+        self._map(lambda item: self.putInCache(item[0], item[1], ttl), list(items))
+
+
+    def putInCache(self, key, result, ttl=None):
+        """
+        Put file in cache, expiring after ttl seconds, expirationdelay by
+        default. The deadline is stored as the file mtime and pushed on the
+        expiry index.
 
         >>> f = FsCache({'dir' : 'test/cache', 'freq' :'2' ,'expirationdelay': '3'})
-        >>> f.putInCache('a', 3, [1, 2], {})
+        >>> f.putInCache(('c', (1, 2), ()), 3)
         3
-        >>> os.path.isfile('test/cache/b546706c3d1155e7fbd95e03f25ae7695590d1d0')
+        >>> os.path.isfile('test/cache/36743c9366e4c3a3b8215e4a1275aa46b388420e')
+        True
+
+        The file is written aside then renamed in place : readers never see
+        a partial entry.
+
+        >>> big = range(100000)
+        >>> seen = []
+        >>> def read():
+        ...     for i in range(50):
+        ...         seen.append(f.get(('big', (), ())))
+        >>> reader = threading.Thread(target=read)
+        >>> reader.start()
+        >>> for i in range(20):
+        ...     _ = f.putInCache(('big', (), ()), big)
+        >>> reader.join()
+        >>> all(i is MISS or i == big for i in seen)
         True
+        >>> [i for i in os.listdir('test/cache') if i.startswith('.tmp')]
+        []
+
+        Values are written with the serializer of the section, bytes raw.
+
+        >>> import array
+        >>> f = FsCache({'dir' : 'test/cache', 'freq' :'2' ,'expirationdelay': '3', 'serializer': 'buffers'})
+        >>> numbers = array.array('d', range(1000))
+        >>> f.putInCache(('c', (1, 2), ()), numbers) == numbers
+        True
+        >>> open('test/cache/36743c9366e4c3a3b8215e4a1275aa46b388420e', 'rb').read(1)
+        'B'
+        >>> f.get(('c', (1, 2), ())) == numbers
+        True
+        >>> f.putInCache(('c', (1, 2), ()), 'bytes')
+        'bytes'
+        >>> open('test/cache/36743c9366e4c3a3b8215e4a1275aa46b388420e', 'rb').read()
+        'Rbytes'
+
+        Entries of at least compressMinBytes are compressed.
+
+        >>> f = FsCache({'dir' : 'test/cache', 'freq' :'2' ,'expirationdelay': '3',
+        ...              'compression': 'zlib', 'compressminbytes': '1024'})
+        >>> f.putInCache(('c', (1, 2), ()), range(1000)) == range(1000)
+        True
+        >>> open('test/cache/36743c9366e4c3a3b8215e4a1275aa46b388420e', 'rb').read(2)
+        'Zz'
+        >>> f.get(('c', (1, 2), ())) == range(1000)
+        True
+        >>> f.putInCache(('c', (1, 2), ()), range(10))
+        [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+        >>> open('test/cache/36743c9366e4c3a3b8215e4a1275aa46b388420e', 'rb').read(1)
+        'P'
         """
-        filename = self._computeFilename(func, *args, **kwargs)
-        cacheFile = open(os.path.join(self._dir, filename), 'wb')
-        cPickle.dump(result,cacheFile)
-        cacheFile.close()
+        filename = self._computeFilename(key)
+        path = os.path.join(self._dir, filename)
+        if self._shardDepth:
+            self._makeDirs(filename)
+
+        now = time.time()
+        deadline = now + (self._expirationdelay if ttl is None else ttl)
+
+        fd, tmpPath = tempfile.mkstemp(prefix=_TMP_PREFIX, dir=os.path.dirname(path))
+        try:
+            cacheFile = os.fdopen(fd, 'wb')
+            try:
+                if self._compression is None:
+                    serializers.dump(result, cacheFile, self._serializer)
+                else:
+                    serializers.dumpCompressed(result, cacheFile, self._serializer,
+                                               self._compression, self._compressMinBytes)
+                if self._fsync:
+                    cacheFile.flush()
+                    os.fsync(cacheFile.fileno())
+            finally:
+                cacheFile.close()
+            os.utime(tmpPath, (now, deadline))
+            os.rename(tmpPath, path)
+        except:
+            self._removeQuietly(tmpPath)
+            raise
+
+        if self._fsync:
+            _fsyncDir(os.path.dirname(path))
+
+        self._indexLock.acquire()
+        try:
+            heapq.heappush(self._index, (deadline, filename))
+        finally:
+            self._indexLock.release()
         return result
 
-    def _computeFilename(self, func, *args, **kwargs):
+    def _removeQuietly(self, path):
+        """
+        Remove a file, ignoring a missing one.
+        """
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def _computeFilename(self, key):
         """
-        Compute sha1 hash for filename.
+        Compute sha1 hash for filename, with its shard dirs.
 
         >>> f = FsCache({'dir' : 'test/cache', 'freq' :'2' ,'expirationdelay': '3'})
-        >>> f._computeFilename('a',[1, 2], {})
-        'b546706c3d1155e7fbd95e03f25ae7695590d1d0'
+        >>> f._computeFilename(('a', (1, 2), ()))
+        '19aecb3c9bf4be4a4a7d0d5735b0c33cc08b605a'
+        >>> f = FsCache({'dir' : 'test/cache', 'freq' :'2' ,'expirationdelay': '3', 'sharddepth': '2'})
+        >>> f._computeFilename(('a', (1, 2), ()))
+        '19/ae/19aecb3c9bf4be4a4a7d0d5735b0c33cc08b605a'
+        """
+        return self._shardPath(digestKey(key))
+
+    def _shardPath(self, filename):
+        """
+        Path of a hash filename relative to dir : shardDepth levels of
+        dirs named after its first hex pairs.
+
+        >>> f = FsCache({'dir' : 'test/cache', 'freq' :'2' ,'expirationdelay': '3', 'sharddepth': '3'})
+        >>> f._shardPath('19aecb3c9bf4be4a4a7d0d5735b0c33cc08b605a')
+        '19/ae/cb/19aecb3c9bf4be4a4a7d0d5735b0c33cc08b605a'
         """
-        s = hashlib.sha1()
-        s.update(str(func))
-        s.update(str(args))
-        s.update(str(kwargs))
+        shards = [filename[2 * i:2 * i + 2] for i in range(self._shardDepth)]
+        return os.path.join(*(shards + [filename]))
 
-        return s.hexdigest()
+    def _makeDirs(self, filename):
+        """
+        Create the shard dirs of a filename.
+        """
+        directory = os.path.dirname(os.path.join(self._dir, filename))
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
     
     @staticmethod
     def checkConf(config):
@@ -204,6 +586,19 @@ class FsCache(threading.Thread, object):
         ...
         NotInteger: expirationdelay must be an integer
         >>> FsCache.checkConf({'module': 'FsCache', 'dir': 'test/cache', 'freq': '2', 'expirationdelay': '3'})
+        >>> FsCache.checkConf({'module': 'FsCache', 'dir': 'test/cache', 'freq': '2', 'expirationdelay': '3', 'sharddepth': 'a'})
+        Traceback (most recent call last):
+        ...
+        NotInteger: sharddepth must be an integer
+        >>> FsCache.checkConf({'module': 'FsCache', 'dir': 'test/cache', 'freq': '2', 'expirationdelay': '3', 'sharddepth': '2'})
+        >>> FsCache.checkConf({'module': 'FsCache', 'dir': 'test/cache', 'freq': '2', 'expirationdelay': '3', 'serializer': 'json'})
+        Traceback (most recent call last):
+        ...
+        IncoherentSectionConfig: unknown serializer json
+        >>> FsCache.checkConf({'module': 'FsCache', 'dir': 'test/cache', 'freq': '2', 'expirationdelay': '3', 'compression': 'zip'})
+        Traceback (most recent call last):
+        ...
+        IncoherentSectionConfig: unknown compression zip
         """
         try:
             
@@ -225,9 +620,105 @@ class FsCache(threading.Thread, object):
                 except ValueError:
                     raise NotInteger('%s must be an integer' % option)
 
+            getBoolean(config, 'fsync')
+            serializers.getSerializer(config.get('serializer', 'pickle'))
+            getInteger(config, 'mmapminbytes')
+            if 'compression' in config:
+                serializers.checkCompression(config['compression'])
+            getInteger(config, 'compressminbytes')
+            getInteger(config, 'readthreads')
+
+            try:
+                shardDepth = int(config.get('sharddepth', 0))
+            except ValueError:
+                raise NotInteger('sharddepth must be an integer')
+            if not 0 <= shardDepth <= 8:
+                raise IncoherentSectionConfig('sharddepth must be between 0 and 8')
+
         except KeyError:
             raise IncoherentSectionConfig('not module FsCache')
 
+# temp files of writes in progress, and age after which they are left over
+_TMP_PREFIX = '.tmp'
+_TMP_MAX_AGE = 3600
+
+def _fsyncDir(directory):
+    """
+    Flush a directory entry, making a rename durable.
+    """
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _walkFiles(directory, prefix=''):
+    """
+    Yield (path relative to directory, mtime) of the files under a
+    directory. Files and directories removed by another process during
+    the walk are skipped.
+
+    >>> import shutil
+    >>> d = tempfile.mkdtemp()
+    >>> os.mkdir(os.path.join(d, 'ab'))
+    >>> open(os.path.join(d, 'ab', 'f'), 'wb').close()
+    >>> [path for path, mtime in _walkFiles(d)]
+    ['ab/f']
+    >>> walk = _walkFiles(d)
+    >>> shutil.rmtree(os.path.join(d, 'ab'))
+    >>> list(walk), list(_walkFiles(d, 'ab'))
+    ([], [])
+    """
+    try:
+        if scandir is not None:
+            entries = list(scandir(os.path.join(directory, prefix)))
+        else:
+            entries = os.listdir(os.path.join(directory, prefix))
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return
+        raise
+
+    for entry in entries:
+        try:
+            if scandir is not None:
+                path = os.path.join(prefix, entry.name)
+                isDir = entry.is_dir()
+                isFile = not isDir and entry.is_file()
+                mtime = isFile and entry.stat().st_mtime
+            else:
+                path = os.path.join(prefix, entry)
+                st = os.stat(os.path.join(directory, path))
+                isDir = stat.S_ISDIR(st.st_mode)
+                isFile = stat.S_ISREG(st.st_mode)
+                mtime = st.st_mtime
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                continue
+            raise
+        if isDir:
+            for i in _walkFiles(directory, path):
+                yield i
+        elif isFile:
+            yield path, mtime
+
+def _isDigest(filename):
+    """
+    Is filename a sha1 hexdigest ?
+
+    >>> _isDigest('19aecb3c9bf4be4a4a7d0d5735b0c33cc08b605a')
+    True
+    >>> _isDigest('.tmp19aecb')
+    False
+    """
+    return len(filename) == 40 and not filename.strip('0123456789abcdef')
+
+
 class CacheDirIncorrect(Exception):
     """
     >>> CacheDirIncorrect('foo')
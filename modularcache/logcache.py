@@ -0,0 +1,680 @@
+#!/usr/bin/env python
+
+import binascii
+import errno
+import fcntl
+import heapq
+import os
+import struct
+import threading
+import time
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import BytesIO as StringIO
+
+from abstractcache import AbstractCache, MISS
+from cachekey import digestKey
+from configoptions import getBoolean, getNumber
+import serializers
+from exceptionconfig import *
+
+
+# log record header : key sha1, deadline, payload length
+_RECORD = struct.Struct('<20sdI')
+# index file : log size covered, then one entry per live key
+_INDEX_HEADER = struct.Struct('<8sQ')
+_INDEX_ENTRY = struct.Struct('<20sQId')
+_INDEX_MAGIC = b'MCLOGIDX'
+
+LOG_NAME = 'cache.log'
+INDEX_NAME = 'cache.idx'
+LOCK_NAME = 'cache.lock'
+
+
+class LogCache(threading.Thread, AbstractCache):
+    """
+    Cache in a single append-only log file.
+
+    Every put appends a record to dir/cache.log, an in-memory index maps
+    keys to their last record. The index is saved to dir/cache.idx and
+    rebuilt from it on startup, scanning only the log written after it ;
+    compaction removes it before swapping the log, so an index never
+    points in a log it was not saved for.
+    The cleaning loop drops expired keys, popped from a heap of deadlines,
+    and, when dead records make up more than compactRatio of the log,
+    rewrites the log with the live records only. The index file is saved
+    when the index changed. One process uses a log dir : it holds a lock
+    on dir/cache.lock.
+    """
+
+    blocking = True
+
+    def __init__(self, config):
+        """
+        Cache in a log file.
+
+        >>> import tempfile
+        >>> l = LogCache({'dir': tempfile.mkdtemp(), 'freq': '2', 'expirationdelay': '3'})
+        >>> l #doctest: +ELLIPSIS
+        <LogCache(Thread-1, ...)>
+        >>> l._index
+        {}
+        >>> l._compactRatio
+        0.5
+        """
+        threading.Thread.__init__(self)
+        AbstractCache.__init__(self, config)
+
+        self.setDaemon(True)
+
+        self._dir = config['dir']
+        self._freq = int(config['freq'])
+        self._expirationdelay = int(config['expirationdelay'])
+        self._compactRatio = getNumber(config, 'compactratio', 0.5)
+        self._fsync = getBoolean(config, 'fsync')
+        self._serializer = serializers.getSerializer(config.get('serializer', 'pickle'))
+
+        self._stopEvent = threading.Event()
+        self._lock = threading.RLock()
+        # held while the index file is written or removed, before _lock
+        self._indexLock = threading.Lock()
+        # key sha1 -> (record offset, payload length, deadline)
+        self._index = {}
+        # (deadline, key sha1), superseded deadlines stay until popped
+        self._heap = []
+        self._deadBytes = 0
+        # the index changed since it was saved
+        self._dirty = False
+
+        self._lockDir()
+        self._open()
+
+    def _lockDir(self):
+        """
+        Take the lock of the log dir, raise if another LogCache holds it.
+
+        >>> import tempfile
+        >>> d = tempfile.mkdtemp()
+        >>> l = LogCache({'dir': d, 'freq': '2', 'expirationdelay': '30'})
+        >>> LogCache({'dir': d, 'freq': '2', 'expirationdelay': '30'}) #doctest: +ELLIPSIS
+        Traceback (most recent call last):
+        ...
+        LogDirLocked: ... is used by another LogCache
+        >>> l.close()
+        >>> LogCache({'dir': d, 'freq': '2', 'expirationdelay': '30'}) #doctest: +ELLIPSIS
+        <LogCache(Thread-..., initial daemon)>
+        """
+        self._lockFd = os.open(self._path(LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._lockFd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            os.close(self._lockFd)
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                raise LogDirLocked('%s is used by another LogCache' % self._dir)
+            raise
+
+    def _path(self, name):
+        return os.path.join(self._dir, name)
+
+    def _open(self):
+        """
+        Open the log and rebuild the index.
+
+        >>> import tempfile
+        >>> d = tempfile.mkdtemp()
+        >>> l = LogCache({'dir': d, 'freq': '2', 'expirationdelay': '30'})
+        >>> l.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> l.putInCache(('b', (1, 2), ()), 4)
+        4
+        >>> l.saveIndex()
+        >>> l.putInCache(('a', (1, 2), ()), 5)
+        5
+        >>> l.close()
+
+        Reopening loads the index file then the records appended after it.
+
+        >>> l = LogCache({'dir': d, 'freq': '2', 'expirationdelay': '30'})
+        >>> l.get(('a', (1, 2), ())), l.get(('b', (1, 2), ()))
+        (5, 4)
+
+        Without the index file the whole log is scanned, and a record
+        truncated by a crash is dropped.
+
+        >>> l.close()
+        >>> os.remove(os.path.join(d, INDEX_NAME))
+        >>> log = open(os.path.join(d, LOG_NAME), 'ab')
+        >>> log.write(_RECORD.pack('x' * 20, time.time() + 30, 100) + 'trunc')
+        >>> log.close()
+        >>> l = LogCache({'dir': d, 'freq': '2', 'expirationdelay': '30'})
+        >>> l.get(('a', (1, 2), ())), l.get(('b', (1, 2), ()))
+        (5, 4)
+        >>> len(l._index)
+        2
+
+        Records written after the cut are indexed where they land.
+
+        >>> l.putInCache(('c', (1, 2), ()), 6)
+        6
+        >>> l.get(('c', (1, 2), ()))
+        6
+        """
+        self._writer = open(self._path(LOG_NAME), 'ab')
+        self._reader = open(self._path(LOG_NAME), 'rb')
+
+        covered = self._loadIndex()
+        self._scanLog(covered)
+
+    def _loadIndex(self):
+        """
+        Load the index file, return the log size it covers.
+        """
+        try:
+            indexFile = open(self._path(INDEX_NAME), 'rb')
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return 0
+            raise
+        try:
+            data = indexFile.read()
+        finally:
+            indexFile.close()
+
+        if len(data) < _INDEX_HEADER.size:
+            return 0
+        magic, covered = _INDEX_HEADER.unpack_from(data, 0)
+        if magic != _INDEX_MAGIC or covered > self._logSize():
+            return 0
+
+        index = {}
+        liveBytes = 0
+        for offset in range(_INDEX_HEADER.size, len(data) - _INDEX_ENTRY.size + 1,
+                            _INDEX_ENTRY.size):
+            digest, recordOffset, length, deadline = _INDEX_ENTRY.unpack_from(data, offset)
+            index[digest] = (recordOffset, length, deadline)
+            liveBytes += _RECORD.size + length
+        self._index = index
+        self._heap = [(deadline, digest) for digest, (_, _, deadline) in index.items()]
+        heapq.heapify(self._heap)
+        self._deadBytes = covered - liveBytes
+        return covered
+
+    def _scanLog(self, offset):
+        """
+        Index the records from offset to the end of the log, truncating a
+        partial last record.
+        """
+        end = self._logSize()
+        self._reader.seek(offset)
+        while offset + _RECORD.size <= end:
+            digest, deadline, length = _RECORD.unpack(self._reader.read(_RECORD.size))
+            if offset + _RECORD.size + length > end:
+                break
+            self._indexRecord(digest, offset, length, deadline)
+            self._reader.seek(length, os.SEEK_CUR)
+            offset += _RECORD.size + length
+
+        if offset < end:
+            self._writer.truncate(offset)
+            # appends go to the new end, puts take their offset from tell
+            self._writer.seek(0, os.SEEK_END)
+            # the reader may buffer the bytes cut
+            self._reader.close()
+            self._reader = open(self._path(LOG_NAME), 'rb')
+
+    def _logSize(self):
+        self._writer.flush()
+        return os.fstat(self._writer.fileno()).st_size
+
+    def _indexRecord(self, digest, offset, length, deadline):
+        """
+        Point a key to a record, the record it replaces becomes dead.
+        """
+        previous = self._index.get(digest)
+        if previous is not None:
+            self._deadBytes += _RECORD.size + previous[1]
+        self._index[digest] = (offset, length, deadline)
+        heapq.heappush(self._heap, (deadline, digest))
+        self._dirty = True
+
+    def _drop(self, digest):
+        entry = self._index.pop(digest, None)
+        if entry is not None:
+            self._deadBytes += _RECORD.size + entry[1]
+            self._dirty = True
+
+    def saveIndex(self):
+        """
+        Write the index file, atomically.
+        """
+        self._indexLock.acquire()
+        try:
+            self._lock.acquire()
+            try:
+                covered = self._logSize()
+                index = dict(self._index)
+                self._dirty = False
+            finally:
+                self._lock.release()
+
+            entries = [_INDEX_ENTRY.pack(digest, offset, length, deadline)
+                       for digest, (offset, length, deadline) in index.items()]
+
+            tmpPath = self._path(INDEX_NAME + '.tmp')
+            indexFile = open(tmpPath, 'wb')
+            try:
+                indexFile.write(_INDEX_HEADER.pack(_INDEX_MAGIC, covered))
+                indexFile.write(b''.join(entries))
+                if self._fsync:
+                    indexFile.flush()
+                    os.fsync(indexFile.fileno())
+            finally:
+                indexFile.close()
+            os.rename(tmpPath, self._path(INDEX_NAME))
+        finally:
+            self._indexLock.release()
+
+    def close(self):
+        """
+        Save the index, close the log and release the log dir.
+        """
+        self.saveIndex()
+        self._lock.acquire()
+        try:
+            self._writer.close()
+            self._reader.close()
+            os.close(self._lockFd)
+        finally:
+            self._lock.release()
+
+    def stop(self):
+        """
+        Stop loop.
+
+        >>> import tempfile
+        >>> l = LogCache({'dir': tempfile.mkdtemp(), 'freq': '2', 'expirationdelay': '3'})
+        >>> l.start()
+        >>> l.stop()
+        >>> l.join(1)
+        >>> l.isAlive()
+        False
+        """
+        self._stopEvent.set()
+
+    def run(self):
+        """
+        Cleaning loop : drop expired keys, compact, save the index if it
+        changed.
+        """
+        while not self._stopEvent.wait(self._freq):
+            self._sweep(time.time())
+            if self._needsCompaction():
+                self.compact()
+            if self._dirty:
+                self.saveIndex()
+
+    def _sweep(self, now):
+        """
+        Drop the expired keys from the index, their records become dead.
+
+        Only the deadlines due are popped : a deadline superseded by a
+        later put is skipped, the heap is rebuilt when those pile up.
+
+        >>> import tempfile
+        >>> l = LogCache({'dir': tempfile.mkdtemp(), 'freq': '2', 'expirationdelay': '30'})
+        >>> l.putInCache(('a', (1, 2), ()), 3, ttl=0)
+        3
+        >>> l.putInCache(('b', (1, 2), ()), 4, ttl=0)
+        4
+        >>> l.putInCache(('b', (1, 2), ()), 5)
+        5
+        >>> l._sweep(time.time())
+        >>> len(l._index), len(l._heap)
+        (1, 1)
+        >>> l.get(('b', (1, 2), ()))
+        5
+        >>> for i in range(200):
+        ...     _ = l.putInCache(('b', (1, 2), ()), i)
+        >>> l._sweep(time.time())
+        >>> len(l._heap)
+        1
+        """
+        self._lock.acquire()
+        try:
+            expired = 0
+            while self._heap and self._heap[0][0] <= now:
+                deadline, digest = heapq.heappop(self._heap)
+                entry = self._index.get(digest)
+                if entry is not None and entry[2] <= now:
+                    self._drop(digest)
+                    expired += 1
+            if len(self._heap) > 2 * len(self._index) + 64:
+                self._heap = [(entry[2], digest) for digest, entry in self._index.items()]
+                heapq.heapify(self._heap)
+            if expired and self.stats is not None:
+                self.stats.incr('expirations', expired)
+        finally:
+            self._lock.release()
+
+    def _needsCompaction(self):
+        size = self._logSize()
+        return size > 0 and self._deadBytes > self._compactRatio * size
+
+    def compact(self):
+        """
+        Rewrite the log with the live records only.
+
+        >>> import tempfile
+        >>> l = LogCache({'dir': tempfile.mkdtemp(), 'freq': '2', 'expirationdelay': '30'})
+        >>> for i in range(100):
+        ...     _ = l.putInCache(('a', (1, 2), ()), 'x' * 1000)
+        >>> _ = l.putInCache(('b', (1, 2), ()), 4)
+        >>> l._needsCompaction()
+        True
+        >>> before = l._logSize()
+        >>> l.compact()
+        >>> l._logSize() < before / 50
+        True
+        >>> l._deadBytes
+        0
+        >>> l.get(('a', (1, 2), ())) == 'x' * 1000, l.get(('b', (1, 2), ()))
+        (True, 4)
+
+        The index file is removed before the swap : a crash before the
+        new one is saved leaves a log that is scanned whole on reopening.
+
+        >>> d = tempfile.mkdtemp()
+        >>> l = LogCache({'dir': d, 'freq': '2', 'expirationdelay': '30'})
+        >>> for i in range(50):
+        ...     _ = l.putInCache(('a', (i,), ()), 'v%d' % i)
+        >>> l.saveIndex()
+        >>> for i in range(50):
+        ...     _ = l.putInCache(('a', (i,), ()), 'w%d' % i)
+        >>> l.saveIndex = lambda: None
+        >>> l.compact()
+        >>> os.path.exists(os.path.join(d, INDEX_NAME))
+        False
+        >>> l._writer.close()
+        >>> os.close(l._lockFd)
+        >>> l = LogCache({'dir': d, 'freq': '2', 'expirationdelay': '30'})
+        >>> [l.get(('a', (i,), ())) for i in range(50)] == ['w%d' % i for i in range(50)]
+        True
+        """
+        # copy the live records without blocking puts
+        self._lock.acquire()
+        try:
+            snapshot = dict(self._index)
+        finally:
+            self._lock.release()
+
+        compactPath = self._path(LOG_NAME + '.compact')
+        reader = open(self._path(LOG_NAME), 'rb')
+        compacted = open(compactPath, 'wb')
+        try:
+            moved = {}
+            for digest, entry in snapshot.items():
+                moved[digest] = (compacted.tell(), entry[1], entry[2])
+                compacted.write(self._readRecord(reader, entry[0], entry[1]))
+
+            # then, locked, the records written since and the swap
+            self._indexLock.acquire()
+            self._lock.acquire()
+            try:
+                index = {}
+                for digest, entry in self._index.items():
+                    if snapshot.get(digest) == entry:
+                        index[digest] = moved[digest]
+                    else:
+                        index[digest] = (compacted.tell(), entry[1], entry[2])
+                        compacted.write(self._readRecord(self._reader, entry[0], entry[1]))
+                compacted.flush()
+                if self._fsync:
+                    os.fsync(compacted.fileno())
+                try:
+                    os.remove(self._path(INDEX_NAME))
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                os.rename(compactPath, self._path(LOG_NAME))
+
+                self._writer.close()
+                self._reader.close()
+                self._writer = open(self._path(LOG_NAME), 'ab')
+                self._reader = open(self._path(LOG_NAME), 'rb')
+                self._index = index
+                self._deadBytes = 0
+            finally:
+                self._lock.release()
+                self._indexLock.release()
+        finally:
+            compacted.close()
+            reader.close()
+        self.saveIndex()
+
+    def _readRecord(self, reader, offset, length):
+        reader.seek(offset)
+        return reader.read(_RECORD.size + length)
+
+    def get(self, key, default=MISS):
+        """
+        Return cache result or default.
+
+        >>> import tempfile
+        >>> l = LogCache({'dir': tempfile.mkdtemp(), 'freq': '2', 'expirationdelay': '30'})
+        >>> l.get(('a', (1, 2), ()))
+        MISS
+        >>> l.putInCache(('a', (1, 2), ()), {'b': 3})
+        {'b': 3}
+        >>> l.get(('a', (1, 2), ()))
+        {'b': 3}
+        >>> l.putInCache(('a', (1, 2), ()), 4, ttl=0)
+        4
+        >>> l.get(('a', (1, 2), ()))
+        MISS
+
+        A record that cannot be decoded is a miss.
+
+        >>> l.putInCache(('b', (1, 2), ()), 5)
+        5
+        >>> offset, length, deadline = l._index[_digest(('b', (1, 2), ()))]
+        >>> log = open(os.path.join(l._dir, LOG_NAME), 'r+b')
+        >>> log.seek(offset + _RECORD.size)
+        >>> log.write('?')
+        >>> log.close()
+        >>> l.get(('b', (1, 2), ()))
+        MISS
+        >>> _digest(('b', (1, 2), ())) in l._index
+        False
+
+        So is a record of another key.
+
+        >>> l.putInCache(('c', (1, 2), ()), 6)
+        6
+        >>> offset, length, deadline = l._index[_digest(('c', (1, 2), ()))]
+        >>> log = open(os.path.join(l._dir, LOG_NAME), 'r+b')
+        >>> log.seek(offset)
+        >>> log.write('x' * 20)
+        >>> log.close()
+        >>> l.get(('c', (1, 2), ()))
+        MISS
+        """
+        digest = _digest(key)
+        self._lock.acquire()
+        try:
+            entry = self._index.get(digest)
+            if entry is None:
+                return default
+            offset, length, deadline = entry
+            if deadline <= time.time():
+                self._drop(digest)
+                if self.stats is not None:
+                    self.stats.incr('expirations')
+                return default
+            record = self._readRecord(self._reader, offset, length)
+        finally:
+            self._lock.release()
+        try:
+            if _RECORD.unpack_from(record)[::2] != (digest, length):
+                raise ValueError('record of another key')
+            return serializers.load(StringIO(record[_RECORD.size:]))
+        except Exception:
+            # unreadable record : forget it
+            self._lock.acquire()
+            try:
+                if self._index.get(digest) == entry:
+                    self._drop(digest)
+            finally:
+                self._lock.release()
+            if self.stats is not None:
+                self.stats.incr('errors')
+            return default
+
+    def isCached(self, key):
+        """
+        >>> import tempfile
+        >>> l = LogCache({'dir': tempfile.mkdtemp(), 'freq': '2', 'expirationdelay': '30'})
+        >>> l.isCached(('a', (1, 2), ()))
+        False
+        >>> l.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> l.isCached(('a', (1, 2), ()))
+        True
+        """
+        entry = self._index.get(_digest(key))
+        return entry is not None and entry[2] > time.time()
+
+    def cached(self, key):
+        """
+        >>> import tempfile
+        >>> l = LogCache({'dir': tempfile.mkdtemp(), 'freq': '2', 'expirationdelay': '30'})
+        >>> l.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> l.cached(('a', (1, 2), ()))
+        3
+        """
+        result = self.get(key)
+        if result is MISS:
+            raise KeyError(key)
+        return result
+
+    def putInCache(self, key, result, ttl=None):
+        """
+        Append result to the log, expiring after ttl seconds,
+        expirationdelay by default.
+
+        >>> import tempfile
+        >>> l = LogCache({'dir': tempfile.mkdtemp(), 'freq': '2', 'expirationdelay': '30'})
+        >>> l.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> l.putInCache(('a', (1, 2), ()), 4)
+        4
+        >>> l._deadBytes > 0
+        True
+        """
+        out = StringIO()
+        serializers.dump(result, out, self._serializer)
+        payload = out.getvalue()
+
+        digest = _digest(key)
+        deadline = time.time() + (self._expirationdelay if ttl is None else ttl)
+        record = _RECORD.pack(digest, deadline, len(payload)) + payload
+
+        self._lock.acquire()
+        try:
+            offset = self._writer.tell()
+            self._writer.write(record)
+            self._writer.flush()
+            if self._fsync:
+                os.fsync(self._writer.fileno())
+            self._indexRecord(digest, offset, len(payload), deadline)
+        finally:
+            self._lock.release()
+        return result
+
+    @staticmethod
+    def checkConf(config):
+        """
+        Check configuration for log Cache.
+
+        >>> LogCache.checkConf({})
+        Traceback (most recent call last):
+        ...
+        IncoherentSectionConfig: not module LogCache
+        >>> LogCache.checkConf({'module': 'LogCache'})
+        Traceback (most recent call last):
+        ...
+        MissingConfigException: no dir in config
+        >>> LogCache.checkConf({'module': 'LogCache', 'dir': 'test/noexist', 'freq': '2', 'expirationdelay': '3'})
+        Traceback (most recent call last):
+        ...
+        CacheDirIncorrect: test/noexist isn't correct
+        >>> LogCache.checkConf({'module': 'LogCache', 'dir': 'test', 'freq': 'a', 'expirationdelay': '3'})
+        Traceback (most recent call last):
+        ...
+        NotInteger: freq must be an integer
+        >>> LogCache.checkConf({'module': 'LogCache', 'dir': 'test', 'freq': '2', 'expirationdelay': '3', 'compactratio': '2'})
+        Traceback (most recent call last):
+        ...
+        BadOptionValue: compactratio must be between 0 and 1
+        >>> LogCache.checkConf({'module': 'LogCache', 'dir': 'test', 'freq': '2', 'expirationdelay': '3'})
+        """
+        try:
+            if config['module'] != 'LogCache':
+                raise IncoherentSectionConfig('not module LogCache')
+        except KeyError:
+            raise IncoherentSectionConfig('not module LogCache')
+
+        for option in ['dir', 'freq', 'expirationdelay']:
+            if not option in config:
+                raise MissingConfigException('no %s in config' % option)
+
+        if not os.path.isdir(config['dir']):
+            raise CacheDirIncorrect(config['dir'] + " isn't correct")
+
+        for option in ['freq', 'expirationdelay']:
+            try:
+                tmp = int(config[option])
+            except ValueError:
+                raise NotInteger('%s must be an integer' % option)
+
+        if not 0 < getNumber(config, 'compactratio', 0.5) < 1:
+            raise BadOptionValue('compactratio must be between 0 and 1')
+        getBoolean(config, 'fsync')
+        serializers.getSerializer(config.get('serializer', 'pickle'))
+
+
+def _digest(key):
+    """
+    Raw sha1 of a key, 20 bytes.
+    """
+    return binascii.unhexlify(digestKey(key))
+
+
+class CacheDirIncorrect(Exception):
+    """
+    >>> CacheDirIncorrect('foo')
+    CacheDirIncorrect('foo',)
+    """
+    pass
+
+
+class NotInteger(Exception):
+    """
+    >>> NotInteger('foo')
+    NotInteger('foo',)
+    """
+    pass
+
+
+class LogDirLocked(Exception):
+    """
+    >>> LogDirLocked('foo')
+    LogDirLocked('foo',)
+    """
+    pass
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -1,15 +1,28 @@
 #!/usr/bin/env python
 
 import functools
+import time
 from decorator import decorator
 
+from abstractcache import MISS
+from asynccache import cacheCoroutine, isCoroutineFunction
 from cachedict import CacheDict
+from cachekey import computeKey
+from revalidate import Revalidator, Stamped
 
 #@decorator
-def cache(selector):
+def cache(selector, ttl=None, staleTtl=None):
     """
     Decorator for cache.
 
+    selector : the cache section.
+    ttl : seconds a result stays fresh, overriding the section expiry.
+    staleTtl : seconds after ttl during which the stale result is still
+    returned at once while one refresh runs in background.
+
+    An async def function is cached by asynccache.cacheCoroutine : awaiting
+    it returns the cached result.
+
     >>> from  modularcacheconfig import ModularCacheConfig
     
 
@@ -57,15 +70,98 @@ def cache(selector):
     True
     >>>	dt1 is dt1
     True
+    >>> mc = ModularCacheConfig('test/singleflight.ini')
+    >>> import threading, time
+    >>> calls = []
+    >>> @cache('singleflight')
+    ... def slow(a):
+    ...     calls.append(a)
+    ...     time.sleep(0.2)
+    ...     return a * 2
+    >>> results = []
+    >>> threads = [threading.Thread(target=lambda: results.append(slow(21)))
+    ...            for i in range(50)]
+    >>> for t in threads:
+    ...     t.start()
+    >>> for t in threads:
+    ...     t.join()
+    >>> calls
+    [21]
+    >>> results == [42] * 50
+    True
+    >>> mc = ModularCacheConfig('test/ttl.ini')
+    >>> values = iter(range(10))
+    >>> @cache('ttl', ttl=0.2, staleTtl=1)
+    ... def counter():
+    ...     return next(values)
+    >>> counter()
+    0
+    >>> counter()
+    0
+    >>> time.sleep(0.3)
+    >>> counter()
+    0
+    >>> _revalidator.join()
+    >>> counter()
+    1
+    >>> time.sleep(1.5)
+    >>> counter()
+    2
+    >>> mc = ModularCacheConfig('test/fscache.ini')
+    >>> @cache('fscache', ttl=0.2)
+    ... def fsCounter(a):
+    ...     return next(values)
+    >>> fsCounter('x')
+    3
+    >>> fsCounter('x')
+    3
+    >>> time.sleep(0.3)
+    >>> fsCounter('x')
+    4
+    >>> mc = ModularCacheConfig('test/ram.ini')
+    >>> @cache('ram')
+    ... def shared(a):
+    ...     return 'plain'
+    >>> shared(1)
+    'plain'
+
+    With a ttl, a result stored without one is a miss.
+
+    >>> @cache('ram', ttl=60)
+    ... def shared(a):
+    ...     return 'stamped'
+    >>> shared(1), shared(1)
+    ('stamped', 'stamped')
+    >>> cache('ram', staleTtl=1)
+    Traceback (most recent call last):
+    ...
+    ValueError: staleTtl needs a ttl
+    >>> mc = ModularCacheConfig('test/ram.ini')
+    >>> @cache('ram')
+    ... def double(a):
+    ...     return a * 2
+    >>> [double(i % 4) for i in range(10)]
+    [0, 2, 4, 6, 0, 2, 4, 6, 0, 2]
+    >>> snapshot = CacheDict.getInstance().stats()['ram']
+    >>> snapshot['hits'], snapshot['misses'], snapshot['puts']
+    (6, 4, 4)
+    >>> snapshot['latency']['lookup']['count']
+    10
     >>> #from cachedict import CacheDict
     >>> #cd = CacheDict.getInstance()
     >>> #cd['fscache'].stop()
     """
     
+    if staleTtl is not None and ttl is None:
+        raise ValueError('staleTtl needs a ttl')
+
     def _cache(fctn):
         """
         Sub decorator.
         """
+        if isCoroutineFunction(fctn):
+            return cacheCoroutine(selector, fctn, ttl, staleTtl)
+
         @functools.wraps(fctn)
         def __cache(*args, **kwargs):
             """
@@ -77,16 +173,208 @@ def cache(selector):
 
             if selector in cd:
                 c = cd[selector]
-                if c.isCached(fctn.__name__, *args, **kwargs):
-                    return c.cached(fctn.__name__, *args, **kwargs)
+                stats = c.stats
+                key = computeKey(fctn.__name__, args, kwargs)
+                if stats is None:
+                    result = c.get(key)
                 else:
-                    return c.putInCache(fctn.__name__, fctn(*args, **kwargs), *args, **kwargs)
+                    start = time.time()
+                    result = c.get(key)
+                    stats.observe('lookup', time.time() - start)
+                if ttl is not None and result is not MISS:
+                    now = time.time()
+                    if not isinstance(result, Stamped):
+                        # stored without ttl
+                        result = MISS
+                    elif result.isFresh(now):
+                        if stats is not None:
+                            stats.incr('hits')
+                        return result.value
+                    elif now < result.freshUntil + (staleTtl or 0):
+                        if stats is not None:
+                            stats.incr('hits')
+                        _revalidator.submit((selector, key), _compute, c, key,
+                                            fctn, args, kwargs, ttl, staleTtl)
+                        return result.value
+                    else:
+                        result = MISS
+                if stats is not None:
+                    stats.incr(result is MISS and 'misses' or 'hits')
+                if result is MISS:
+                    if c.singleFlight is None:
+                        result = _compute(c, key, fctn, args, kwargs, ttl, staleTtl)
+                    else:
+                        result = c.singleFlight.do(key, _fill, c, key, fctn, args, kwargs,
+                                                   ttl, staleTtl)
+                return result
             else :
                 return fctn(*args, **kwargs)
         return __cache
 
     return _cache
 
+def cacheMany(selector, ttl=None):
+    """
+    Decorator for a vectorized function, taking a list of inputs as last
+    argument and returning the list of their results.
+
+    Each input is cached as its own entry : a call looks all of them up in
+    one batch and computes only the missing ones, in a single call.
+
+    >>> from  modularcacheconfig import ModularCacheConfig
+    >>> mc = ModularCacheConfig('test/ram.ini')
+    >>> calls = []
+    >>> @cacheMany('ram')
+    ... def squares(inputs):
+    ...     calls.append(inputs)
+    ...     return [i * i for i in inputs]
+    >>> squares([1, 2, 3])
+    [1, 4, 9]
+    >>> squares([2, 3, 4, 5, 4])
+    [4, 9, 16, 25, 16]
+    >>> calls
+    [[1, 2, 3], [4, 5]]
+    >>> squares([1, 5])
+    [1, 25]
+    >>> len(calls)
+    2
+    >>> class A(object):
+    ...     @cacheMany('ram', ttl=60)
+    ...     def scaled(self, factor, inputs):
+    ...         return [i * factor for i in inputs]
+    >>> a = A()
+    >>> a.scaled(2, [1, 2]), a.scaled(3, [1, 2])
+    ([2, 4], [3, 6])
+    >>> @cacheMany('ram', ttl=60)
+    ... def squares(inputs):
+    ...     return [-i * i for i in inputs]
+    >>> squares([1, 6])
+    [-1, -36]
+
+    A function must return one result per input.
+
+    >>> @cacheMany('ram')
+    ... def lossy(inputs):
+    ...     return [i for i in inputs if i]
+    >>> lossy([0, 1])
+    Traceback (most recent call last):
+    ...
+    ValueError: lossy returned 1 results for 2 inputs
+    >>> lossy([1])
+    [1]
+    """
+    def _cache(fctn):
+        """
+        Sub decorator.
+        """
+        @functools.wraps(fctn)
+        def __cache(*args):
+            """
+            Sub sub decorator.
+            """
+            cd = CacheDict.getInstance()
+            if selector not in cd:
+                return fctn(*args)
+
+            c = cd[selector]
+            stats = c.stats
+            prefix, inputs = args[:-1], list(args[-1])
+            keys = [computeKey(fctn.__name__, prefix + (item,), {}) for item in inputs]
+            start = time.time()
+            results = c.getMany(keys)
+            if stats is not None:
+                stats.observe('lookup', time.time() - start)
+            if ttl is not None:
+                now = time.time()
+                results = [result.value if isinstance(result, Stamped) and result.isFresh(now)
+                           else MISS for result in results]
+
+            # each missing key computed once, at its first position
+            firsts = {}
+            for position, result in enumerate(results):
+                if result is MISS:
+                    firsts.setdefault(keys[position], position)
+            if stats is not None:
+                misses = len([result for result in results if result is MISS])
+                stats.incr('hits', len(results) - misses)
+                stats.incr('misses', misses)
+            if not firsts:
+                return results
+            missing = sorted(firsts.values())
+            start = time.time()
+            try:
+                computed = list(fctn(*(prefix + ([inputs[p] for p in missing],))))
+                if len(computed) != len(missing):
+                    raise ValueError('%s returned %d results for %d inputs'
+                                     % (fctn.__name__, len(computed), len(missing)))
+            except Exception:
+                if stats is not None:
+                    stats.incr('errors')
+                raise
+            if stats is not None:
+                stats.observe('compute', time.time() - start)
+
+            byKey = dict((keys[p], result) for p, result in zip(missing, computed))
+            for position, result in enumerate(results):
+                if result is MISS:
+                    results[position] = byKey[keys[position]]
+            start = time.time()
+            if ttl is None:
+                c.putMany(byKey.items())
+            else:
+                freshUntil = time.time() + ttl
+                c.putMany([(key, Stamped(result, freshUntil)) for key, result in byKey.items()], ttl)
+            if stats is not None:
+                stats.observe('store', time.time() - start)
+                stats.incr('puts', len(byKey))
+            return results
+        return __cache
+
+    return _cache
+
+_revalidator = Revalidator()
+
+def _compute(c, key, fctn, args, kwargs, ttl=None, staleTtl=None):
+    """
+    Compute a result and put it in cache, stamped with its freshness when
+    the decorator has a ttl.
+    """
+    stats = c.stats
+    start = time.time()
+    try:
+        result = fctn(*args, **kwargs)
+    except Exception:
+        if stats is not None:
+            stats.incr('errors')
+        raise
+    if stats is not None:
+        computed = time.time()
+        stats.observe('compute', computed - start)
+
+    if ttl is None:
+        c.putInCache(key, result)
+    else:
+        c.putInCache(key, Stamped(result, time.time() + ttl), ttl + (staleTtl or 0))
+
+    if stats is not None:
+        stats.observe('store', time.time() - computed)
+        stats.incr('puts')
+    return result
+
+def _fill(c, key, fctn, args, kwargs, ttl=None, staleTtl=None):
+    """
+    Compute a missing result and put it in cache, unless a previous
+    flight already did.
+    """
+    result = c.get(key)
+    if result is MISS:
+        return _compute(c, key, fctn, args, kwargs, ttl, staleTtl)
+    if ttl is None:
+        return result
+    if not isinstance(result, Stamped) or not result.isFresh():
+        return _compute(c, key, fctn, args, kwargs, ttl, staleTtl)
+    return result.value
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
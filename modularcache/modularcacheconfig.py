@@ -2,9 +2,19 @@
 
 from cachedict import CacheDict
 
-import ConfigParser
+import threading
+
+try:
+    import ConfigParser
+except ImportError:
+    import configparser as ConfigParser
 
 import exceptionconfig
+from configoptions import getBoolean, getInteger
+from singleflight import SingleFlight
+from stats import Stats
+from stripedcache import StripedCache
+from writebehind import WriteBehind, WriteBehindCache
 
 class ModularCacheConfig(object):
     """
@@ -97,6 +107,10 @@ class ModularCacheConfig(object):
         >>> m._checkSection('dummy1')
         """
         module = __import__(self._config._sections['Cache_'+str(section)]['module'].lower()).__dict__[self._config._sections['Cache_'+str(section)]['module']]
+        SingleFlight.checkConf(self._config._sections['Cache_'+str(section)])
+        Stats.checkConf(self._config._sections['Cache_'+str(section)])
+        StripedCache.checkConf(self._config._sections['Cache_'+str(section)])
+        WriteBehind.checkConf(self._config._sections['Cache_'+str(section)])
         return module.checkConf(self._config._sections['Cache_'+str(section)])
 
     def _addCache(self, section):
@@ -106,12 +120,71 @@ class ModularCacheConfig(object):
         >>> cd = CacheDict.getInstance()
         >>> cd['dummy1'] #doctest: +ELLIPSIS
         <dummycache.DummyCache object at 0x...>
+        >>> m = ModularCacheConfig('test/striped.ini')
+        >>> cd = CacheDict.getInstance()
+        >>> cd['striped'] #doctest: +ELLIPSIS
+        <stripedcache.StripedCache object at 0x...>
+        >>> m = ModularCacheConfig('test/logcache.ini')
+        >>> cd = CacheDict.getInstance()
+        >>> cd['log'].isAlive()
+        True
+        >>> cd['log'].stop()
+        >>> cd['log'].join()
+        >>> m = ModularCacheConfig('test/sqlitecache.ini')
+        >>> cd = CacheDict.getInstance()
+        >>> cd['sqlite'].isAlive()
+        True
+        >>> cd['sqlite'].stop()
+        >>> cd['sqlite'].join()
+        >>> m = ModularCacheConfig('test/tiered.ini')
+        >>> cd = CacheDict.getInstance()
+        >>> [tier.__class__.__name__ for tier in cd['tiered'].tiers()]
+        ['RamLRUCache', 'FsCache']
+        >>> cd['fscache'].stop()
+        >>> cd['fscache'].join()
+        >>> m = ModularCacheConfig('test/writebehind.ini')
+        >>> cd = CacheDict.getInstance()
+        >>> cd['fscache'] #doctest: +ELLIPSIS
+        <writebehind.WriteBehindCache object at 0x...>
+        >>> cd['fscache'].backend.stop()
+        >>> cd['fscache'].backend.join()
+        >>> m = ModularCacheConfig('test/tinylfu.ini')
+        >>> cd = CacheDict.getInstance()
+        >>> cd['tinylfu'] #doctest: +ELLIPSIS
+        <ramtinylfucache.RamTinyLFUCache object at 0x...>
+        >>> m = ModularCacheConfig('test/shmcache.ini')
+        >>> cd = CacheDict.getInstance()
+        >>> cd['shm'].putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> ModularCacheConfig('test/shmcache.ini') #doctest: +ELLIPSIS
+        <__main__.ModularCacheConfig object at 0x...>
+        >>> CacheDict.getInstance()['shm'].get(('a', (1, 2), ()))
+        3
+        >>> m = ModularCacheConfig('test/remotecache.ini')
+        >>> CacheDict.getInstance()['remote'] #doctest: +ELLIPSIS
+        <remotecache.RemoteCache object at 0x...>
+        >>> m = ModularCacheConfig('test/sharded.ini')
+        >>> cd = CacheDict.getInstance()
+        >>> cd['sharded'].putMany([(('a', (i,), ()), i) for i in range(300)])
+        >>> [len(cd[name]._cache) > 50 for name in ['ram1', 'ram2', 'ram3']]
+        [True, True, True]
         """
 
         cd = CacheDict.getInstance()
-        module = __import__(self._config._sections['Cache_'+str(section)]['module'].lower()).__dict__[self._config._sections['Cache_'+str(section)]['module']]( self._config._sections['Cache_'+str(section)])
+        config = self._config._sections['Cache_'+str(section)]
+        module = __import__(config['module'].lower()).__dict__[config['module']]
+
+        if getInteger(config, 'stripes', 1) > 1:
+            cd[section] = StripedCache(module, config)
+        else:
+            cd[section] = module(config)
+
+        # backends with a cleaning loop, like FsCache
+        if isinstance(cd[section], threading.Thread):
+            cd[section].start()
 
-        cd[section] = module
+        if getBoolean(config, 'writebehind') and not getattr(module, 'ownWriteBehind', False):
+            cd[section] = WriteBehindCache(cd[section], config)
 
         
 if __name__ == "__main__":
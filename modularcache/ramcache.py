@@ -1,12 +1,20 @@
 #!/usr/bin/env path
 
-from abstractcache import AbstractCache
+import sys
+
+from abstractcache import AbstractCache, MISS
+from configoptions import getInteger
+import sizer
 
 from exceptionconfig import *
 
 class RamCache(AbstractCache):
     """
     Ram Cache.
+
+    With `maxBytes`, results are sized by `sizer` when stored and entries
+    are evicted until their total is back under the budget ; a result
+    larger than the budget is not cached.
     """
     
     def __init__(self, config=None):
@@ -18,10 +26,18 @@ class RamCache(AbstractCache):
         <__main__.RamCache object at 0x...>
         >>> r._cache
         {}
+        >>> r._maxBytes is None
+        True
         """
-        AbstractCache.__init__(self)
+        AbstractCache.__init__(self, config)
 
         self._cache = {}
+        config = config or {}
+        self._maxBytes = getInteger(config, 'maxbytes')
+        self._sizer = sizer.getSizer(config.get('sizer'))
+        # key -> bytes, with maxBytes only
+        self._sizes = {}
+        self._bytes = 0
         
     
     @staticmethod
@@ -38,6 +54,10 @@ class RamCache(AbstractCache):
         ...
         IncoherentSectionConfig: not module RamCache
         >>> RamCache.checkConf({'module' : 'RamCache', 'param1' : 'value1'})
+        >>> RamCache.checkConf({'module' : 'RamCache', 'maxbytes' : 'a'})
+        Traceback (most recent call last):
+        ...
+        BadOptionValue: maxbytes must be an integer
         """
         try:
             if config['module'] == 'RamCache':
@@ -47,6 +67,8 @@ class RamCache(AbstractCache):
         except KeyError:
             raise IncoherentSectionConfig('not module RamCache')
 
+        sizer.checkConf(config)
+
     def __setitem__(self, key, value):
         """
         Set items.
@@ -84,7 +106,7 @@ class RamCache(AbstractCache):
         {}
         """
         
-        del(self._cache[key])
+        self._discard(key)
 
     def has_key(self, key):
         """
@@ -114,45 +136,155 @@ class RamCache(AbstractCache):
         return key in self._cache
 
 
-    def isCached(self, func, *args, **kwargs):
+    def get(self, key, default=MISS):
+        """
+        Return the cached result or default.
+
+        >>> r = RamCache()
+        >>> r.get(('a', (1, 2), ()))
+        MISS
+        >>> r._cache =  {('a', (1, 2), ()): 3}
+        >>> r.get(('a', (1, 2), ()))
+        3
+        """
+        return self._cache.get(key, default)
+
+    def getMany(self, keys, default=MISS):
+        """
+        >>> r = RamCache()
+        >>> r._cache =  {('a', (1, 2), ()): 3}
+        >>> r.getMany([('a', (1, 2), ()), ('a', (1, 3), ())])
+        [3, MISS]
+        """
+        get = self._cache.get
+        return [get(key, default) for key in keys]
+
+    def putMany(self, items, ttl=None):
+        """
+        >>> r = RamCache()
+        >>> r.putMany([(('a', (1, 2), ()), 3)])
+        >>> r._cache
+        {('a', (1, 2), ()): 3}
+        """
+        if self._maxBytes is not None:
+            return AbstractCache.putMany(self, items, ttl)
+        self._cache.update(items)
+
+    def isCached(self, key):
         """
         >>> r = RamCache()
         >>> r._cache
         {}
-        >>> r.isCached('a',[1, 2], {})
+        >>> r.isCached(('a', (1, 2), ()))
         False
-        >>> r._cache =  {'a': {'([1, 2], {})': {'{}': 3}}}
-        >>> r.isCached('a',[1, 2], {})
+        >>> r._cache =  {('a', (1, 2), ()): 3}
+        >>> r.isCached(('a', (1, 2), ()))
         True
         """
-        return func in self._cache and str(args) in self._cache[func] and str(kwargs) in self._cache[func][str(args)]
+        return key in self._cache
 
-    def cached(self, func, *args, **kwargs):
+    def cached(self, key):
         """
         >>> r = RamCache()
-        >>> r._cache =  {'a': {'([1, 2], {})': {'{}': 3}}}
-        >>> r.cached('a',[1, 2], {})
+        >>> r._cache =  {('a', (1, 2), ()): 3}
+        >>> r.cached(('a', (1, 2), ()))
         3
         """
-        return  self._cache[func][str(args)][str(kwargs)]
+        return self._cache[key]
 
-    def putInCache(self, func, result, *args, **kwargs):
+    def putInCache(self, key, result, ttl=None):
         """
         >>> r = RamCache()
-        >>> r.putInCache('a', 3, [1, 2], {})
+        >>> r.putInCache(('a', (1, 2), ()), 3)
         3
         >>> r._cache
-        {'a': {'([1, 2], {})': {'{}': 3}}}
-        """
-        if func not in self._cache:
-            self._cache[func] = {}
+        {('a', (1, 2), ()): 3}
 
-        if str(args) not in self._cache[func]:
-            self._cache[func][str(args)] = {}
+        maxBytes evicts entries until the results fit.
 
+        >>> r = RamCache({'maxbytes': '10000'})
+        >>> for i in range(10):
+        ...     _ = r.putInCache(('a', (i,), ()), 'x' * 3000)
+        >>> len(r._cache), r.memoryBytes() <= 10000
+        (3, True)
+        >>> r.putInCache(('b', (1,), ()), 'x' * 20000) == 'x' * 20000
+        True
+        >>> ('b', (1,), ()) in r._cache
+        False
 
-        self._cache[func][str(args)][str(kwargs)] = result
+        The result just stored is never the one evicted.
+
+        >>> r = RamCache({'maxbytes': '10000'})
+        >>> all(r.putInCache(('a', (i,), ()), 'x' * 3000) and r.isCached(('a', (i,), ()))
+        ...     for i in range(50))
+        True
+        """
+        if key in self._cache:
+            self._discard(key)
+        if self._track(key, result):
+            # evict before storing : the new entry is not a candidate
+            self._shrink()
+            self._cache[key] = result
         return result
+
+    def memoryBytes(self):
+        """
+        Bytes held by the cached results as sized when stored, None
+        without maxBytes.
+
+        >>> RamCache().memoryBytes() is None
+        True
+        >>> r = RamCache({'maxbytes': '100000', 'sizer': 'getsizeof'})
+        >>> r.putInCache(('a', (1,), ()), 'x' * 1000) == 'x' * 1000
+        True
+        >>> r.memoryBytes() == sys.getsizeof('x' * 1000)
+        True
+        >>> del(r[('a', (1,), ())])
+        >>> r.memoryBytes()
+        0
+        """
+        if self._maxBytes is None:
+            return None
+        return self._bytes
+
+    def _track(self, key, result):
+        """
+        Account the size of a result about to be stored under key. False if
+        it is larger than maxBytes, and must not be stored.
+        """
+        if self._maxBytes is None:
+            return True
+        size = self._sizer(result)
+        if size > self._maxBytes:
+            return False
+        self._sizes[key] = size
+        self._bytes += size
+        return True
+
+    def _discard(self, key):
+        """
+        Remove an entry and its size.
+        """
+        del(self._cache[key])
+        self._bytes -= self._sizes.pop(key, 0)
+
+    def _shrink(self):
+        """
+        Evict entries while over maxBytes.
+        """
+        if self._maxBytes is None:
+            return
+        while self._bytes > self._maxBytes and self._cache:
+            self._evictOne()
+            if self.stats is not None:
+                self.stats.incr('evictions')
+
+    def _evictOne(self):
+        """
+        Evict an entry, the first one in the iteration order of _cache,
+        which does not hold the entry being stored.
+        """
+        self._discard(next(iter(self._cache)))
     
 if __name__ == "__main__":
     import doctest
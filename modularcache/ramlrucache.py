@@ -1,32 +1,38 @@
 #!/usr/bin/env path
 
+from collections import OrderedDict
+
+from abstractcache import MISS
 from ramcache import RamCache
+import sizer
 
 from exceptionconfig import *
 
 class RamLRUCache(RamCache):
     """
     Ram LRU Cache.
+
+    Entries live in a single ordered map keyed by the composite cache key, least
+    recently used first : lookup, promotion and eviction are all O(1).
+    `maxBytes` evicts least recently used entries too.
     """
-    
+
     def __init__(self, config=None):
         """
         Ram Cache.
 
-        >>> r = RamLRUCache({'size' : 5}) 
+        >>> r = RamLRUCache({'size' : 5})
         >>> r #doctest: +ELLIPSIS
         <__main__.RamLRUCache object at 0x...>
         >>> r._cache
-        {}
-        >>> r._order
-        []
+        OrderedDict()
         >>> r._size
         5
         """
-        
-        RamCache.__init__(self)
 
-        self._order = []
+        RamCache.__init__(self, config)
+
+        self._cache = OrderedDict()
         self._size = int(config['size'])
 
     @classmethod
@@ -72,85 +78,160 @@ class RamLRUCache(RamCache):
         else:
             raise MissingConfigException('no size in config')
 
+        sizer.checkConf(config)
 
 
-    def cached(self, func, *args, **kwargs):
+    def get(self, key, default=MISS):
         """
+        Return the cached result, marked as most recently used, or default.
+
         >>> r = RamLRUCache({'size' : 5})
-        >>> r._cache =  {'a': {'([1, 2], {})': {'{}': 3}}}
-        >>> r.cached('a',[1, 2], {})
+        >>> r.get(('a', (1, 2), ()))
+        MISS
+        >>> r.putInCache(('a', (1, 2), ()), 3)
         3
-        >>> r._order
-        ['a||(([1, 2], {}), {})||{}']
-        >>> r._cache = {'a': {'([1, 2], {})': {'{}': 3}}, 'c': {'([1, 3], {})': {'{}': 3.1400000000000001}}, 'b': {'([1, 3], {})': {'{}': 66}}}
-        >>> r._order = ['a||(([1, 2], {}), {})||{}', 'b||(([1, 3], {}), {})||{}', 'c||(([1, 3], {}), {})||{}']
-        >>> r._order
-        ['a||(([1, 2], {}), {})||{}', 'b||(([1, 3], {}), {})||{}', 'c||(([1, 3], {}), {})||{}']
-        >>> r.cached('a',[1, 2], {})
+        >>> r.putInCache(('b', (1, 3), ()), 66)
+        66
+        >>> r.get(('a', (1, 2), ()))
         3
-        >>> r._order
-        ['b||(([1, 3], {}), {})||{}', 'c||(([1, 3], {}), {})||{}', 'a||(([1, 2], {}), {})||{}']
+        >>> [k[0] for k in r._cache]
+        ['b', 'a']
         """
-        
-        key = self._computeKey(func, args, kwargs )
+        try:
+            result = self._cache.pop(key)
+        except KeyError:
+            return default
+        self._cache[key] = result
 
-        if key in self._order:
-            self._order.remove(key)
-           
-        self._order.append(key)
-        
-        return RamCache.cached(self, func, *args, **kwargs)
-        
+        return result
+
+    def getMany(self, keys, default=MISS):
+        """
+        Return the results of keys, marked as most recently used in order.
+
+        >>> r = RamLRUCache({'size' : 5})
+        >>> r.putMany([(('a', (1, 2), ()), 3), (('b', (1, 3), ()), 66)])
+        >>> r.getMany([('a', (1, 2), ()), ('c', (1, 2), ())])
+        [3, MISS]
+        >>> [k[0] for k in r._cache]
+        ['b', 'a']
+        """
+        cache = self._cache
+        pop = cache.pop
+        results = []
+        for key in keys:
+            result = pop(key, MISS)
+            if result is MISS:
+                results.append(default)
+            else:
+                cache[key] = result
+                results.append(result)
+        return results
+
+    def isCached(self, key):
+        """
+        >>> r = RamLRUCache({'size' : 5})
+        >>> r.isCached(('a', (1, 2), ()))
+        False
+        >>> r.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> r.isCached(('a', (1, 2), ()))
+        True
+        """
+        return key in self._cache
 
-    def putInCache(self, func, result, *args, **kwargs):
+    def cached(self, key):
         """
+        Return the cached result and mark it as most recently used.
+
         >>> r = RamLRUCache({'size' : 5})
-        >>> r.putInCache('a', 3, [1, 2], {})
+        >>> r.putInCache(('a', (1, 2), ()), 3)
         3
-        >>> r._order
-        ['a||(([1, 2], {}), {})||{}']
-        >>> r.putInCache('b', 66, [1, 3], {})
+        >>> r.putInCache(('b', (1, 3), ()), 66)
         66
-        >>> r.putInCache('c', 3.14, [1, 3], {})
-        3.1400000000000001
-        >>> r._order
-        ['a||(([1, 2], {}), {})||{}', 'b||(([1, 3], {}), {})||{}', 'c||(([1, 3], {}), {})||{}']
-        >>> r._cache
-        {'a': {'([1, 2], {})': {'{}': 3}}, 'c': {'([1, 3], {})': {'{}': 3.1400000000000001}}, 'b': {'([1, 3], {})': {'{}': 66}}}
+        >>> r.putInCache(('c', (1, 3), ()), 3.5)
+        3.5
+        >>> r.cached(('a', (1, 2), ()))
+        3
+        >>> [k[0] for k in r._cache]
+        ['b', 'c', 'a']
         """
+        # pop and re-insert moves the key to the most recent end in O(1)
+        result = self._cache.pop(key)
+        self._cache[key] = result
 
-        key = self._computeKey(func, args, kwargs )
+        return result
 
-        self._order.append(key)
-        if len(self._order) >= self._size:
-            tmp = self._order.pop(0).split('||')
-            del(_cache[tmp[0]][tmp[1]][tmp[2]])
+    def putInCache(self, key, result, ttl=None):
+        """
+        Put result in cache, evicting the least recently used entry when full.
+
+        >>> r = RamLRUCache({'size' : 2})
+        >>> r.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> r.putInCache(('b', (1, 3), ()), 66)
+        66
+        >>> r.cached(('a', (1, 2), ()))
+        3
+        >>> r.putInCache(('c', (1, 3), ()), 3.5)
+        3.5
+        >>> [k[0] for k in r._cache]
+        ['a', 'c']
+        >>> r._cache.values()
+        [3, 3.5]
+        >>> r = RamLRUCache({'size' : 100, 'maxbytes': '10000'})
+        >>> for i in range(5):
+        ...     _ = r.putInCache(('a', (i,), ()), 'x' * 3000)
+        >>> [k[1][0] for k in r._cache], r.memoryBytes() <= 10000
+        ([2, 3, 4], True)
+        """
+        if key in self._cache:
+            self._discard(key)
+        elif len(self._cache) >= self._size:
+            self._evictOne()
+            if self.stats is not None:
+                self.stats.incr('evictions')
+
+        if self._track(key, result):
+            self._cache[key] = result
+            self._shrink()
+        return result
 
-        return RamCache.putInCache(self, func, result, *args, **kwargs)
-            
 
-    def _computeKey(self, func, *args, **kwargs):
+    def putMany(self, items, ttl=None):
         """
-        TODO improve compute
-        >>> r = RamLRUCache({'size' : 5})
-        >>> r._computeKey('func', ['args1', 'args2'], {'kwargs1': 'value1',})
-        \"func||(['args1', 'args2'], {'kwargs1': 'value1'})||{}\"
+        Put (key, result) pairs, evicting the least recently used entries
+        once, after the batch.
+
+        >>> r = RamLRUCache({'size' : 2})
+        >>> r.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> r.putMany([(('b', (1, 3), ()), 66), (('c', (1, 3), ()), 3.5), (('b', (1, 3), ()), 67)])
+        >>> r._cache.items()
+        [(('c', (1, 3), ()), 3.5), (('b', (1, 3), ()), 67)]
         """
-        return '||'.join([str(i) for i in  [func, args, kwargs]] )
+        if self._maxBytes is not None:
+            return RamCache.putMany(self, items, ttl)
+        cache = self._cache
+        pop = cache.pop
+        for key, result in items:
+            pop(key, None)
+            cache[key] = result
+        popitem = cache.popitem
+        evicted = len(cache) - self._size
+        for i in range(evicted):
+            popitem(last=False)
+        if evicted > 0 and self.stats is not None:
+            self.stats.incr('evictions', evicted)
 
 
-    
 class NotInteger(Exception):
     """
     >>> NotInteger('foo')
     NotInteger('foo',)
     """
     pass
-           
-            
-            
-                       
-            
+
 
 if __name__ == "__main__":
     import doctest
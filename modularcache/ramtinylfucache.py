@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+from collections import OrderedDict
+
+from abstractcache import AbstractCache, MISS
+from ramcache import RamCache
+import sizer
+
+from exceptionconfig import *
+
+
+class CountMinSketch(object):
+    """
+    Approximate access counts, 4 bits each.
+
+    Every `sampleSize` increments all counts are halved, so the sketch
+    follows recent popularity.
+    """
+
+    _depth = 4
+    _maxCount = 15
+
+    def __init__(self, size):
+        """
+        size : the number of entries of the cache.
+
+        >>> s = CountMinSketch(100)
+        >>> len(s._table), s._sampleSize
+        (512, 1000)
+        """
+        width = 1
+        while width < 4 * size:
+            width *= 2
+        self._mask = width - 1
+        self._table = [0] * width
+        self._sampleSize = 10 * size
+        self._additions = 0
+
+    def _indexes(self, key):
+        h = hash(key)
+        step = (h >> 16) | 1
+        mask = self._mask
+        return [(h + i * step) & mask for i in range(self._depth)]
+
+    def frequency(self, key):
+        """
+        >>> s = CountMinSketch(100)
+        >>> for i in range(3):
+        ...     s.increment('a')
+        >>> s.frequency('a'), s.frequency('b')
+        (3, 0)
+        """
+        table = self._table
+        return min(table[i] for i in self._indexes(key))
+
+    def increment(self, key):
+        """
+        >>> s = CountMinSketch(10)
+        >>> for i in range(50):
+        ...     s.increment('a')
+        >>> s.frequency('a')
+        15
+        >>> for i in range(100):
+        ...     s.increment(i)
+        >>> s.frequency('a') < 15
+        True
+        """
+        table = self._table
+        indexes = self._indexes(key)
+        count = min(table[i] for i in indexes)
+        if count < self._maxCount:
+            # conservative update : only the smallest counters grow
+            for i in indexes:
+                if table[i] == count:
+                    table[i] = count + 1
+        self._additions += 1
+        if self._additions >= self._sampleSize:
+            self._age()
+
+    def _age(self):
+        self._table = [count >> 1 for count in self._table]
+        self._additions //= 2
+
+
+class RamTinyLFUCache(RamCache):
+    """
+    Ram cache with the W-TinyLFU policy.
+
+    New entries go to a small LRU window. The entry leaving the window
+    enters the main cache only if it was accessed more often than the
+    entry the main cache would evict, according to a count-min sketch of
+    recent accesses. The main cache is a segmented LRU : entries hit in
+    probation move to the protected segment. A scan of one-off keys goes
+    through the window without flushing the frequently used entries.
+    `maxBytes` evicts from probation, then protected, then the window.
+    """
+
+    # share of size for the window, and of the main cache for protected
+    _windowShare = 0.01
+    _protectedShare = 0.8
+
+    def __init__(self, config=None):
+        """
+        >>> r = RamTinyLFUCache({'size' : 200})
+        >>> r._windowSize, r._protectedSize, r._mainSize
+        (2, 158, 198)
+        >>> r._cache
+        {}
+        """
+        RamCache.__init__(self, config)
+
+        self._size = int(config['size'])
+        self._windowSize = max(1, int(self._size * self._windowShare))
+        self._mainSize = max(1, self._size - self._windowSize)
+        self._protectedSize = int(self._mainSize * self._protectedShare)
+
+        # segments in LRU order, values in _cache
+        self._window = OrderedDict()
+        self._probation = OrderedDict()
+        self._protected = OrderedDict()
+        self._sketch = CountMinSketch(self._size)
+
+    @classmethod
+    def checkConf(cls, config):
+        """
+        Check configuration for Ram TinyLFU Cache.
+
+        >>> RamTinyLFUCache.checkConf({'module' : 'RamLRUCache'})
+        Traceback (most recent call last):
+        ...
+        IncoherentSectionConfig: not module RamTinyLFUCache
+        >>> RamTinyLFUCache.checkConf({'module' : 'RamTinyLFUCache'})
+        Traceback (most recent call last):
+        ...
+        MissingConfigException: no size in config
+        >>> RamTinyLFUCache.checkConf({'module' : 'RamTinyLFUCache', 'size': 'a'})
+        Traceback (most recent call last):
+        ...
+        NotInteger: size must be an integer
+        >>> RamTinyLFUCache.checkConf({'module' : 'RamTinyLFUCache', 'size': '1000', 'maxbytes': '0'})
+        Traceback (most recent call last):
+        ...
+        BadOptionValue: maxbytes must be at least 1
+        >>> RamTinyLFUCache.checkConf({'module' : 'RamTinyLFUCache', 'size': '1000'})
+        """
+        if config.get('module') != cls.__name__:
+            raise IncoherentSectionConfig('not module %s' % cls.__name__)
+
+        if not 'size' in config:
+            raise MissingConfigException('no size in config')
+        try:
+            tmp = int(config['size'])
+        except ValueError:
+            raise NotInteger('size must be an integer')
+
+        sizer.checkConf(config)
+
+    def get(self, key, default=MISS):
+        """
+        Return the cached result or default, recording the access.
+
+        >>> r = RamTinyLFUCache({'size' : 100})
+        >>> r.get(('a', (1, 2), ()))
+        MISS
+        >>> r.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> r.get(('a', (1, 2), ()))
+        3
+        """
+        self._sketch.increment(key)
+        result = self._cache.get(key, MISS)
+        if result is MISS:
+            return default
+        self._touch(key)
+        return result
+
+    def getMany(self, keys, default=MISS):
+        return AbstractCache.getMany(self, keys, default)
+
+    def cached(self, key):
+        """
+        >>> r = RamTinyLFUCache({'size' : 100})
+        >>> r.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> r.cached(('a', (1, 2), ()))
+        3
+        """
+        result = self.get(key)
+        if result is MISS:
+            raise KeyError(key)
+        return result
+
+    def _touch(self, key):
+        """
+        Move a hit entry : to the MRU end of its segment, or from probation
+        to protected.
+        """
+        if key in self._window:
+            self._window[key] = self._window.pop(key)
+        elif key in self._protected:
+            self._protected[key] = self._protected.pop(key)
+        else:
+            del(self._probation[key])
+            self._protected[key] = None
+            if len(self._protected) > self._protectedSize:
+                demoted = self._protected.popitem(last=False)[0]
+                self._probation[demoted] = None
+
+    def putInCache(self, key, result, ttl=None):
+        """
+        Put result in the window, then admit the entry leaving the window
+        into the main cache or drop it.
+
+        >>> r = RamTinyLFUCache({'size' : 100})
+        >>> for i in range(100):
+        ...     _ = r.putInCache(('a', (i,), ()), i)
+        >>> len(r._cache)
+        100
+
+        Frequently read entries stay while a scan goes through.
+
+        >>> for n in range(5):
+        ...     for i in range(50):
+        ...         _ = r.get(('a', (i,), ()))
+        >>> for i in range(1000):
+        ...     if r.get(('scan', (i,), ())) is MISS:
+        ...         _ = r.putInCache(('scan', (i,), ()), i)
+        >>> len(r._cache)
+        100
+        >>> len([i for i in range(50) if r.isCached(('a', (i,), ()))])
+        50
+
+        maxBytes evicts entries until the results fit, a result larger
+        than maxBytes is not stored.
+
+        >>> r = RamTinyLFUCache({'size' : 100, 'maxbytes': '10000'})
+        >>> for i in range(5):
+        ...     _ = r.putInCache(('a', (i,), ()), 'x' * 3000)
+        >>> len(r._cache), r.memoryBytes() <= 10000
+        (3, True)
+        >>> _ = r.putInCache(('a', (4,), ()), 'x' * 6000)
+        >>> len(r._cache), r.memoryBytes() <= 10000
+        (2, True)
+        >>> _ = r.putInCache(('a', (4,), ()), 'x' * 20000)
+        >>> r.isCached(('a', (4,), ())), len(r._window) + len(r._probation) + len(r._protected)
+        (False, 1)
+        """
+        if key in self._cache:
+            self._bytes -= self._sizes.pop(key, 0)
+            if not self._track(key, result):
+                self._discard(key)
+                return result
+            self._cache[key] = result
+            self._touch(key)
+            self._shrink()
+            return result
+
+        if not self._track(key, result):
+            return result
+        self._cache[key] = result
+        self._window[key] = None
+        if len(self._window) > self._windowSize:
+            self._admit(self._window.popitem(last=False)[0])
+        self._shrink()
+        return result
+
+    def _admit(self, candidate):
+        """
+        Move the candidate leaving the window to probation, evicting the
+        least used of it and the main cache victim when the main cache is
+        full.
+        """
+        if len(self._probation) + len(self._protected) < self._mainSize:
+            self._probation[candidate] = None
+            return
+
+        victims = self._probation or self._protected
+        victim = next(iter(victims))
+        sketch = self._sketch
+        if sketch.frequency(candidate) > sketch.frequency(victim):
+            self._discard(victim)
+            self._probation[candidate] = None
+        else:
+            self._discard(candidate)
+        if self.stats is not None:
+            self.stats.incr('evictions')
+
+    def putMany(self, items, ttl=None):
+        AbstractCache.putMany(self, items, ttl)
+
+    def _discard(self, key):
+        RamCache._discard(self, key)
+        for segment in (self._window, self._probation, self._protected):
+            segment.pop(key, None)
+
+    def _evictOne(self):
+        """
+        Evict the least recently used entry of probation, else of
+        protected, else of the window.
+        """
+        for segment in (self._probation, self._protected, self._window):
+            if segment:
+                self._discard(next(iter(segment)))
+                return
+
+
+class NotInteger(Exception):
+    """
+    >>> NotInteger('foo')
+    NotInteger('foo',)
+    """
+    pass
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
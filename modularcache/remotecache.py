@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+
+import binascii
+import os
+import socket
+import threading
+import time
+import weakref
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import BytesIO as StringIO
+
+from abstractcache import AbstractCache, MISS
+from cachekey import digestKey
+from cacheserver import (GET, PUT, OK, MISSING, MAX_COUNT, BadAddress, parseAddress,
+                         readExactly, _REQUEST, _REPLY, _LENGTH)
+from configoptions import getInteger, getNumber
+import serializers
+from exceptionconfig import *
+
+
+class RemoteCache(AbstractCache):
+    """
+    Cache on a cacheserver, shared by several hosts.
+
+    Each thread keeps its own persistent connection to address. getMany
+    and putMany split keys in frames of batchSize and send all of them
+    before reading the replies. A lookup that fails or takes more than
+    timeout seconds is a miss, a put is dropped : the connection is then
+    closed and the server is not tried again for retryDelay seconds.
+
+    Only the thread local holds a connection strongly : the connection of
+    a thread that ended is closed when its thread local is collected.
+    """
+
+    blocking = True
+
+    def __init__(self, config):
+        """
+        Cache on a cacheserver.
+
+        >>> r = RemoteCache({'address': '127.0.0.1:11311'})
+        >>> r._timeout, r._batchSize, r._ttl is None
+        (0.5, 100, True)
+        """
+        AbstractCache.__init__(self, config)
+
+        self._family, self._address = parseAddress(config['address'])
+        self._timeout = getNumber(config, 'timeout', 0.5)
+        self._retryDelay = getNumber(config, 'retrydelay', 1.0)
+        self._batchSize = getInteger(config, 'batchsize', 100)
+        # None : the expiry of the server section
+        self._ttl = getInteger(config, 'expirationdelay')
+        self._serializer = serializers.getSerializer(config.get('serializer', 'pickle'))
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # the connections of the live threads, for close
+        self._connections = weakref.WeakSet()
+        self._downUntil = 0
+
+    def _connection(self):
+        """
+        Return the connection of the current thread, connecting it if
+        needed, None while the server is deemed down.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and connection.pid == os.getpid():
+            return connection
+        if time.time() < self._downUntil:
+            return None
+
+        sock = socket.socket(self._family, socket.SOCK_STREAM)
+        sock.settimeout(self._timeout)
+        try:
+            sock.connect(self._address)
+        except socket.error:
+            sock.close()
+            self._failed()
+            return None
+        if self._family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        connection = self._local.connection = _Connection(sock)
+        self._lock.acquire()
+        try:
+            self._connections.add(connection)
+        finally:
+            self._lock.release()
+        return connection
+
+    def _failed(self):
+        """
+        Drop the connection of the current thread after an error.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            self._local.connection = None
+            self._lock.acquire()
+            try:
+                self._connections.discard(connection)
+            finally:
+                self._lock.release()
+            connection.close()
+        self._downUntil = time.time() + self._retryDelay
+        if self.stats is not None:
+            self.stats.incr('errors')
+
+    def _batches(self, items):
+        return [items[i:i + self._batchSize] for i in range(0, len(items), self._batchSize)]
+
+    def get(self, key, default=MISS):
+        """
+        Return the cached result or default.
+
+        >>> server, thread = _startServer()
+        >>> r = RemoteCache({'address': server.address})
+        >>> r.get(('a', (1, 2), ()))
+        MISS
+        >>> r.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> r.get(('a', (1, 2), ()))
+        3
+        >>> r.close()
+        >>> _stopServer(server, thread)
+
+        The server may listen on a Unix socket.
+
+        >>> import tempfile
+        >>> server, thread = _startServer(os.path.join(tempfile.mkdtemp(), 'cache.sock'))
+        >>> r = RemoteCache({'address': server.address})
+        >>> r.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> r.get(('a', (1, 2), ()))
+        3
+        >>> r.close()
+        >>> _stopServer(server, thread)
+        """
+        return self.getMany([key], default)[0]
+
+    def getMany(self, keys, default=MISS):
+        """
+        Return the results of keys, in order, default for the missing
+        ones, in pipelined frames.
+
+        >>> server, thread = _startServer()
+        >>> r = RemoteCache({'address': server.address, 'batchsize': '2'})
+        >>> r.putMany([(('a', (i,), ()), i) for i in range(5)])
+        >>> r.getMany([('a', (i,), ()) for i in range(6)])
+        [0, 1, 2, 3, 4, MISS]
+
+        Each thread has its connection.
+
+        >>> results = []
+        >>> threads = [threading.Thread(target=lambda: results.append(r.get(('a', (1,), ()))))
+        ...            for i in range(3)]
+        >>> for t in threads:
+        ...     t.start()
+        >>> for t in threads:
+        ...     t.join()
+        >>> results
+        [1, 1, 1]
+
+        The connections of the threads that ended are closed : the server
+        only keeps a thread for the connection of this one.
+
+        >>> threads = [threading.Thread(target=lambda: r.get(('a', (1,), ())))
+        ...            for i in range(50)]
+        >>> for t in threads:
+        ...     t.start()
+        >>> for t in threads:
+        ...     t.join()
+        >>> deadline = time.time() + 5
+        >>> while ((len(r._connections) > 1 or threading.active_count() > 3)
+        ...        and time.time() < deadline):
+        ...     time.sleep(0.01)
+        >>> len(r._connections), threading.active_count()
+        (1, 3)
+        >>> r.close()
+        >>> _stopServer(server, thread)
+
+        A server that does not answer in time gives misses, and is not
+        tried again for retryDelay.
+
+        >>> mute = socket.socket()
+        >>> mute.bind(('127.0.0.1', 0))
+        >>> mute.listen(1)
+        >>> r = RemoteCache({'address': '127.0.0.1:%d' % mute.getsockname()[1],
+        ...                  'timeout': '0.1'})
+        >>> r.getMany([('a', (1,), ()), ('a', (2,), ())])
+        [MISS, MISS]
+        >>> start = time.time()
+        >>> r.get(('a', (1,), ())), time.time() - start < 0.1
+        (MISS, True)
+        >>> r.stats.snapshot()['errors']
+        1
+        >>> mute.close()
+        """
+        if not keys:
+            return []
+        connection = self._connection()
+        if connection is None:
+            return [default] * len(keys)
+
+        batches = self._batches([_digest(key) for key in keys])
+        request = b''.join(_REQUEST.pack(GET, len(batch), -1) + b''.join(batch)
+                           for batch in batches)
+        payloads = []
+        try:
+            connection.sock.sendall(request)
+            for batch in batches:
+                status, count = _REPLY.unpack(readExactly(connection.rfile, _REPLY.size))
+                if status != OK or count != len(batch):
+                    raise EOFError('bad reply')
+                for i in range(count):
+                    length = _LENGTH.unpack(readExactly(connection.rfile, _LENGTH.size))[0]
+                    if length == MISSING:
+                        payloads.append(None)
+                    else:
+                        payloads.append(readExactly(connection.rfile, length))
+        except (socket.error, EOFError):
+            self._failed()
+            return [default] * len(keys)
+
+        return [default if payload is None else serializers.load(StringIO(payload))
+                for payload in payloads]
+
+    def isCached(self, key):
+        """
+        >>> server, thread = _startServer()
+        >>> r = RemoteCache({'address': server.address})
+        >>> r.isCached(('a', (1, 2), ()))
+        False
+        >>> r.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> r.isCached(('a', (1, 2), ()))
+        True
+        >>> r.close()
+        >>> _stopServer(server, thread)
+        """
+        return self.get(key) is not MISS
+
+    def cached(self, key):
+        """
+        >>> server, thread = _startServer()
+        >>> r = RemoteCache({'address': server.address})
+        >>> r.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> r.cached(('a', (1, 2), ()))
+        3
+        >>> r.close()
+        >>> _stopServer(server, thread)
+        """
+        result = self.get(key)
+        if result is MISS:
+            raise KeyError(key)
+        return result
+
+    def putInCache(self, key, result, ttl=None):
+        """
+        Put result on the server, expiring after ttl seconds,
+        expirationdelay by default, else the expiry of the server section.
+
+        >>> server, thread = _startServer()
+        >>> r = RemoteCache({'address': server.address, 'expirationdelay': '30'})
+        >>> r.putInCache(('a', (1, 2), ()), [1, 2])
+        [1, 2]
+        >>> r.putInCache(('b', (1, 2), ()), 4, ttl=0)
+        4
+        >>> r.getMany([('a', (1, 2), ()), ('b', (1, 2), ())])
+        [[1, 2], MISS]
+        >>> r.close()
+        >>> _stopServer(server, thread)
+        """
+        self.putMany([(key, result)], ttl)
+        return result
+
+    def putMany(self, items, ttl=None):
+        """
+        Put (key, result) pairs on the server, in pipelined frames.
+
+        >>> server, thread = _startServer()
+        >>> r = RemoteCache({'address': server.address, 'batchsize': '2'})
+        >>> r.putMany([(('a', (i,), ()), i) for i in range(5)])
+        >>> server.cache.stats.snapshot()['puts']
+        5
+        >>> r.close()
+        >>> _stopServer(server, thread)
+        """
+        if not items:
+            return
+        connection = self._connection()
+        if connection is None:
+            return
+
+        if ttl is None:
+            ttl = self._ttl
+        records = []
+        for key, result in items:
+            out = StringIO()
+            serializers.dump(result, out, self._serializer)
+            payload = out.getvalue()
+            records.append(_digest(key) + _LENGTH.pack(len(payload)) + payload)
+
+        batches = self._batches(records)
+        request = b''.join(_REQUEST.pack(PUT, len(batch), -1 if ttl is None else ttl)
+                           + b''.join(batch) for batch in batches)
+        try:
+            connection.sock.sendall(request)
+            for batch in batches:
+                status, count = _REPLY.unpack(readExactly(connection.rfile, _REPLY.size))
+                if status != OK or count != len(batch):
+                    raise EOFError('bad reply')
+        except (socket.error, EOFError):
+            self._failed()
+
+    def close(self):
+        """
+        Close the connections of every thread.
+        """
+        self._lock.acquire()
+        try:
+            connections = list(self._connections)
+            self._connections.clear()
+        finally:
+            self._lock.release()
+        for connection in connections:
+            connection.close()
+
+    @staticmethod
+    def checkConf(config):
+        """
+        Check configuration for remote Cache.
+
+        >>> RemoteCache.checkConf({})
+        Traceback (most recent call last):
+        ...
+        IncoherentSectionConfig: not module RemoteCache
+        >>> RemoteCache.checkConf({'module': 'RemoteCache'})
+        Traceback (most recent call last):
+        ...
+        MissingConfigException: no address in config
+        >>> RemoteCache.checkConf({'module': 'RemoteCache', 'address': 'localhost:port'})
+        Traceback (most recent call last):
+        ...
+        BadAddress: localhost:port
+        >>> RemoteCache.checkConf({'module': 'RemoteCache', 'address': 'localhost:11311', 'batchsize': '0'})
+        Traceback (most recent call last):
+        ...
+        BadOptionValue: batchsize must be at least 1
+        >>> RemoteCache.checkConf({'module': 'RemoteCache', 'address': 'localhost:11311', 'batchsize': '20000'})
+        Traceback (most recent call last):
+        ...
+        BadOptionValue: batchsize must be at most 10000
+        >>> RemoteCache.checkConf({'module': 'RemoteCache', 'address': 'localhost:11311', 'timeout': '0.2'})
+        """
+        try:
+            if config['module'] != 'RemoteCache':
+                raise IncoherentSectionConfig('not module RemoteCache')
+        except KeyError:
+            raise IncoherentSectionConfig('not module RemoteCache')
+
+        if not 'address' in config:
+            raise MissingConfigException('no address in config')
+        parseAddress(config['address'])
+
+        for option in ['timeout', 'retrydelay']:
+            if getNumber(config, option, 1) <= 0:
+                raise BadOptionValue('%s must be positive' % option)
+        batchSize = getInteger(config, 'batchsize', 1)
+        if batchSize < 1:
+            raise BadOptionValue('batchsize must be at least 1')
+        if batchSize > MAX_COUNT:
+            raise BadOptionValue('batchsize must be at most %d' % MAX_COUNT)
+        getInteger(config, 'expirationdelay')
+        serializers.getSerializer(config.get('serializer', 'pickle'))
+
+
+class _Connection(object):
+    """
+    A socket with a buffered reader, owned by one thread of one process,
+    closed when collected.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.rfile = sock.makefile('rb')
+        self.pid = os.getpid()
+
+    def close(self):
+        try:
+            self.rfile.close()
+            self.sock.close()
+        except socket.error:
+            pass
+
+    def __del__(self):
+        self.close()
+
+
+def _digest(key):
+    """
+    Raw sha1 of a key, 20 bytes.
+    """
+    return binascii.unhexlify(digestKey(key))
+
+
+def _startServer(address='127.0.0.1:0'):
+    """
+    Serve a TimeLimitedRamCache, on a free localhost port by default, for
+    doctests.
+    """
+    from cacheserver import CacheServer
+    from timelimitedramcache import TimeLimitedRamCache
+
+    server = CacheServer(address, TimeLimitedRamCache({'duration': '60'}))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    return server, thread
+
+
+def _stopServer(server, thread):
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
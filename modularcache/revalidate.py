@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+
+class Stamped(object):
+    """
+    A cached value with the wall clock time until which it is fresh.
+
+    Wall clock rather than monotonic time, since FsCache entries outlive
+    the process.
+
+    >>> s = Stamped(3, time.time() + 60)
+    >>> s.value
+    3
+    >>> s.isFresh()
+    True
+    >>> Stamped(3, time.time() - 1).isFresh()
+    False
+    """
+
+    def __init__(self, value, freshUntil):
+        self.value = value
+        self.freshUntil = freshUntil
+
+    def isFresh(self, now=None):
+        if now is None:
+            now = time.time()
+        return now < self.freshUntil
+
+
+class Revalidator(object):
+    """
+    Refresh stale entries on a background thread pool, at most one refresh
+    per key at a time.
+    """
+
+    def __init__(self, workers=4):
+        """
+        >>> r = Revalidator(2)
+        >>> r._pending
+        set([])
+        """
+        self._workers = workers
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pending = set()
+
+    def submit(self, key, fctn, *args):
+        """
+        Run fctn(*args) in background unless a refresh of key is pending.
+        Return True if the refresh was scheduled.
+
+        >>> r = Revalidator(2)
+        >>> done = threading.Event()
+        >>> def refresh():
+        ...     done.wait()
+        >>> r.submit('k', refresh)
+        True
+        >>> r.submit('k', refresh)
+        False
+        >>> done.set()
+        >>> r.join()
+        >>> r._pending
+        set([])
+        """
+        self._lock.acquire()
+        try:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+            if self._pool is None:
+                self._pool = ThreadPool(self._workers)
+        finally:
+            self._lock.release()
+
+        self._pool.apply_async(self._run, (key, fctn, args))
+        return True
+
+    def join(self):
+        """
+        Wait for the pending refreshes.
+        """
+        while self._pending:
+            time.sleep(0.01)
+
+    def _run(self, key, fctn, args):
+        try:
+            fctn(*args)
+        except Exception:
+            # the stale value is served until it expires; the next
+            # foreground call then raises the error itself
+            pass
+        finally:
+            self._lock.acquire()
+            try:
+                self._pending.discard(key)
+            finally:
+                self._lock.release()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
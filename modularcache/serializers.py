@@ -0,0 +1,530 @@
+#!/usr/bin/env python
+"""
+Serializers of FsCache entries.
+
+An entry starts with the one byte tag of the serializer that wrote it,
+so entries written with different serializers can be read back whatever
+the current setting of the section. Bytes values are always written raw.
+
+A compressed entry is the 'Z' tag, the one byte tag of its codec, then
+the compressed entry : compressed and plain entries coexist.
+"""
+
+import array
+import bz2
+import marshal
+import struct
+import zlib
+
+try:
+    import cPickle
+except ImportError:
+    import pickle as cPickle
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import BytesIO as StringIO
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+from exceptionconfig import *
+
+
+class Serializer(object):
+    """
+    Write a value after its tag, read it back.
+    """
+    tag = None
+
+    def dump(self, value, fileobj):
+        raise NotImplementedError
+
+    def load(self, fileobj):
+        raise NotImplementedError
+
+
+class PickleSerializer(Serializer):
+    """
+    Pickle, highest protocol.
+
+    >>> _roundTrip(PickleSerializer(), {'a': [1, 2.5]})
+    ('P', {'a': [1, 2.5]})
+    """
+    tag = b'P'
+
+    def dump(self, value, fileobj):
+        fileobj.write(self.tag)
+        cPickle.dump(value, fileobj, cPickle.HIGHEST_PROTOCOL)
+
+    def load(self, fileobj):
+        return cPickle.load(fileobj)
+
+
+class MarshalSerializer(Serializer):
+    """
+    marshal, for builtin types only : a value holding an object of any
+    other type, at any depth, is pickled. marshal would write some of
+    them, like arrays or subclasses of builtin types, as their base type.
+
+    >>> _roundTrip(MarshalSerializer(), [1, 2.5, u'a', (None, True)])
+    ('M', [1, 2.5, u'a', (None, True)])
+    >>> _roundTrip(MarshalSerializer(), {'a': frozenset([2])})
+    ('M', {'a': frozenset([2])})
+    >>> _roundTrip(MarshalSerializer(), [1, Serializer()])[0]
+    'P'
+    >>> _roundTrip(MarshalSerializer(), array.array('d', [1.0]))
+    ('P', array('d', [1.0]))
+    >>> _roundTrip(MarshalSerializer(), {'a': array.array('d', [1.0])})
+    ('P', {'a': array('d', [1.0])})
+    >>> _roundTrip(MarshalSerializer(), {'a': {'b': array.array('d', [1.0])}})
+    ('P', {'a': {'b': array('d', [1.0])}})
+    >>> _roundTrip(MarshalSerializer(), [[bytearray(b'x')]])
+    ('P', [[bytearray(b'x')]])
+    """
+    tag = b'M'
+
+    def dump(self, value, fileobj):
+        if not _marshalNative(value):
+            return SERIALIZERS['pickle'].dump(value, fileobj)
+        try:
+            data = marshal.dumps(value)
+        except ValueError:
+            # nested too deep
+            return SERIALIZERS['pickle'].dump(value, fileobj)
+        fileobj.write(self.tag)
+        fileobj.write(data)
+
+    def load(self, fileobj):
+        return marshal.loads(fileobj.read())
+
+
+class RawSerializer(Serializer):
+    """
+    Bytes written as they are.
+
+    >>> _roundTrip(RawSerializer(), 'some bytes')
+    ('R', 'some bytes')
+    >>> _roundTrip(RawSerializer(), 3)
+    Traceback (most recent call last):
+    ...
+    TypeError: raw serializer only stores bytes, not int
+    """
+    tag = b'R'
+
+    def dump(self, value, fileobj):
+        if not isinstance(value, bytes):
+            raise TypeError('raw serializer only stores bytes, not %s' % type(value).__name__)
+        fileobj.write(self.tag)
+        fileobj.write(value)
+
+    def load(self, fileobj):
+        return fileobj.read()
+
+
+class BufferSerializer(Serializer):
+    """
+    Pickle with large buffers out of band : bytes, bytearray and array
+    values of at least minBytes are not copied in the pickle stream but
+    written directly to the file after it. Only the value itself and the
+    members of a small dict, list or tuple are looked at ; other values
+    are pickled as they are.
+
+    Layout : tag, buffer count, pickle length, one (kind, typecode, length)
+    record per buffer, the pickle, then the buffers, each one starting on a
+    64 bytes boundary.
+
+    >>> big = array.array('d', range(10000))
+    >>> tag, value = _roundTrip(BufferSerializer(), {'x': big, 'y': 'z' * 5000, 'n': 1})
+    >>> tag
+    'B'
+    >>> value['x'] == big, value['y'] == 'z' * 5000, value['n']
+    (True, True, 1)
+    >>> out = StringIO()
+    >>> BufferSerializer().dump(big, out)
+    >>> len(out.getvalue()) - big.itemsize * len(big) < 200
+    True
+    >>> _roundTrip(BufferSerializer(), [1.5] * 10000)[0]
+    'P'
+    """
+    tag = b'B'
+
+    _header = struct.Struct('<IQ')
+    _record = struct.Struct('<ccQ')
+    _align = 64
+
+    def __init__(self, minBytes=1024):
+        self._minBytes = minBytes
+
+    def _large(self, obj):
+        kind = _BUFFER_KINDS.get(type(obj))
+        return kind is not None and _nbytes(obj) >= self._minBytes
+
+    def dump(self, value, fileobj):
+        large = set(id(obj) for obj in _members(value) if self._large(obj))
+        if not large:
+            return SERIALIZERS['pickle'].dump(value, fileobj)
+
+        buffers = []
+        def persistentId(obj):
+            if id(obj) not in large:
+                return None
+            buffers.append((_BUFFER_KINDS[type(obj)], obj))
+            return len(buffers) - 1
+
+        data = _dumpPickle(value, persistentId)
+
+        fileobj.write(self.tag)
+        fileobj.write(self._header.pack(len(buffers), len(data)))
+        for kind, obj in buffers:
+            typecode = obj.typecode.encode('ascii') if kind == b'a' else b' '
+            fileobj.write(self._record.pack(kind, typecode, _nbytes(obj)))
+        fileobj.write(data)
+
+        offset = (len(self.tag) + self._header.size + self._record.size * len(buffers) +
+                  len(data))
+        for kind, obj in buffers:
+            padding = -offset % self._align
+            fileobj.write(b'\0' * padding)
+            fileobj.write(obj)
+            offset += padding + _nbytes(obj)
+
+    def load(self, fileobj):
+        # the tag was read already : it sits just before the data
+        return self.loadFrom(fileobj.read(), -len(self.tag))
+
+    def loadFrom(self, data, start, views=False):
+        """
+        Load an entry from a buffer holding it, its tag at offset start.
+        With views, out of band buffers are read-only views of data
+        instead of copies.
+        """
+        offset = start + len(self.tag)
+        count, size = self._header.unpack_from(data, offset)
+        offset += self._header.size
+
+        records = []
+        for i in range(count):
+            records.append(self._record.unpack_from(data, offset))
+            offset += self._record.size
+
+        pickled = data[offset:offset + size]
+        offset += size
+
+        buffers = []
+        for kind, typecode, length in records:
+            offset += -(offset - start) % self._align
+            typecode = typecode.decode('ascii')
+            if views:
+                buffers.append(_view(data, offset, length, typecode if kind == b'a' else None))
+            else:
+                buffers.append(self._makeBuffer(kind, typecode, data, offset, length))
+            offset += length
+
+        return _loadPickle(pickled, buffers.__getitem__)
+
+    def _makeBuffer(self, kind, typecode, data, offset, length):
+        """
+        Rebuild a buffer value from length bytes of data at offset.
+        """
+        raw = data[offset:offset + length]
+        if kind == b'b':
+            return bytearray(raw)
+        if kind == b'a':
+            return array.array(typecode, raw)
+        return bytes(raw)
+
+
+# containers larger than this are not looked into for buffers
+_MAX_MEMBERS = 256
+
+def _members(value):
+    """
+    The value, or the members of a small dict, list or tuple : where the
+    serializers look for buffers, at a bounded cost.
+
+    >>> _members({'a': 1})
+    [1]
+    >>> _members(range(1000)) == [range(1000)]
+    True
+    """
+    kind = type(value)
+    if kind is dict and len(value) <= _MAX_MEMBERS:
+        return value.values()
+    if kind in (list, tuple) and len(value) <= _MAX_MEMBERS:
+        return value
+    return [value]
+
+# types marshal writes and reads back as they are
+_MARSHAL_SCALARS = set([type(None), bool, int, float, complex, bytes, type(u'')])
+try:
+    _MARSHAL_SCALARS.add(long)
+except NameError:
+    pass
+_MARSHAL_CONTAINERS = set([tuple, list, set, frozenset])
+
+def _marshalNative(value):
+    """
+    Whether value and everything it holds have exact marshal types.
+
+    >>> _marshalNative({'a': [1, (2.5, None)], 'b': set([u'c'])}), _marshalNative(3)
+    (True, True)
+    >>> _marshalNative({'a': {'b': bytearray(b'x')}})
+    False
+    >>> class Int(int):
+    ...     pass
+    >>> _marshalNative([[Int(1)]])
+    False
+    >>> loop = [1]
+    >>> loop.append(loop)
+    >>> _marshalNative(loop)
+    False
+    """
+    if type(value) in _MARSHAL_SCALARS:
+        return True
+    # walked a level at a time : scalars are filtered out in bulk
+    level = [value]
+    seen = set()
+    while level:
+        members = []
+        for obj in level:
+            kind = type(obj)
+            if kind is dict:
+                members.extend(obj)
+                members.extend(obj.values())
+            elif kind in _MARSHAL_CONTAINERS:
+                members.extend(obj)
+            else:
+                return False
+        # marshal does not keep shared or recursive references
+        ids = set(map(id, level))
+        if len(ids) < len(level) or not seen.isdisjoint(ids):
+            return False
+        seen.update(ids)
+        if _MARSHAL_SCALARS.issuperset(map(type, members)):
+            return True
+        level = [member for member in members if type(member) not in _MARSHAL_SCALARS]
+    return True
+
+# kinds of out of band buffers
+_BUFFER_KINDS = {bytes: b's', bytearray: b'b', array.array: b'a'}
+
+def _nbytes(obj):
+    if type(obj) is array.array:
+        return obj.itemsize * len(obj)
+    return len(obj)
+
+def _view(data, offset, length, typecode=None):
+    """
+    Read-only view of length bytes of data at offset, typed like an array
+    when the memoryview can.
+    """
+    try:
+        view = memoryview(data)[offset:offset + length]
+    except TypeError:
+        # python 2 mmap only has the old buffer interface
+        return buffer(data, offset, length)
+    if typecode is not None and hasattr(view, 'cast'):
+        view = view.cast(typecode)
+    return view
+
+def _dumpPickle(value, persistentId):
+    out = StringIO()
+    pickler = cPickle.Pickler(out, cPickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = persistentId
+    pickler.dump(value)
+    return out.getvalue()
+
+def _loadPickle(data, persistentLoad):
+    unpickler = cPickle.Unpickler(StringIO(data))
+    unpickler.persistent_load = persistentLoad
+    return unpickler.load()
+
+
+SERIALIZERS = {
+    'pickle': PickleSerializer(),
+    'marshal': MarshalSerializer(),
+    'raw': RawSerializer(),
+    'buffers': BufferSerializer(),
+}
+
+_BY_TAG = dict((s.tag, s) for s in SERIALIZERS.values())
+
+
+def registerSerializer(name, serializer):
+    """
+    Make a serializer available to the serializer option.
+
+    >>> class Upper(RawSerializer):
+    ...     tag = b'U'
+    >>> registerSerializer('upper', Upper())
+    >>> getSerializer('upper') #doctest: +ELLIPSIS
+    <__main__.Upper object at 0x...>
+    >>> registerSerializer('upper2', Upper())
+    Traceback (most recent call last):
+    ...
+    ValueError: tag 'U' already used
+    """
+    if serializer.tag in _BY_TAG and _BY_TAG[serializer.tag] is not serializer:
+        raise ValueError('tag %r already used' % serializer.tag)
+    SERIALIZERS[name] = serializer
+    _BY_TAG[serializer.tag] = serializer
+
+
+def getSerializer(name):
+    """
+    Return a registered serializer.
+
+    >>> getSerializer('pickle') #doctest: +ELLIPSIS
+    <__main__.PickleSerializer object at 0x...>
+    >>> getSerializer('json')
+    Traceback (most recent call last):
+    ...
+    IncoherentSectionConfig: unknown serializer json
+    """
+    try:
+        return SERIALIZERS[name]
+    except KeyError:
+        raise IncoherentSectionConfig('unknown serializer %s' % name)
+
+
+def dump(value, fileobj, serializer):
+    """
+    Write value with serializer; bytes values skip it and are written raw.
+
+    >>> out = StringIO()
+    >>> dump('abc', out, getSerializer('pickle'))
+    >>> out.getvalue()
+    'Rabc'
+    """
+    if type(value) is bytes:
+        serializer = SERIALIZERS['raw']
+    serializer.dump(value, fileobj)
+
+
+def load(fileobj):
+    """
+    Read a value written by dump, whatever its serializer.
+
+    >>> load(StringIO('Rabc'))
+    'abc'
+    >>> load(StringIO('?abc'))
+    Traceback (most recent call last):
+    ...
+    ValueError: unknown serializer tag '?'
+    """
+    tag = fileobj.read(1)
+    if tag == _COMPRESSED_TAG:
+        codec = fileobj.read(1)
+        try:
+            decompress = _DECOMPRESS_BY_TAG[codec]
+        except KeyError:
+            raise ValueError('unknown compression tag %r' % codec)
+        return load(StringIO(decompress(fileobj.read())))
+    try:
+        serializer = _BY_TAG[tag]
+    except KeyError:
+        raise ValueError('unknown serializer tag %r' % tag)
+    return serializer.load(fileobj)
+
+
+_COMPRESSED_TAG = b'Z'
+
+# name : (tag, compress, decompress)
+COMPRESSIONS = {
+    'zlib': (b'z', zlib.compress, zlib.decompress),
+    'bz2': (b'b', bz2.compress, bz2.decompress),
+}
+if lzma is not None:
+    COMPRESSIONS['lzma'] = (b'x', lzma.compress, lzma.decompress)
+
+_DECOMPRESS_BY_TAG = dict((tag, decompress) for tag, compress, decompress in COMPRESSIONS.values())
+
+
+def checkCompression(name):
+    """
+    Check a compression name.
+
+    >>> checkCompression('zlib')
+    >>> checkCompression('zip')
+    Traceback (most recent call last):
+    ...
+    IncoherentSectionConfig: unknown compression zip
+    """
+    if name not in COMPRESSIONS:
+        raise IncoherentSectionConfig('unknown compression %s' % name)
+
+
+def dumpCompressed(value, fileobj, serializer, compression, minBytes=0):
+    """
+    Write value like dump, compressed when its entry is at least minBytes
+    long and compression makes it smaller.
+
+    >>> out = StringIO()
+    >>> dumpCompressed(['abc'] * 1000, out, getSerializer('pickle'), 'zlib')
+    >>> data = out.getvalue()
+    >>> data[:2], len(data) < 100
+    ('Zz', True)
+    >>> load(StringIO(data)) == ['abc'] * 1000
+    True
+    >>> out = StringIO()
+    >>> dumpCompressed(['abc'] * 1000, out, getSerializer('pickle'), 'bz2', 1000000)
+    >>> out.getvalue()[:1]
+    'P'
+    """
+    out = StringIO()
+    dump(value, out, serializer)
+    data = out.getvalue()
+
+    if len(data) >= minBytes:
+        tag, compress, decompress = COMPRESSIONS[compression]
+        compressed = compress(data)
+        if len(compressed) + 2 < len(data):
+            fileobj.write(_COMPRESSED_TAG + tag)
+            fileobj.write(compressed)
+            return
+    fileobj.write(data)
+
+
+# tags whose payload can be read without copy from a mapped entry
+MAPPED_TAGS = frozenset([b'R', b'B'])
+
+
+def loadMapped(data):
+    """
+    Read a value from a mapped entry whose tag is in MAPPED_TAGS : bytes
+    and out of band buffers come back as read-only views of data.
+
+    >>> data = StringIO()
+    >>> dump(array.array('b', range(100)) * 20, data, getSerializer('buffers'))
+    >>> view = loadMapped(data.getvalue())
+    >>> type(view) in (buffer, memoryview), len(view)
+    (True, 2000)
+    >>> bytearray(loadMapped('Rabc'))
+    bytearray(b'abc')
+    """
+    tag = data[:1]
+    if tag == b'R':
+        return _view(data, 1, len(data) - 1)
+    return SERIALIZERS['buffers'].loadFrom(data, 0, views=True)
+
+
+def _roundTrip(serializer, value):
+    """
+    Return (tag, loaded value) of value written with serializer.
+    """
+    out = StringIO()
+    dump(value, out, serializer)
+    data = out.getvalue()
+    return data[0], load(StringIO(data))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+
+import bisect
+import hashlib
+
+from abstractcache import AbstractCache, MISS
+from cachedict import CacheDict
+from cachekey import digestKey
+from configoptions import getInteger
+
+import exceptionconfig
+from exceptionconfig import *
+
+
+class HashRing(object):
+    """
+    Consistent hash ring : each node owns the arcs ending at its virtual
+    nodes, a key goes to the owner of its point. Adding or removing one
+    of N nodes moves about 1/N of the keys, to or from that node only.
+    """
+
+    def __init__(self, nodes, vnodes=160):
+        """
+        >>> ring = HashRing(['fs1', 'fs2', 'fs3'], 10)
+        >>> len(ring._points)
+        30
+        """
+        self._vnodes = vnodes
+        self._points = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        """
+        Add node and its virtual nodes.
+
+        >>> ring = HashRing(['fs1'], 10)
+        >>> ring.add('fs2')
+        >>> sorted(set(ring._owners))
+        ['fs1', 'fs2']
+        """
+        for i in range(self._vnodes):
+            point = _point('%s#%d' % (node, i))
+            position = bisect.bisect(self._points, point)
+            self._points.insert(position, point)
+            self._owners.insert(position, node)
+
+    def remove(self, node):
+        """
+        >>> ring = HashRing(['fs1', 'fs2'], 10)
+        >>> ring.remove('fs1')
+        >>> sorted(set(ring._owners)), len(ring._points)
+        (['fs2'], 10)
+        """
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners)
+                if owner != node]
+        self._points = [point for point, owner in kept]
+        self._owners = [owner for point, owner in kept]
+
+    def node(self, digest):
+        """
+        Return the node of a key hexdigest, as given by cachekey.digestKey.
+
+        Keys spread over the nodes within 15% of an even share with 160
+        virtual nodes, closer with more.
+
+        >>> ring = HashRing(['fs1', 'fs2', 'fs3'])
+        >>> digests = [digestKey(('f', (i,), ())) for i in range(30000)]
+        >>> nodes = [ring.node(digest) for digest in digests]
+        >>> counts = [nodes.count(node) for node in ['fs1', 'fs2', 'fs3']]
+        >>> all(abs(count - 10000) < 1500 for count in counts)
+        True
+
+        A fourth node takes about a quarter of the keys, from every other
+        node, and the other keys stay in place.
+
+        >>> ring.add('fs4')
+        >>> moved = [(old, ring.node(digest)) for digest, old in zip(digests, nodes)
+        ...          if ring.node(digest) != old]
+        >>> 0.2 < len(moved) / 30000.0 < 0.3
+        True
+        >>> set(new for old, new in moved), sorted(set(old for old, new in moved))
+        (set(['fs4']), ['fs1', 'fs2', 'fs3'])
+
+        Removing it brings back the previous placement.
+
+        >>> ring.remove('fs4')
+        >>> [ring.node(digest) for digest in digests] == nodes
+        True
+        """
+        position = bisect.bisect(self._points, int(digest[:16], 16))
+        return self._owners[position % len(self._owners)]
+
+
+class ShardedCache(AbstractCache):
+    """
+    Cache spread over other cache sections.
+
+    shards = fs1, fs2, fs3
+
+    Each key is stored in one shard only, chosen by a consistent hash ring
+    with vnodes virtual nodes per shard : adding a shard to the list moves
+    about 1/N of the keys. Shards are sections of the same configuration,
+    looked up in CacheDict on first use.
+    """
+
+    def __init__(self, config):
+        """
+        Sharded cache.
+
+        >>> s = ShardedCache({'module': 'ShardedCache', 'shards': 'fs1, fs2, fs3'})
+        >>> s._shardNames
+        ['fs1', 'fs2', 'fs3']
+        >>> len(s._ring._points)
+        480
+        """
+        AbstractCache.__init__(self, config)
+
+        self._shardNames = _shardNames(config)
+        self._ring = HashRing(self._shardNames, getInteger(config, 'vnodes', 160))
+        self._shards = None
+
+    def shards(self):
+        """
+        Return {section name: cache} of the shards.
+
+        >>> from ramcache import RamCache
+        >>> cd = CacheDict()
+        >>> cd['ram1'] = RamCache()
+        >>> ShardedCache({'shards': 'ram1, ram2'}).shards()
+        Traceback (most recent call last):
+        ...
+        CacheSectionNotDefined: No Cache_ram2 section
+        """
+        if self._shards is None:
+            cd = CacheDict.getInstance()
+            shards = {}
+            for name in self._shardNames:
+                if cd is None or name not in cd:
+                    raise exceptionconfig.CacheSectionNotDefined('No Cache_' + name + ' section')
+                shards[name] = cd[name]
+            self._shards = shards
+        return self._shards
+
+    def shard(self, key):
+        """
+        Return the shard of key.
+
+        >>> from ramcache import RamCache
+        >>> cd = CacheDict()
+        >>> cd['ram1'], cd['ram2'] = RamCache(), RamCache()
+        >>> s = ShardedCache({'shards': 'ram1, ram2'})
+        >>> s.shard(('a', (1, 2), ())) in (cd['ram1'], cd['ram2'])
+        True
+        """
+        return self.shards()[self._ring.node(digestKey(key))]
+
+    @property
+    def blocking(self):
+        """
+        True if a shard is.
+
+        >>> from ramcache import RamCache
+        >>> cd = CacheDict()
+        >>> cd['ram1'], cd['ram2'] = RamCache(), RamCache()
+        >>> ShardedCache({'shards': 'ram1, ram2'}).blocking
+        False
+        """
+        return any(shard.blocking for shard in self.shards().values())
+
+    def get(self, key, default=MISS):
+        """
+        >>> from ramcache import RamCache
+        >>> cd = CacheDict()
+        >>> cd['ram1'], cd['ram2'] = RamCache(), RamCache()
+        >>> s = ShardedCache({'shards': 'ram1, ram2'})
+        >>> s.get(('a', (1, 2), ()))
+        MISS
+        >>> s.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> s.get(('a', (1, 2), ()))
+        3
+        """
+        return self.shard(key).get(key, default)
+
+    def getMany(self, keys, default=MISS):
+        """
+        Return the results of keys, with one getMany per shard.
+
+        >>> from ramcache import RamCache
+        >>> cd = CacheDict()
+        >>> cd['ram1'], cd['ram2'] = RamCache(), RamCache()
+        >>> s = ShardedCache({'shards': 'ram1, ram2'})
+        >>> s.putMany([(('a', (i,), ()), i) for i in range(10)])
+        >>> s.getMany([('a', (i,), ()) for i in range(11)])
+        [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, MISS]
+        >>> len(cd['ram1']._cache) + len(cd['ram2']._cache)
+        10
+        """
+        keys = list(keys)
+        results = [default] * len(keys)
+        for shard, positions in self._byShard(keys).items():
+            found = shard.getMany([keys[p] for p in positions], default)
+            for position, result in zip(positions, found):
+                results[position] = result
+        return results
+
+    def _byShard(self, keys):
+        """
+        Return {shard: positions of its keys}.
+        """
+        byShard = {}
+        for position, key in enumerate(keys):
+            byShard.setdefault(self.shard(key), []).append(position)
+        return byShard
+
+    def isCached(self, key):
+        """
+        >>> from ramcache import RamCache
+        >>> cd = CacheDict()
+        >>> cd['ram1'], cd['ram2'] = RamCache(), RamCache()
+        >>> s = ShardedCache({'shards': 'ram1, ram2'})
+        >>> s.isCached(('a', (1, 2), ()))
+        False
+        >>> s.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> s.isCached(('a', (1, 2), ()))
+        True
+        """
+        return self.shard(key).isCached(key)
+
+    def cached(self, key):
+        """
+        >>> from ramcache import RamCache
+        >>> cd = CacheDict()
+        >>> cd['ram1'], cd['ram2'] = RamCache(), RamCache()
+        >>> s = ShardedCache({'shards': 'ram1, ram2'})
+        >>> s.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> s.cached(('a', (1, 2), ()))
+        3
+        """
+        result = self.get(key)
+        if result is MISS:
+            raise KeyError(key)
+        return result
+
+    def putInCache(self, key, result, ttl=None):
+        """
+        Put result in the shard of key only.
+
+        >>> from ramcache import RamCache
+        >>> cd = CacheDict()
+        >>> cd['ram1'], cd['ram2'] = RamCache(), RamCache()
+        >>> s = ShardedCache({'shards': 'ram1, ram2'})
+        >>> s.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> cd['ram1'].isCached(('a', (1, 2), ())) != cd['ram2'].isCached(('a', (1, 2), ()))
+        True
+        """
+        return self.shard(key).putInCache(key, result, ttl)
+
+    def putMany(self, items, ttl=None):
+        items = list(items)
+        for shard, positions in self._byShard([key for key, result in items]).items():
+            shard.putMany([items[p] for p in positions], ttl)
+
+    @staticmethod
+    def checkConf(config):
+        """
+        Check configuration for Sharded Cache.
+
+        >>> ShardedCache.checkConf({})
+        Traceback (most recent call last):
+        ...
+        IncoherentSectionConfig: not module ShardedCache
+        >>> ShardedCache.checkConf({'module': 'ShardedCache'})
+        Traceback (most recent call last):
+        ...
+        MissingConfigException: no shards in config
+        >>> ShardedCache.checkConf({'module': 'ShardedCache', 'shards': ' , '})
+        Traceback (most recent call last):
+        ...
+        BadOptionValue: shards must name at least one section
+        >>> ShardedCache.checkConf({'module': 'ShardedCache', 'shards': 'fs1, fs1'})
+        Traceback (most recent call last):
+        ...
+        BadOptionValue: shards must name each section once
+        >>> ShardedCache.checkConf({'module': 'ShardedCache', 'shards': 'fs1, fs2', 'vnodes': '0'})
+        Traceback (most recent call last):
+        ...
+        BadOptionValue: vnodes must be at least 1
+        >>> ShardedCache.checkConf({'module': 'ShardedCache', 'shards': 'fs1, fs2, fs3'})
+        """
+        try:
+            if config['module'] != 'ShardedCache':
+                raise IncoherentSectionConfig('not module ShardedCache')
+        except KeyError:
+            raise IncoherentSectionConfig('not module ShardedCache')
+
+        if not 'shards' in config:
+            raise MissingConfigException('no shards in config')
+        names = _shardNames(config)
+        if not names:
+            raise BadOptionValue('shards must name at least one section')
+        if len(set(names)) != len(names):
+            raise BadOptionValue('shards must name each section once')
+        if getInteger(config, 'vnodes', 160) < 1:
+            raise BadOptionValue('vnodes must be at least 1')
+
+
+def _shardNames(config):
+    return [name.strip() for name in config['shards'].split(',') if name.strip()]
+
+
+def _point(text):
+    """
+    Position of text on the ring, a 64 bits integer.
+    """
+    return int(hashlib.sha1(text.encode('utf-8')).hexdigest()[:16], 16)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
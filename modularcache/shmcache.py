@@ -0,0 +1,690 @@
+#!/usr/bin/env python
+
+import binascii
+import bisect
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import BytesIO as StringIO
+
+from abstractcache import AbstractCache, MISS
+from cachekey import digestKey
+from configoptions import getInteger
+import serializers
+from exceptionconfig import *
+
+
+# magic, slots, pages, page size, entries, payload bytes, next free page,
+# eviction hand, dirty
+_HEADER = struct.Struct('<8sQQQQQQQQ')
+_MAGIC = b'MCSHM001'
+# index entry : key sha1, deadline, chunk offset (0 when empty), length
+_ENTRY = struct.Struct('<20sdQI')
+# first bytes of a free chunk : offset of the next free chunk
+_NEXT = struct.Struct('<Q')
+# page map entry : size class of the page plus one, 0 when not cut
+_CLASS = struct.Struct('<B')
+
+_MIN_CHUNK = 64
+_GROWTH = 1.25
+# entries kept under this share of the slots, for short probes
+_LOAD = 0.75
+
+
+class ShmCache(AbstractCache):
+    """
+    Cache in a memory mapped file shared by the processes of a host.
+
+    Put the file on a tmpfs like /dev/shm : the processes of a prefork
+    server map the same pages and share one cache, without disk I/O.
+
+    The file holds a fixed size open addressed index of key sha1s, with
+    linear probing, and slab pages of values : a page is cut into chunks
+    of one size class when a value of that class first needs it. When
+    no chunk is left, entries of the same class met by a rotating hand
+    are evicted, expired entries on the way are dropped. A value larger
+    than a page is not cached.
+
+    Access is serialized by flock on the file, shared for reads ; a
+    process killed while writing leaves the segment marked dirty and
+    the next writer clears it. The geometry, slots, pages and page size,
+    is appended to the file name : processes configured differently use
+    separate files, and a file in use is never resized nor cleared for
+    another geometry.
+    """
+
+    def __init__(self, config):
+        """
+        Cache in a shared memory file.
+
+        >>> import tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), 'shm')
+        >>> s = ShmCache({'file': path, 'memory': '65536', 'pagesize': '4096',
+        ...               'expirationdelay': '30'})
+        >>> s._slots, s._pages, len(s._chunkSizes)
+        (64, 16, 19)
+        >>> s._file == path + '.64-16-4096'
+        True
+        >>> s._header()[4]
+        0
+        """
+        AbstractCache.__init__(self, config)
+
+        self._expirationdelay = int(config['expirationdelay'])
+        self._serializer = serializers.getSerializer(config.get('serializer', 'pickle'))
+
+        memory = int(config['memory'])
+        self._pageSize = min(getInteger(config, 'pagesize', 1 << 20), memory)
+        self._pages = memory // self._pageSize
+        self._slots = getInteger(config, 'slots', max(16, memory // 1024))
+        self._maxEntries = int(self._slots * _LOAD)
+        self._chunkSizes = _chunkSizes(self._pageSize)
+        self._geometry = (_MAGIC, self._slots, self._pages, self._pageSize)
+        self._file = '%s.%d-%d-%d' % (config['file'], self._slots, self._pages,
+                                      self._pageSize)
+
+        # layout : header, free list heads, page classes, index, pages
+        self._freeOffset = _HEADER.size
+        self._pageMapOffset = self._freeOffset + _NEXT.size * len(self._chunkSizes)
+        self._indexOffset = _align(self._pageMapOffset + self._pages, 8)
+        self._pagesOffset = _align(self._indexOffset + _ENTRY.size * self._slots,
+                                   mmap.PAGESIZE)
+        self._size = self._pagesOffset + self._pages * self._pageSize
+
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        """
+        Map the file, initializing it unless another process already did.
+
+        >>> import tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), 'shm')
+        >>> config = {'file': path, 'memory': '65536', 'pagesize': '4096',
+        ...           'expirationdelay': '30'}
+        >>> s = ShmCache(config)
+        >>> s.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> ShmCache(config).get(('a', (1, 2), ()))
+        3
+
+        Another geometry maps another file, the first one is left as is.
+
+        >>> config['memory'] = '131072'
+        >>> ShmCache(config).get(('a', (1, 2), ()))
+        MISS
+        >>> s.get(('a', (1, 2), ())), os.path.getsize(s._file) == s._size
+        (3, True)
+
+        A file of this name holding another geometry is not touched.
+
+        >>> other = ShmCache(config)
+        >>> other._setHeader(slots=1)
+        >>> ShmCache(config) #doctest: +ELLIPSIS
+        Traceback (most recent call last):
+        ...
+        GeometryMismatch: ... holds another geometry
+        """
+        self._fd = os.open(self._file, os.O_RDWR | os.O_CREAT, 0o600)
+        self._pid = os.getpid()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            # grow a new file only : shrinking a mapped file kills its users
+            if os.fstat(self._fd).st_size < self._size:
+                os.ftruncate(self._fd, self._size)
+            self._map = mmap.mmap(self._fd, self._size)
+            if self._header()[0] != _MAGIC:
+                self._clear()
+            geometry = self._header()[:4]
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        if geometry != self._geometry:
+            self.close()
+            raise GeometryMismatch('%s holds another geometry' % self._file)
+
+    def _acquire(self, exclusive):
+        """
+        Lock the segment against the other threads and processes, mapping
+        it again if its header changed.
+
+        >>> import tempfile
+        >>> config = {'file': os.path.join(tempfile.mkdtemp(), 'shm'), 'memory': '65536',
+        ...           'pagesize': '4096', 'expirationdelay': '30'}
+        >>> s = ShmCache(config)
+        >>> s.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> ShmCache(config)._setHeader(magic='garbage!')
+        >>> s.get(('a', (1, 2), ())), s._header()[:4] == s._geometry
+        (MISS, True)
+        """
+        mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        self._lock.acquire()
+        try:
+            if self._pid != os.getpid():
+                # a forked child shares the flock of its parent's descriptor
+                os.close(self._fd)
+                self._fd = os.open(self._file, os.O_RDWR)
+                self._pid = os.getpid()
+            fcntl.flock(self._fd, mode)
+            if self._header()[:4] != self._geometry:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+                self.close()
+                self._open()
+                fcntl.flock(self._fd, mode)
+        except:
+            self._lock.release()
+            raise
+
+    def _release(self):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+    def _header(self):
+        return _HEADER.unpack_from(self._map, 0)
+
+    def _setHeader(self, **fields):
+        header = list(self._header())
+        for name, value in fields.items():
+            header[_FIELDS.index(name)] = value
+        _HEADER.pack_into(self._map, 0, *header)
+
+    def _clear(self):
+        """
+        Reset the segment to an empty cache.
+        """
+        self._map[_HEADER.size:self._pagesOffset] = b'\0' * (self._pagesOffset - _HEADER.size)
+        _HEADER.pack_into(self._map, 0, _MAGIC, self._slots, self._pages, self._pageSize,
+                          0, 0, 0, 0, 0)
+
+    def _beginWrite(self):
+        """
+        Mark the segment dirty for the time of a change, clearing it if
+        a writer died in the middle of one.
+        """
+        if self._header()[8]:
+            self._clear()
+        self._setHeader(dirty=1)
+
+    def _endWrite(self):
+        self._setHeader(dirty=0)
+
+    def _home(self, digest):
+        return struct.unpack_from('<Q', digest)[0] % self._slots
+
+    def _entry(self, slot):
+        return _ENTRY.unpack_from(self._map, self._indexOffset + slot * _ENTRY.size)
+
+    def _setEntry(self, slot, digest, deadline, offset, length):
+        _ENTRY.pack_into(self._map, self._indexOffset + slot * _ENTRY.size,
+                         digest, deadline, offset, length)
+
+    def _find(self, digest):
+        """
+        Return the slot of digest, or the empty slot ending its probe
+        as -1 - slot.
+        """
+        slot = self._home(digest)
+        while True:
+            entry = self._entry(slot)
+            if not entry[2]:
+                return -1 - slot
+            if entry[0] == digest:
+                return slot
+            slot = (slot + 1) % self._slots
+
+    def _classOf(self, offset):
+        page = (offset - self._pagesOffset) // self._pageSize
+        return _CLASS.unpack_from(self._map, self._pageMapOffset + page)[0] - 1
+
+    def _allocate(self, sizeClass):
+        """
+        Return the offset of a free chunk of sizeClass, 0 if none is left.
+        """
+        headOffset = self._freeOffset + sizeClass * _NEXT.size
+        head = _NEXT.unpack_from(self._map, headOffset)[0]
+        if not head:
+            head = self._carve(sizeClass)
+            if not head:
+                return 0
+        _NEXT.pack_into(self._map, headOffset, _NEXT.unpack_from(self._map, head)[0])
+        return head
+
+    def _carve(self, sizeClass):
+        """
+        Cut the next free page into chunks of sizeClass, return the first.
+        """
+        page = self._header()[6]
+        if page >= self._pages:
+            return 0
+        self._setHeader(nextPage=page + 1)
+        _CLASS.pack_into(self._map, self._pageMapOffset + page, sizeClass + 1)
+
+        chunk = self._chunkSizes[sizeClass]
+        start = self._pagesOffset + page * self._pageSize
+        offsets = range(start, start + self._pageSize - chunk + 1, chunk)
+        for offset, following in zip(offsets, list(offsets[1:]) + [0]):
+            _NEXT.pack_into(self._map, offset, following)
+        return start
+
+    def _free(self, offset):
+        headOffset = self._freeOffset + self._classOf(offset) * _NEXT.size
+        _NEXT.pack_into(self._map, offset, _NEXT.unpack_from(self._map, headOffset)[0])
+        _NEXT.pack_into(self._map, headOffset, offset)
+
+    def _delete(self, slot):
+        """
+        Free the chunk of slot and empty it, shifting back the entries
+        probed after it.
+        """
+        digest, deadline, offset, length = self._entry(slot)
+        self._free(offset)
+        header = self._header()
+        self._setHeader(entries=header[4] - 1, used=header[5] - length)
+
+        hole = slot
+        slot = (slot + 1) % self._slots
+        while True:
+            entry = self._entry(slot)
+            if not entry[2]:
+                break
+            home = self._home(entry[0])
+            # the entry may fill the hole unless its home is between them
+            if (slot - home) % self._slots >= (slot - hole) % self._slots:
+                self._setEntry(hole, *entry)
+                hole = slot
+            slot = (slot + 1) % self._slots
+        self._setEntry(hole, b'\0' * 20, 0, 0, 0)
+
+    def _evict(self, sizeClass=None):
+        """
+        Advance the hand, evicting the first entry of sizeClass (of any
+        class when None) and the expired entries on the way. Return
+        False when no entry of sizeClass is left.
+        """
+        now = time.time()
+        slot = self._header()[7]
+        for step in range(self._slots):
+            digest, deadline, offset, length = self._entry(slot)
+            if offset:
+                matches = sizeClass is None or self._classOf(offset) == sizeClass
+                if matches or deadline <= now:
+                    self._delete(slot)
+                    if self.stats is not None:
+                        self.stats.incr('evictions' if deadline > now else 'expirations')
+                    if matches:
+                        self._setHeader(hand=slot)
+                        return True
+                    # an entry may have shifted into slot
+                    continue
+            slot = (slot + 1) % self._slots
+        self._setHeader(hand=slot)
+        return False
+
+    def get(self, key, default=MISS):
+        """
+        Return the cached result or default.
+
+        >>> import tempfile
+        >>> s = ShmCache({'file': os.path.join(tempfile.mkdtemp(), 'shm'),
+        ...               'memory': '65536', 'pagesize': '4096', 'expirationdelay': '30'})
+        >>> s.get(('a', (1, 2), ()))
+        MISS
+        >>> s.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> s.get(('a', (1, 2), ()))
+        3
+        >>> s.putInCache(('b', (1, 2), ()), 4, ttl=0)
+        4
+        >>> s.get(('b', (1, 2), ()))
+        MISS
+        """
+        return self.getMany([key], default)[0]
+
+    def getMany(self, keys, default=MISS):
+        """
+        Return the results of keys, in order, under a single lock.
+
+        A process forked after opening the cache reads the entries of its
+        parent, and the parent those of the child.
+
+        >>> import tempfile
+        >>> s = ShmCache({'file': os.path.join(tempfile.mkdtemp(), 'shm'),
+        ...               'memory': '65536', 'pagesize': '4096', 'expirationdelay': '30'})
+        >>> s.putInCache(('a', (1,), ()), 'parent')
+        'parent'
+        >>> pid = os.fork()
+        >>> if not pid:
+        ...     s.putInCache(('a', (2,), ()), s.get(('a', (1,), ())) + ' child')
+        ...     os._exit(0)
+        >>> os.waitpid(pid, 0)[1]
+        0
+        >>> s.getMany([('a', (1,), ()), ('a', (2,), ()), ('a', (3,), ())])
+        ['parent', 'parent child', MISS]
+
+        An entry that cannot be decoded is a miss, and is deleted.
+
+        >>> offset = s._entry(s._find(_digest(('a', (1,), ()))))[2]
+        >>> s._map[offset:offset + 1] = b'?'
+        >>> s.getMany([('a', (1,), ()), ('a', (2,), ())])
+        [MISS, 'parent child']
+        >>> s._find(_digest(('a', (1,), ()))) < 0, s.stats.snapshot()['errors']
+        (True, 1)
+        """
+        digests = [_digest(key) for key in keys]
+        # (payload, chunk offset) of each key, None when missing
+        payloads = []
+        expired = 0
+        self._acquire(False)
+        try:
+            # a dirty segment is being repaired : every key misses
+            dirty = self._header()[8]
+            now = time.time()
+            for digest in digests:
+                slot = -1 if dirty else self._find(digest)
+                if slot < 0:
+                    payloads.append(None)
+                    continue
+                digest, deadline, offset, length = self._entry(slot)
+                if deadline <= now:
+                    expired += 1
+                    payloads.append(None)
+                    continue
+                payloads.append((self._map[offset:offset + length], offset))
+        finally:
+            self._release()
+
+        if expired and self.stats is not None:
+            self.stats.incr('expirations', expired)
+        results = []
+        for digest, payload in zip(digests, payloads):
+            if payload is None:
+                results.append(default)
+                continue
+            try:
+                results.append(serializers.load(StringIO(payload[0])))
+            except Exception:
+                # unreadable entry : forget it
+                self._forget(digest, payload[1])
+                results.append(default)
+        return results
+
+    def _forget(self, digest, offset):
+        """
+        Delete the entry of digest if it still is at offset, counting an
+        error.
+        """
+        self._acquire(True)
+        try:
+            self._beginWrite()
+            slot = self._find(digest)
+            if slot >= 0 and self._entry(slot)[2] == offset:
+                self._delete(slot)
+            self._endWrite()
+        finally:
+            self._release()
+        if self.stats is not None:
+            self.stats.incr('errors')
+
+    def isCached(self, key):
+        """
+        >>> import tempfile
+        >>> s = ShmCache({'file': os.path.join(tempfile.mkdtemp(), 'shm'),
+        ...               'memory': '65536', 'pagesize': '4096', 'expirationdelay': '30'})
+        >>> s.isCached(('a', (1, 2), ()))
+        False
+        >>> s.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> s.isCached(('a', (1, 2), ()))
+        True
+        """
+        digest = _digest(key)
+        self._acquire(False)
+        try:
+            if self._header()[8]:
+                return False
+            slot = self._find(digest)
+            return slot >= 0 and self._entry(slot)[1] > time.time()
+        finally:
+            self._release()
+
+    def cached(self, key):
+        """
+        >>> import tempfile
+        >>> s = ShmCache({'file': os.path.join(tempfile.mkdtemp(), 'shm'),
+        ...               'memory': '65536', 'pagesize': '4096', 'expirationdelay': '30'})
+        >>> s.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> s.cached(('a', (1, 2), ()))
+        3
+        """
+        result = self.get(key)
+        if result is MISS:
+            raise KeyError(key)
+        return result
+
+    def putInCache(self, key, result, ttl=None):
+        """
+        Put result in cache, expiring after ttl seconds, expirationdelay by
+        default.
+
+        >>> import tempfile
+        >>> s = ShmCache({'file': os.path.join(tempfile.mkdtemp(), 'shm'),
+        ...               'memory': '65536', 'pagesize': '4096', 'expirationdelay': '30'})
+        >>> s.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> s.putInCache(('a', (1, 2), ()), 'x' * 1000)[:3]
+        'xxx'
+        >>> s.get(('a', (1, 2), ())) == 'x' * 1000
+        True
+        >>> s._header()[4]
+        1
+
+        The slots keep a free share, entries beyond it are evicted.
+
+        >>> for i in range(100):
+        ...     _ = s.putInCache(('b', (i,), ()), i)
+        >>> s._header()[4]
+        48
+        >>> len([r for r in s.getMany([('b', (i,), ()) for i in range(100)]) if r is not MISS])
+        48
+
+        When the pages are all cut, entries of the size class of the new
+        value make room.
+
+        >>> for i in range(100):
+        ...     _ = s.putInCache(('c', (i,), ()), 'y' * 3000)
+        >>> s.get(('c', (99,), ())) == 'y' * 3000, s._header()[4] <= 48
+        (True, True)
+        >>> s.get(('c', (0,), ()))
+        MISS
+
+        A value larger than a page is not cached.
+
+        >>> len(s.putInCache(('d', (1, 2), ()), 'z' * 5000))
+        5000
+        >>> s.get(('d', (1, 2), ()))
+        MISS
+        """
+        self.putMany([(key, result)], ttl)
+        return result
+
+    def putMany(self, items, ttl=None):
+        """
+        Put (key, result) pairs in cache under a single lock.
+
+        >>> import tempfile
+        >>> s = ShmCache({'file': os.path.join(tempfile.mkdtemp(), 'shm'),
+        ...               'memory': '65536', 'pagesize': '4096', 'expirationdelay': '30'})
+        >>> s.putMany([(('a', (1,), ()), 3), (('a', (2,), ()), 4)])
+        >>> s.getMany([('a', (1,), ()), ('a', (2,), ())])
+        [3, 4]
+        >>> s.memoryBytes() > 0
+        True
+        """
+        deadline = time.time() + (self._expirationdelay if ttl is None else ttl)
+        records = []
+        for key, result in items:
+            out = StringIO()
+            serializers.dump(result, out, self._serializer)
+            records.append((_digest(key), out.getvalue()))
+
+        self._acquire(True)
+        try:
+            self._beginWrite()
+            for digest, payload in records:
+                self._store(digest, payload, deadline)
+            self._endWrite()
+        finally:
+            self._release()
+
+    def _store(self, digest, payload, deadline):
+        slot = self._find(digest)
+        if slot >= 0:
+            self._delete(slot)
+        if len(payload) > self._pageSize:
+            return
+
+        sizeClass = bisect.bisect_left(self._chunkSizes, len(payload))
+        while self._header()[4] >= self._maxEntries:
+            self._evict()
+        offset = self._allocate(sizeClass)
+        while not offset:
+            if not self._evict(sizeClass):
+                # every page went to other size classes
+                return
+            offset = self._allocate(sizeClass)
+
+        self._map[offset:offset + len(payload)] = payload
+        self._setEntry(-1 - self._find(digest), digest, deadline, offset, len(payload))
+        header = self._header()
+        self._setHeader(entries=header[4] + 1, used=header[5] + len(payload))
+
+    def memoryBytes(self):
+        """
+        Bytes of the cached values, in every process.
+        """
+        return self._header()[5]
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+    @staticmethod
+    def checkConf(config):
+        """
+        Check configuration for shared memory Cache.
+
+        >>> ShmCache.checkConf({})
+        Traceback (most recent call last):
+        ...
+        IncoherentSectionConfig: not module ShmCache
+        >>> ShmCache.checkConf({'module': 'ShmCache'})
+        Traceback (most recent call last):
+        ...
+        MissingConfigException: no file in config
+        >>> ShmCache.checkConf({'module': 'ShmCache', 'file': 'test/noexist/shm', 'memory': '65536', 'expirationdelay': '3'})
+        Traceback (most recent call last):
+        ...
+        CacheDirIncorrect: test/noexist isn't correct
+        >>> ShmCache.checkConf({'module': 'ShmCache', 'file': 'test/cache/shm', 'memory': 'a', 'expirationdelay': '3'})
+        Traceback (most recent call last):
+        ...
+        NotInteger: memory must be an integer
+        >>> ShmCache.checkConf({'module': 'ShmCache', 'file': 'test/cache/shm', 'memory': '65536', 'pagesize': '32', 'expirationdelay': '3'})
+        Traceback (most recent call last):
+        ...
+        BadOptionValue: pagesize must be at least 64
+        >>> ShmCache.checkConf({'module': 'ShmCache', 'file': 'test/cache/shm', 'memory': '65536', 'expirationdelay': '3'})
+        """
+        try:
+            if config['module'] != 'ShmCache':
+                raise IncoherentSectionConfig('not module ShmCache')
+        except KeyError:
+            raise IncoherentSectionConfig('not module ShmCache')
+
+        for option in ['file', 'memory', 'expirationdelay']:
+            if not option in config:
+                raise MissingConfigException('no %s in config' % option)
+
+        directory = os.path.dirname(config['file']) or '.'
+        if not os.path.isdir(directory):
+            raise CacheDirIncorrect(directory + " isn't correct")
+
+        for option in ['memory', 'expirationdelay']:
+            try:
+                tmp = int(config[option])
+            except ValueError:
+                raise NotInteger('%s must be an integer' % option)
+
+        if getInteger(config, 'pagesize', _MIN_CHUNK) < _MIN_CHUNK:
+            raise BadOptionValue('pagesize must be at least %d' % _MIN_CHUNK)
+        if getInteger(config, 'slots', 16) < 16:
+            raise BadOptionValue('slots must be at least 16')
+        serializers.getSerializer(config.get('serializer', 'pickle'))
+
+
+_FIELDS = ('magic', 'slots', 'pages', 'pageSize', 'entries', 'used', 'nextPage', 'hand',
+           'dirty')
+
+
+def _chunkSizes(pageSize):
+    """
+    Chunk size of each class, growing by _GROWTH up to the page size.
+
+    >>> _chunkSizes(1024)
+    [64, 80, 104, 136, 176, 224, 280, 352, 440, 552, 696, 872, 1024]
+    """
+    sizes = []
+    size = _MIN_CHUNK
+    while size < pageSize:
+        sizes.append(size)
+        size = _align(int(size * _GROWTH), 8)
+    sizes.append(pageSize)
+    return sizes
+
+
+def _align(offset, alignment):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _digest(key):
+    """
+    Raw sha1 of a key, 20 bytes.
+    """
+    return binascii.unhexlify(digestKey(key))
+
+
+class CacheDirIncorrect(Exception):
+    """
+    >>> CacheDirIncorrect('foo')
+    CacheDirIncorrect('foo',)
+    """
+    pass
+
+
+class NotInteger(Exception):
+    """
+    >>> NotInteger('foo')
+    NotInteger('foo',)
+    """
+    pass
+
+
+class GeometryMismatch(Exception):
+    """
+    >>> GeometryMismatch('foo')
+    GeometryMismatch('foo',)
+    """
+    pass
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
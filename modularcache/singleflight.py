@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+import threading
+
+from configoptions import getBoolean, getNumber
+
+
+class SingleFlight(object):
+    """
+    Run at most one computation per key at a time.
+
+    The first caller of a key computes it, the other callers of the same
+    key wait for its result or its exception.
+    """
+
+    def __init__(self, timeout=None):
+        """
+        timeout : seconds a caller waits for the computing thread, None
+        to wait forever.
+
+        >>> s = SingleFlight(2)
+        >>> s._timeout
+        2
+        >>> s._calls
+        {}
+        """
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    @staticmethod
+    def fromConfig(config):
+        """
+        Return a SingleFlight if the section enables it, else None.
+
+        >>> SingleFlight.fromConfig({'module': 'RamCache'}) is None
+        True
+        >>> SingleFlight.fromConfig({'singleflight': 'true'})._timeout is None
+        True
+        >>> SingleFlight.fromConfig({'singleflight': 'true', 'singleflighttimeout': '5'})._timeout
+        5.0
+        """
+        if not getBoolean(config, 'singleflight'):
+            return None
+        return SingleFlight(getNumber(config, 'singleflighttimeout'))
+
+    @staticmethod
+    def checkConf(config):
+        """
+        Check single flight options of a section.
+
+        >>> SingleFlight.checkConf({'singleflight': 'yes', 'singleflighttimeout': '0.5'})
+        >>> SingleFlight.checkConf({'singleflight': 'yes', 'singleflighttimeout': 'a'})
+        Traceback (most recent call last):
+        ...
+        BadOptionValue: singleflighttimeout must be a number
+        """
+        getBoolean(config, 'singleflight')
+        getNumber(config, 'singleflighttimeout')
+
+    def do(self, key, fctn, *args, **kwargs):
+        """
+        Return fctn(*args, **kwargs), computed once for concurrent callers
+        of the same key.
+
+        >>> import time
+        >>> s = SingleFlight()
+        >>> calls = []
+        >>> def slow(x):
+        ...     calls.append(x)
+        ...     time.sleep(0.2)
+        ...     return x * 2
+        >>> results = []
+        >>> threads = [threading.Thread(target=lambda: results.append(s.do('k', slow, 21)))
+        ...            for i in range(50)]
+        >>> for t in threads:
+        ...     t.start()
+        >>> for t in threads:
+        ...     t.join()
+        >>> calls
+        [21]
+        >>> results == [42] * 50
+        True
+        >>> s._calls
+        {}
+
+        Waiters get the exception of the computing thread.
+
+        >>> def fail():
+        ...     time.sleep(0.2)
+        ...     raise ValueError('boom')
+        >>> errors = []
+        >>> def call():
+        ...     try:
+        ...         s.do('k', fail)
+        ...     except ValueError as e:
+        ...         errors.append(e)
+        >>> threads = [threading.Thread(target=call) for i in range(20)]
+        >>> for t in threads:
+        ...     t.start()
+        >>> for t in threads:
+        ...     t.join()
+        >>> len(errors)
+        20
+        >>> len(set(id(e) for e in errors))
+        1
+
+        Waiters give up after the timeout.
+
+        >>> s = SingleFlight(0.1)
+        >>> leader = threading.Thread(target=s.do, args=('k', time.sleep, 0.5))
+        >>> leader.start()
+        >>> time.sleep(0.05)
+        >>> s.do('k', time.sleep, 0.5)
+        Traceback (most recent call last):
+        ...
+        SingleFlightTimeout: no result for 'k' after 0.1s
+        >>> leader.join()
+        """
+        self._lock.acquire()
+        try:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        finally:
+            self._lock.release()
+
+        if leader:
+            try:
+                call.result = fctn(*args, **kwargs)
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                self._lock.acquire()
+                try:
+                    del(self._calls[key])
+                finally:
+                    self._lock.release()
+                call.event.set()
+            return call.result
+
+        if not call.event.wait(self._timeout):
+            raise SingleFlightTimeout('no result for %r after %ss' % (key, self._timeout))
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class _Call(object):
+    """
+    A computation in flight.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlightTimeout(Exception):
+    """
+    >>> SingleFlightTimeout('foo')
+    SingleFlightTimeout('foo',)
+    """
+    pass
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
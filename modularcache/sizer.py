@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+import sys
+
+from configoptions import getInteger
+from exceptionconfig import BadOptionValue
+
+
+# types holding no other object
+try:
+    _SCALARS = (bytes, unicode, bytearray, int, long, float)
+except NameError:
+    _SCALARS = (bytes, str, bytearray, int, float)
+
+def deepSizeOf(value):
+    """
+    Bytes held by value and the objects it contains, each counted once.
+
+    >>> deepSizeOf('x' * 1000) > 1000
+    True
+    >>> deepSizeOf(['x' * 1000] * 10) < 2000
+    True
+    >>> deepSizeOf(['x' * 1000, 'y' * 1000]) > 2000
+    True
+    >>> deepSizeOf({'a': range(1000)}) > deepSizeOf(range(1000))
+    True
+    >>> class A(object):
+    ...     def __init__(self):
+    ...         self.data = 'x' * 1000
+    >>> deepSizeOf(A()) > 1000
+    True
+    >>> loop = []
+    >>> loop.append(loop)
+    >>> deepSizeOf(loop) == sys.getsizeof(loop)
+    True
+    """
+    seen = set()
+    stack = [value]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+
+        if isinstance(obj, _SCALARS):
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        if hasattr(obj, '__dict__') and not isinstance(obj, type):
+            stack.append(obj.__dict__)
+        for slot in getattr(type(obj), '__slots__', ()):
+            if hasattr(obj, slot):
+                stack.append(getattr(obj, slot))
+    return total
+
+
+SIZERS = {'deep': deepSizeOf, 'getsizeof': sys.getsizeof}
+
+
+def getSizer(name=None):
+    """
+    Return the sizer function : 'deep' (default), 'getsizeof', or the
+    dotted path of a function taking a value and returning bytes.
+
+    >>> getSizer() is deepSizeOf
+    True
+    >>> getSizer('os.path.getsize') #doctest: +ELLIPSIS
+    <function getsize at 0x...>
+    >>> getSizer('os.path.nope')
+    Traceback (most recent call last):
+    ...
+    BadOptionValue: unknown sizer os.path.nope
+    """
+    if name is None:
+        return deepSizeOf
+    if name in SIZERS:
+        return SIZERS[name]
+    moduleName, _, functionName = name.rpartition('.')
+    try:
+        return getattr(__import__(moduleName, fromlist=[functionName]), functionName)
+    except (ImportError, AttributeError, ValueError):
+        raise BadOptionValue('unknown sizer %s' % name)
+
+
+def checkConf(config):
+    """
+    Check the maxBytes and sizer options of a section.
+
+    >>> checkConf({'maxbytes': '1000000', 'sizer': 'getsizeof'})
+    >>> checkConf({'maxbytes': '0'})
+    Traceback (most recent call last):
+    ...
+    BadOptionValue: maxbytes must be at least 1
+    """
+    maxBytes = getInteger(config, 'maxbytes')
+    if maxBytes is not None and maxBytes < 1:
+        raise BadOptionValue('maxbytes must be at least 1')
+    getSizer(config.get('sizer'))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,504 @@
+#!/usr/bin/env python
+
+import binascii
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import BytesIO as StringIO
+
+from abstractcache import AbstractCache, MISS
+from cachekey import digestKey
+from configoptions import getInteger, getNumber
+import serializers
+from exceptionconfig import *
+
+
+_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS cache ('
+    ' key BLOB PRIMARY KEY, expiry REAL NOT NULL, value BLOB NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS cache_expiry ON cache (expiry)',
+]
+
+
+class SqliteCache(threading.Thread, AbstractCache):
+    """
+    Cache in a SQLite database, in WAL mode.
+
+    Puts are queued and written by the thread, a batch per transaction,
+    every flushInterval seconds or as soon as batchSize puts are queued.
+    Queued puts are served from memory until written, at most maxPending
+    of them : further puts are dropped until the writer catches up. A
+    batch that fails to write is queued again. Every freq seconds one
+    DELETE on the expiry index drops the expired rows. Several processes
+    can share the database file, a forked child gets its own connections
+    and writer.
+    """
+
+    blocking = True
+
+    def __init__(self, config):
+        """
+        Cache in a SQLite database.
+
+        >>> import tempfile
+        >>> s = SqliteCache({'file': os.path.join(tempfile.mkdtemp(), 'c.db'), 'freq': '2', 'expirationdelay': '3'})
+        >>> s #doctest: +ELLIPSIS
+        <SqliteCache(Thread-1, ...)>
+        >>> s._connection().execute('PRAGMA journal_mode').fetchone()[0]
+        u'wal'
+        >>> s._batchSize, s._flushInterval, s._maxPending
+        (500, 0.05, 5000)
+        """
+        threading.Thread.__init__(self)
+        AbstractCache.__init__(self, config)
+
+        self.setDaemon(True)
+
+        self._file = config['file']
+        self._freq = int(config['freq'])
+        self._expirationdelay = int(config['expirationdelay'])
+        self._batchSize = getInteger(config, 'batchsize', 500)
+        self._flushInterval = getNumber(config, 'flushinterval', 0.05)
+        self._maxPending = getInteger(config, 'maxpending', 10 * self._batchSize)
+        self._serializer = serializers.getSerializer(config.get('serializer', 'pickle'))
+
+        self._local = threading.local()
+        self._stopEvent = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._writeLock = threading.Lock()
+        # key digest -> (expiry, blob), queued then being written
+        self._pending = {}
+        self._flushing = {}
+        self._pid = os.getpid()
+
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        for statement in _SCHEMA:
+            connection.execute(statement)
+        connection.commit()
+
+    def _checkFork(self):
+        """
+        In a forked child, drop the connections, locks and queue inherited
+        from the parent, which writes its queue itself, and restart the
+        writer if the parent ran one.
+
+        >>> import tempfile
+        >>> s = SqliteCache({'file': os.path.join(tempfile.mkdtemp(), 'c.db'), 'freq': '2', 'expirationdelay': '30'})
+        >>> s.start()
+        >>> s.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> parent = s._connection()
+        >>> s._pid = -1
+        >>> s._checkFork()
+        >>> s._pending, s._connection() is parent, s._writer.isAlive()
+        ({}, False, True)
+        >>> s.putInCache(('a', (1, 2), ()), 4)
+        4
+        >>> s.stop()
+        >>> s._writer.join(1)
+        >>> s._count()
+        1
+        """
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writeLock = threading.Lock()
+        self._pending = {}
+        self._flushing = {}
+        if self.ident is not None and not self._stopEvent.isSet():
+            self._writer = threading.Thread(target=self.run)
+            self._writer.setDaemon(True)
+            self._writer.start()
+
+    def _connection(self):
+        """
+        The connection of the current thread.
+        """
+        self._checkFork()
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self._file, timeout=30)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def stop(self):
+        """
+        Stop loop, writing the queued puts.
+
+        >>> import tempfile
+        >>> s = SqliteCache({'file': os.path.join(tempfile.mkdtemp(), 'c.db'), 'freq': '2', 'expirationdelay': '30'})
+        >>> s.start()
+        >>> s.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> s.stop()
+        >>> s.join(1)
+        >>> s.isAlive()
+        False
+        >>> s._pending
+        {}
+        >>> s._count()
+        1
+        """
+        self._stopEvent.set()
+        self._wake.set()
+
+    def run(self):
+        """
+        Writer loop : write the queued puts, drop the expired rows.
+        """
+        lastExpire = time.time()
+        while not self._stopEvent.isSet():
+            self._wake.wait(self._flushInterval)
+            self._wake.clear()
+            self.flush()
+            now = time.time()
+            if now - lastExpire >= self._freq:
+                self.expire(now)
+                lastExpire = now
+        self.flush()
+
+    def flush(self):
+        """
+        Write the queued puts in one transaction.
+
+        >>> import tempfile
+        >>> s = SqliteCache({'file': os.path.join(tempfile.mkdtemp(), 'c.db'), 'freq': '2', 'expirationdelay': '30'})
+        >>> for i in range(100):
+        ...     _ = s.putInCache(('a', (i, 2), ()), i)
+        >>> s._count()
+        0
+        >>> s.get(('a', (7, 2), ()))
+        7
+        >>> s.flush()
+        >>> s._count()
+        100
+        >>> s.get(('a', (7, 2), ()))
+        7
+
+        A batch that fails is counted as an error and queued again, behind
+        the puts made since.
+
+        >>> s.putInCache(('a', (1, 2), ()), 1)
+        1
+        >>> s.putInCache(('b', (1, 2), ()), 2)
+        2
+        >>> s._local.connection = sqlite3.connect(':memory:')
+        >>> s.flush()
+        >>> s.stats.snapshot()['errors'], len(s._pending), s._flushing
+        (1, 2, {})
+        >>> del s._local.connection
+        >>> s.flush()
+        >>> s._count(), s.get(('b', (1, 2), ()))
+        (101, 2)
+        """
+        self._checkFork()
+        self._writeLock.acquire()
+        try:
+            self._lock.acquire()
+            try:
+                self._flushing, self._pending = self._pending, {}
+                rows = [(sqlite3.Binary(digest), expiry, sqlite3.Binary(blob))
+                        for digest, (expiry, blob) in self._flushing.items()]
+            finally:
+                self._lock.release()
+
+            if rows:
+                connection = self._connection()
+                try:
+                    with connection:
+                        connection.executemany(
+                            'INSERT OR REPLACE INTO cache (key, expiry, value) VALUES (?, ?, ?)',
+                            rows)
+                except sqlite3.Error:
+                    self._requeue()
+                    if self.stats is not None:
+                        self.stats.incr('errors')
+                    return
+
+            self._lock.acquire()
+            try:
+                self._flushing = {}
+            finally:
+                self._lock.release()
+        finally:
+            self._writeLock.release()
+
+    def _requeue(self):
+        """
+        Queue again the puts of a failed batch, unless put again since,
+        dropping those beyond maxPending.
+        """
+        self._lock.acquire()
+        try:
+            for digest, entry in self._flushing.items():
+                if len(self._pending) >= self._maxPending:
+                    break
+                self._pending.setdefault(digest, entry)
+            self._flushing = {}
+        finally:
+            self._lock.release()
+
+    def expire(self, now=None):
+        """
+        Drop the expired rows, return how many.
+
+        >>> import tempfile
+        >>> s = SqliteCache({'file': os.path.join(tempfile.mkdtemp(), 'c.db'), 'freq': '2', 'expirationdelay': '30'})
+        >>> s.putInCache(('a', (1, 2), ()), 3, ttl=0)
+        3
+        >>> s.putInCache(('b', (1, 2), ()), 4)
+        4
+        >>> s.flush()
+        >>> s.expire()
+        1
+        >>> s._count()
+        1
+
+        A failure is counted as an error.
+
+        >>> s._local.connection = sqlite3.connect(':memory:')
+        >>> s.expire()
+        0
+        >>> s.stats.snapshot()['errors']
+        1
+        """
+        if now is None:
+            now = time.time()
+        connection = self._connection()
+        try:
+            with connection:
+                expired = connection.execute('DELETE FROM cache WHERE expiry <= ?',
+                                             (now,)).rowcount
+        except sqlite3.Error:
+            if self.stats is not None:
+                self.stats.incr('errors')
+            return 0
+        if expired and self.stats is not None:
+            self.stats.incr('expirations', expired)
+        return expired
+
+    def _count(self):
+        return self._connection().execute('SELECT count(*) FROM cache').fetchone()[0]
+
+    def _queued(self, digest):
+        """
+        The (expiry, blob) of a put not yet written, or None.
+        """
+        self._checkFork()
+        self._lock.acquire()
+        try:
+            entry = self._pending.get(digest)
+            if entry is None:
+                entry = self._flushing.get(digest)
+            return entry
+        finally:
+            self._lock.release()
+
+    def _lookup(self, digest):
+        """
+        Return the blob of a key, None if missing or expired.
+        """
+        now = time.time()
+        entry = self._queued(digest)
+        if entry is not None:
+            expiry, blob = entry
+        else:
+            row = self._connection().execute(
+                'SELECT expiry, value FROM cache WHERE key = ?',
+                (sqlite3.Binary(digest),)).fetchone()
+            if row is None:
+                return None
+            expiry, blob = row
+        if expiry <= now:
+            return None
+        return blob
+
+    def get(self, key, default=MISS):
+        """
+        Return cache result or default.
+
+        >>> import tempfile
+        >>> s = SqliteCache({'file': os.path.join(tempfile.mkdtemp(), 'c.db'), 'freq': '2', 'expirationdelay': '30'})
+        >>> s.get(('a', (1, 2), ()))
+        MISS
+        >>> s.putInCache(('a', (1, 2), ()), {'b': 3})
+        {'b': 3}
+        >>> s.flush()
+        >>> s.get(('a', (1, 2), ()))
+        {'b': 3}
+        >>> s.putInCache(('a', (1, 2), ()), 4, ttl=0)
+        4
+        >>> s.get(('a', (1, 2), ()))
+        MISS
+        """
+        blob = self._lookup(_digest(key))
+        if blob is None:
+            return default
+        return serializers.load(StringIO(bytes(blob)))
+
+    def isCached(self, key):
+        """
+        >>> import tempfile
+        >>> s = SqliteCache({'file': os.path.join(tempfile.mkdtemp(), 'c.db'), 'freq': '2', 'expirationdelay': '30'})
+        >>> s.isCached(('a', (1, 2), ()))
+        False
+        >>> s.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> s.isCached(('a', (1, 2), ()))
+        True
+        """
+        return self._lookup(_digest(key)) is not None
+
+    def cached(self, key):
+        """
+        >>> import tempfile
+        >>> s = SqliteCache({'file': os.path.join(tempfile.mkdtemp(), 'c.db'), 'freq': '2', 'expirationdelay': '30'})
+        >>> s.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> s.cached(('a', (1, 2), ()))
+        3
+        """
+        result = self.get(key)
+        if result is MISS:
+            raise KeyError(key)
+        return result
+
+    def putInCache(self, key, result, ttl=None):
+        """
+        Queue result for the writer, expiring after ttl seconds,
+        expirationdelay by default.
+
+        >>> import tempfile
+        >>> s = SqliteCache({'file': os.path.join(tempfile.mkdtemp(), 'c.db'), 'freq': '2', 'expirationdelay': '30', 'batchsize': '10'})
+        >>> for i in range(9):
+        ...     _ = s.putInCache(('a', (i, 2), ()), i)
+        >>> s._wake.isSet()
+        False
+        >>> s.putInCache(('a', (9, 2), ()), 9)
+        9
+        >>> s._wake.isSet()
+        True
+
+        Past maxPending queued puts, new keys are dropped.
+
+        >>> s = SqliteCache({'file': os.path.join(tempfile.mkdtemp(), 'c.db'), 'freq': '2', 'expirationdelay': '30', 'maxpending': '3'})
+        >>> for i in range(5):
+        ...     _ = s.putInCache(('a', (i, 2), ()), i)
+        >>> len(s._pending), s.get(('a', (4, 2), ())), s.stats.snapshot()['errors']
+        (3, MISS, 2)
+        """
+        out = StringIO()
+        serializers.dump(result, out, self._serializer)
+        expiry = time.time() + (self._expirationdelay if ttl is None else ttl)
+        digest = _digest(key)
+
+        self._checkFork()
+        self._lock.acquire()
+        try:
+            dropped = len(self._pending) >= self._maxPending and digest not in self._pending
+            if not dropped:
+                self._pending[digest] = (expiry, out.getvalue())
+            full = len(self._pending) >= self._batchSize
+        finally:
+            self._lock.release()
+        if dropped and self.stats is not None:
+            self.stats.incr('errors')
+        if full:
+            self._wake.set()
+        return result
+
+    @staticmethod
+    def checkConf(config):
+        """
+        Check configuration for SQLite Cache.
+
+        >>> SqliteCache.checkConf({})
+        Traceback (most recent call last):
+        ...
+        IncoherentSectionConfig: not module SqliteCache
+        >>> SqliteCache.checkConf({'module': 'SqliteCache'})
+        Traceback (most recent call last):
+        ...
+        MissingConfigException: no file in config
+        >>> SqliteCache.checkConf({'module': 'SqliteCache', 'file': 'test/noexist/c.db', 'freq': '2', 'expirationdelay': '3'})
+        Traceback (most recent call last):
+        ...
+        CacheDirIncorrect: test/noexist isn't correct
+        >>> SqliteCache.checkConf({'module': 'SqliteCache', 'file': 'test/c.db', 'freq': 'a', 'expirationdelay': '3'})
+        Traceback (most recent call last):
+        ...
+        NotInteger: freq must be an integer
+        >>> SqliteCache.checkConf({'module': 'SqliteCache', 'file': 'test/c.db', 'freq': '2', 'expirationdelay': '3', 'batchsize': '0'})
+        Traceback (most recent call last):
+        ...
+        BadOptionValue: batchsize must be at least 1
+        >>> SqliteCache.checkConf({'module': 'SqliteCache', 'file': 'test/c.db', 'freq': '2', 'expirationdelay': '3', 'batchsize': '10', 'maxpending': '5'})
+        Traceback (most recent call last):
+        ...
+        BadOptionValue: maxpending must be at least batchsize
+        >>> SqliteCache.checkConf({'module': 'SqliteCache', 'file': 'test/c.db', 'freq': '2', 'expirationdelay': '3'})
+        """
+        try:
+            if config['module'] != 'SqliteCache':
+                raise IncoherentSectionConfig('not module SqliteCache')
+        except KeyError:
+            raise IncoherentSectionConfig('not module SqliteCache')
+
+        for option in ['file', 'freq', 'expirationdelay']:
+            if not option in config:
+                raise MissingConfigException('no %s in config' % option)
+
+        directory = os.path.dirname(config['file']) or '.'
+        if not os.path.isdir(directory):
+            raise CacheDirIncorrect(directory + " isn't correct")
+
+        for option in ['freq', 'expirationdelay']:
+            try:
+                tmp = int(config[option])
+            except ValueError:
+                raise NotInteger('%s must be an integer' % option)
+
+        batchSize = getInteger(config, 'batchsize', 500)
+        if batchSize < 1:
+            raise BadOptionValue('batchsize must be at least 1')
+        if getInteger(config, 'maxpending', 10 * batchSize) < batchSize:
+            raise BadOptionValue('maxpending must be at least batchsize')
+        getNumber(config, 'flushinterval')
+        serializers.getSerializer(config.get('serializer', 'pickle'))
+
+
+def _digest(key):
+    """
+    Raw sha1 of a key, 20 bytes.
+    """
+    return binascii.unhexlify(digestKey(key))
+
+
+class CacheDirIncorrect(Exception):
+    """
+    >>> CacheDirIncorrect('foo')
+    CacheDirIncorrect('foo',)
+    """
+    pass
+
+
+class NotInteger(Exception):
+    """
+    >>> NotInteger('foo')
+    NotInteger('foo',)
+    """
+    pass
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+
+import json
+import math
+import threading
+import weakref
+
+from configoptions import getBoolean
+
+
+COUNTERS = ('hits', 'misses', 'puts', 'evictions', 'expirations', 'errors')
+TIMERS = ('lookup', 'compute', 'store')
+
+# latency buckets : bucket b holds [2**(b-1), 2**b) microseconds
+_BUCKETS = 40
+
+
+class Stats(object):
+    """
+    Counters and latency histograms of a cache section.
+
+    Each thread records in its own counters, without locking ; reading
+    merges the counters of every thread. The counters of threads that
+    ended are folded into one record, so threads coming and going do not
+    pile up records.
+    """
+
+    def __init__(self):
+        """
+        >>> s = Stats()
+        >>> s.snapshot()['hits']
+        0
+        """
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # (weakref to the thread, its record)
+        self._records = []
+        # counters of the threads that ended
+        self._ended = _Record()
+
+    @staticmethod
+    def fromConfig(config):
+        """
+        Return a Stats unless the section disables it.
+
+        >>> Stats.fromConfig({'module': 'RamCache'}) #doctest: +ELLIPSIS
+        <__main__.Stats object at 0x...>
+        >>> Stats.fromConfig({'stats': 'off'}) is None
+        True
+        """
+        if not getBoolean(config, 'stats', True):
+            return None
+        return Stats()
+
+    @staticmethod
+    def checkConf(config):
+        """
+        >>> Stats.checkConf({'stats': 'nope'})
+        Traceback (most recent call last):
+        ...
+        BadOptionValue: stats must be a boolean
+        """
+        getBoolean(config, 'stats', True)
+
+    def _record(self):
+        """
+        The record of the current thread.
+        """
+        try:
+            return self._local.record
+        except AttributeError:
+            record = self._local.record = _Record()
+            thread = weakref.ref(threading.current_thread())
+            self._lock.acquire()
+            try:
+                self._foldEnded()
+                self._records.append((thread, record))
+            finally:
+                self._lock.release()
+            return record
+
+    def _foldEnded(self):
+        """
+        Add the records of the threads that ended to the ended record,
+        with the lock held.
+        """
+        live = []
+        for thread, record in self._records:
+            owner = thread()
+            if owner is not None and owner.is_alive():
+                live.append((thread, record))
+            else:
+                self._ended.add(record)
+        self._records = live
+
+    def incr(self, counter, n=1):
+        """
+        >>> s = Stats()
+        >>> s.incr('hits')
+        >>> s.incr('hits', 2)
+        >>> s.snapshot()['hits']
+        3
+        """
+        try:
+            counts = self._local.record.counts
+        except AttributeError:
+            counts = self._record().counts
+        counts[counter] += n
+
+    def observe(self, timer, seconds):
+        """
+        Record a latency, in seconds.
+
+        >>> s = Stats()
+        >>> for i in range(99):
+        ...     s.observe('lookup', 0.000003)
+        >>> s.observe('lookup', 0.1)
+        >>> lookup = s.snapshot()['latency']['lookup']
+        >>> lookup['count'], lookup['p50'], lookup['p99'], lookup['max']
+        (100, 4, 4, 131072)
+        """
+        try:
+            histogram = self._local.record.histograms[timer]
+        except AttributeError:
+            histogram = self._record().histograms[timer]
+        if seconds > 0:
+            bucket = min(math.frexp(seconds * 1e6)[1], _BUCKETS - 1)
+            histogram[max(bucket, 0)] += 1
+        else:
+            histogram[0] += 1
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            for thread, record in self._records:
+                record.clear()
+            self._ended.clear()
+        finally:
+            self._lock.release()
+
+    def snapshot(self):
+        """
+        Return the merged counters, the hit ratio and, per timer, the
+        count, percentiles and max in microseconds (bucket upper bounds)
+        and the non empty buckets.
+
+        >>> s = Stats()
+        >>> def work():
+        ...     for i in range(1000):
+        ...         s.incr('hits')
+        ...     s.incr('misses')
+        >>> threads = [threading.Thread(target=work) for i in range(4)]
+        >>> for t in threads:
+        ...     t.start()
+        >>> for t in threads:
+        ...     t.join()
+        >>> snapshot = s.snapshot()
+        >>> snapshot['hits'], snapshot['misses'], snapshot['hitRatio']
+        (4000, 4, 0.999)
+        >>> snapshot['latency']['compute']
+        {'count': 0}
+
+        The records of the threads that ended are folded into one.
+
+        >>> threads = [threading.Thread(target=work) for i in range(50)]
+        >>> for t in threads:
+        ...     t.start()
+        ...     t.join()
+        >>> s.snapshot()['hits'], len(s._records) < 3
+        (54000, True)
+        """
+        merged = _Record()
+        self._lock.acquire()
+        try:
+            self._foldEnded()
+            merged.add(self._ended)
+            records = [record for thread, record in self._records]
+        finally:
+            self._lock.release()
+        for record in records:
+            merged.add(record)
+
+        snapshot = dict(merged.counts)
+        histograms = merged.histograms
+
+        lookups = snapshot['hits'] + snapshot['misses']
+        snapshot['hitRatio'] = round(float(snapshot['hits']) / lookups, 3) if lookups else None
+        snapshot['latency'] = dict((timer, _summary(histogram))
+                                   for timer, histogram in histograms.items())
+        return snapshot
+
+
+class _Record(object):
+    """
+    Counters of one thread.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.counts = dict((counter, 0) for counter in COUNTERS)
+        self.histograms = dict((timer, [0] * _BUCKETS) for timer in TIMERS)
+
+    def add(self, other):
+        """
+        Add the counters of another record.
+        """
+        for counter, count in other.counts.items():
+            self.counts[counter] += count
+        for timer, histogram in other.histograms.items():
+            merged = self.histograms[timer]
+            for bucket, count in enumerate(histogram):
+                merged[bucket] += count
+
+
+def _summary(histogram):
+    count = sum(histogram)
+    if not count:
+        return {'count': 0}
+
+    def percentile(p):
+        rank = p * count
+        seen = 0
+        for bucket, n in enumerate(histogram):
+            seen += n
+            if seen >= rank:
+                return 2 ** bucket
+    top = max(bucket for bucket, n in enumerate(histogram) if n)
+    return {'count': count, 'p50': percentile(0.5), 'p99': percentile(0.99),
+            'max': 2 ** top,
+            'buckets': [[2 ** bucket, n] for bucket, n in enumerate(histogram) if n]}
+
+
+def dumps(sections, format='text'):
+    """
+    Dump {section: snapshot} as 'text' or 'json'.
+
+    >>> s = Stats()
+    >>> s.incr('hits', 3)
+    >>> s.incr('misses')
+    >>> s.observe('lookup', 0.00001)
+    >>> print(dumps({'ram': s.snapshot()}))
+    [ram]
+      hits 3  misses 1  puts 0  evictions 0  expirations 0  errors 0  hit ratio 0.75
+      lookup   count 1  p50 16us  p99 16us  max 16us
+    >>> json.loads(dumps({'ram': s.snapshot()}, 'json'))['ram']['hits']
+    3
+    """
+    if format == 'json':
+        return json.dumps(sections, sort_keys=True)
+    if format != 'text':
+        raise ValueError('unknown stats format %s' % format)
+
+    lines = []
+    for section in sorted(sections):
+        snapshot = sections[section]
+        lines.append('[%s]' % section)
+        counters = '  '.join('%s %d' % (counter, snapshot[counter]) for counter in COUNTERS)
+        if snapshot['hitRatio'] is not None:
+            counters += '  hit ratio %s' % snapshot['hitRatio']
+        if 'bytes' in snapshot:
+            counters += '  bytes %d' % snapshot['bytes']
+        lines.append('  ' + counters)
+        for timer in TIMERS:
+            latency = snapshot['latency'][timer]
+            if latency['count']:
+                lines.append('  %-8s count %d  p50 %dus  p99 %dus  max %dus'
+                             % (timer, latency['count'], latency['p50'], latency['p99'],
+                                latency['max']))
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
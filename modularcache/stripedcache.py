@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+import sys
+import threading
+
+from abstractcache import AbstractCache, MISS
+from configoptions import getInteger
+
+from exceptionconfig import *
+
+
+class StripedCache(AbstractCache):
+    """
+    Thread safe cache made of stripes.
+
+    Keys are spread by hash over `stripes` instances of a backend, each one
+    guarded by its own lock : threads working on different stripes never
+    wait for each other. Capacity options are shared out between stripes,
+    so an LRU evicts per stripe.
+    """
+
+    # options divided between stripes
+    _capacityOptions = ('size', 'maxentries', 'maxbytes')
+
+    def __init__(self, backend, config):
+        """
+        backend : the backend class of the stripes.
+        config : the Cache_* section, with a 'stripes' option.
+
+        >>> from ramlrucache import RamLRUCache
+        >>> s = StripedCache(RamLRUCache, {'module': 'RamLRUCache', 'size': '100', 'stripes': '4'})
+        >>> len(s._stripes)
+        4
+        >>> s._stripes[0] #doctest: +ELLIPSIS
+        <ramlrucache.RamLRUCache object at 0x...>
+        >>> s._stripes[0]._size
+        25
+        >>> len(set(s._locks))
+        4
+        """
+        AbstractCache.__init__(self, config)
+
+        stripes = getInteger(config, 'stripes', 1)
+
+        stripeConfig = dict(config)
+        stripeConfig.pop('singleflight', None)
+        for option in self._capacityOptions:
+            if option in stripeConfig:
+                stripeConfig[option] = max(1, int(stripeConfig[option]) // stripes)
+
+        self._stripes = [backend(stripeConfig) for i in range(stripes)]
+        self._locks = [threading.Lock() for i in range(stripes)]
+        self.blocking = self._stripes[0].blocking
+        # one set of counters for the section
+        for stripe in self._stripes:
+            stripe.stats = self.stats
+
+    @staticmethod
+    def checkConf(config):
+        """
+        Check the stripes option of a section.
+
+        >>> StripedCache.checkConf({'module': 'RamCache'})
+        >>> StripedCache.checkConf({'module': 'RamCache', 'stripes': '16'})
+        >>> StripedCache.checkConf({'module': 'RamCache', 'stripes': 'a'})
+        Traceback (most recent call last):
+        ...
+        BadOptionValue: stripes must be an integer
+        >>> StripedCache.checkConf({'module': 'RamCache', 'stripes': '0'})
+        Traceback (most recent call last):
+        ...
+        BadOptionValue: stripes must be at least 1
+        """
+        if getInteger(config, 'stripes', 1) < 1:
+            raise BadOptionValue('stripes must be at least 1')
+
+    def memoryBytes(self):
+        """
+        Bytes held by all stripes, None if the backend does not count them.
+
+        >>> from ramcache import RamCache
+        >>> s = StripedCache(RamCache, {'stripes': '4', 'maxbytes': '40000', 'sizer': 'getsizeof'})
+        >>> s._stripes[0]._maxBytes
+        10000
+        >>> for i in range(8):
+        ...     _ = s.putInCache(('a', (i,), ()), 'x' * 100)
+        >>> s.memoryBytes() == 8 * sys.getsizeof('x' * 100)
+        True
+        >>> StripedCache(RamCache, {'stripes': '4'}).memoryBytes() is None
+        True
+        """
+        if not hasattr(self._stripes[0], 'memoryBytes'):
+            return None
+        total = 0
+        for lock, stripe in zip(self._locks, self._stripes):
+            with lock:
+                size = stripe.memoryBytes()
+            if size is None:
+                return None
+            total += size
+        return total
+
+    def _stripe(self, key):
+        """
+        Return the (lock, cache) of the stripe of a key.
+        """
+        i = hash(key) % len(self._stripes)
+        return self._locks[i], self._stripes[i]
+
+    def get(self, key, default=MISS):
+        """
+        >>> from ramcache import RamCache
+        >>> s = StripedCache(RamCache, {'stripes': '4'})
+        >>> s.get(('a', (1, 2), ()))
+        MISS
+        >>> s.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> s.get(('a', (1, 2), ()))
+        3
+        """
+        lock, cache = self._stripe(key)
+        with lock:
+            return cache.get(key, default)
+
+    def _byStripe(self, keys):
+        """
+        Return {stripe index: [positions of its keys]}.
+        """
+        n = len(self._stripes)
+        groups = {}
+        for position, key in enumerate(keys):
+            groups.setdefault(hash(key) % n, []).append(position)
+        return groups
+
+    def getMany(self, keys, default=MISS):
+        """
+        Return the results of keys, taking each stripe lock once.
+
+        >>> from ramcache import RamCache
+        >>> s = StripedCache(RamCache, {'stripes': '4'})
+        >>> s.putMany([(('a', (i,), ()), i) for i in range(8)])
+        >>> s.getMany([('a', (i,), ()) for i in range(10)])
+        [0, 1, 2, 3, 4, 5, 6, 7, MISS, MISS]
+        """
+        keys = list(keys)
+        results = [default] * len(keys)
+        for i, positions in self._byStripe(keys).items():
+            with self._locks[i]:
+                found = self._stripes[i].getMany([keys[p] for p in positions], default)
+            for position, result in zip(positions, found):
+                results[position] = result
+        return results
+
+    def putMany(self, items, ttl=None):
+        items = list(items)
+        for i, positions in self._byStripe([key for key, result in items]).items():
+            with self._locks[i]:
+                self._stripes[i].putMany([items[p] for p in positions], ttl)
+
+    def isCached(self, key):
+        """
+        >>> from ramcache import RamCache
+        >>> s = StripedCache(RamCache, {'stripes': '4'})
+        >>> s.isCached(('a', (1, 2), ()))
+        False
+        """
+        lock, cache = self._stripe(key)
+        with lock:
+            return cache.isCached(key)
+
+    def cached(self, key):
+        """
+        >>> from ramcache import RamCache
+        >>> s = StripedCache(RamCache, {'stripes': '4'})
+        >>> s.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> s.cached(('a', (1, 2), ()))
+        3
+        """
+        lock, cache = self._stripe(key)
+        with lock:
+            return cache.cached(key)
+
+    def putInCache(self, key, result, ttl=None):
+        """
+        Put result in the stripe of the key.
+
+        >>> from ramlrucache import RamLRUCache
+        >>> s = StripedCache(RamLRUCache, {'size': '64', 'stripes': '8'})
+        >>> def work(n):
+        ...     for i in range(2000):
+        ...         key = ('f', (n, i % 100), ())
+        ...         if s.get(key) is MISS:
+        ...             s.putInCache(key, i)
+        >>> threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+        >>> for t in threads:
+        ...     t.start()
+        >>> for t in threads:
+        ...     t.join()
+        >>> all(len(stripe._cache) <= 8 for stripe in s._stripes)
+        True
+        """
+        lock, cache = self._stripe(key)
+        with lock:
+            return cache.putInCache(key, result, ttl)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+
+from abstractcache import AbstractCache, MISS
+from cachedict import CacheDict
+from writebehind import WriteBehind
+
+import exceptionconfig
+from exceptionconfig import *
+
+
+class TieredCache(AbstractCache):
+    """
+    Cache made of other cache sections, fastest first.
+
+    tiers = ramlru, fscache
+
+    Reads try each tier in order and copy a hit into the faster tiers, so a
+    key read from disk once is then served from RAM. Writes go to every
+    tier, or with writeBehind to the first one at once and to the slower
+    ones from a background thread. Tiers are sections of the same
+    configuration, looked up in CacheDict on first use.
+    """
+
+    # writeBehind applies to the slower tiers only, not to the section
+    ownWriteBehind = True
+
+    def __init__(self, config):
+        """
+        Tiered cache.
+
+        >>> t = TieredCache({'module': 'TieredCache', 'tiers': 'ramlru, fscache'})
+        >>> t._tierNames
+        ['ramlru', 'fscache']
+        >>> t._tiers is None
+        True
+        """
+        AbstractCache.__init__(self, config)
+
+        self._tierNames = _tierNames(config)
+        self._tiers = None
+        self._writeBehind = WriteBehind.fromConfig(self._writeSlower, config, self.stats)
+
+    def tiers(self):
+        """
+        Return the tier caches, fastest first.
+
+        >>> from ramcache import RamCache
+        >>> cd = CacheDict()
+        >>> cd['ram'] = RamCache()
+        >>> TieredCache({'tiers': 'ram, disk'}).tiers()
+        Traceback (most recent call last):
+        ...
+        CacheSectionNotDefined: No Cache_disk section
+        """
+        if self._tiers is None:
+            cd = CacheDict.getInstance()
+            tiers = []
+            for name in self._tierNames:
+                if cd is None or name not in cd:
+                    raise exceptionconfig.CacheSectionNotDefined('No Cache_' + name + ' section')
+                tiers.append(cd[name])
+            self._tiers = tiers
+        return self._tiers
+
+    @property
+    def blocking(self):
+        """
+        True if a tier is.
+
+        >>> from ramcache import RamCache
+        >>> cd = CacheDict()
+        >>> cd['l1'], cd['l2'] = RamCache(), RamCache()
+        >>> TieredCache({'tiers': 'l1, l2'}).blocking
+        False
+        """
+        return any(tier.blocking for tier in self.tiers())
+
+    def get(self, key, default=MISS):
+        """
+        Return the result of the first tier holding key, copied into the
+        tiers before it.
+
+        >>> from ramcache import RamCache
+        >>> cd = CacheDict()
+        >>> cd['l1'], cd['l2'] = RamCache(), RamCache()
+        >>> t = TieredCache({'tiers': 'l1, l2'})
+        >>> t.get(('a', (1, 2), ()))
+        MISS
+        >>> cd['l2'].putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> t.get(('a', (1, 2), ()))
+        3
+        >>> cd['l1'].get(('a', (1, 2), ()))
+        3
+
+        After the first hit, a key of a disk tier is served by the RAM tier
+        only : bench/bench_tieredcache.py times it.
+
+        >>> import tempfile
+        >>> from fscache import FsCache
+        >>> from ramlrucache import RamLRUCache
+        >>> cd['ramlru'] = RamLRUCache({'size': '100'})
+        >>> cd['fscache'] = FsCache({'dir': tempfile.mkdtemp(), 'freq': '1', 'expirationdelay': '60'})
+        >>> t = TieredCache({'tiers': 'ramlru, fscache'})
+        >>> key = ('f', (1, 2), ())
+        >>> cd['fscache'].putInCache(key, range(100)) #doctest: +ELLIPSIS
+        [0, 1, 2, ...]
+        >>> reads = {'ramlru': 0, 'fscache': 0}
+        >>> def counted(name):
+        ...     tierGet = cd[name].get
+        ...     def get(*args):
+        ...         reads[name] += 1
+        ...         return tierGet(*args)
+        ...     cd[name].get = get
+        >>> counted('ramlru'), counted('fscache')
+        (None, None)
+        >>> for i in range(1000):
+        ...     _ = t.get(key)
+        >>> reads
+        {'ramlru': 1000, 'fscache': 1}
+        >>> cd['ramlru']._cache[key] == range(100)
+        True
+        """
+        tiers = self.tiers()
+        for i, tier in enumerate(tiers):
+            result = tier.get(key, MISS)
+            if result is not MISS:
+                for faster in tiers[:i]:
+                    faster.putInCache(key, result)
+                return result
+        return default
+
+    def getMany(self, keys, default=MISS):
+        """
+        Return the results of keys, asking each tier for the keys still
+        missing and copying hits into the faster tiers.
+
+        >>> from ramcache import RamCache
+        >>> cd = CacheDict()
+        >>> cd['l1'], cd['l2'] = RamCache(), RamCache()
+        >>> t = TieredCache({'tiers': 'l1, l2'})
+        >>> cd['l1'].putInCache(('a', (1,), ()), 1)
+        1
+        >>> cd['l2'].putInCache(('a', (2,), ()), 2)
+        2
+        >>> t.getMany([('a', (1,), ()), ('a', (2,), ()), ('a', (3,), ())])
+        [1, 2, MISS]
+        >>> sorted(cd['l1']._cache.values())
+        [1, 2]
+        """
+        keys = list(keys)
+        results = [default] * len(keys)
+        missing = range(len(keys))
+        tiers = self.tiers()
+        for i, tier in enumerate(tiers):
+            if not missing:
+                break
+            found = tier.getMany([keys[p] for p in missing], MISS)
+            hits = []
+            stillMissing = []
+            for position, result in zip(missing, found):
+                if result is MISS:
+                    stillMissing.append(position)
+                else:
+                    results[position] = result
+                    hits.append((keys[position], result))
+            for faster in tiers[:i]:
+                faster.putMany(hits)
+            missing = stillMissing
+        return results
+
+    def isCached(self, key):
+        """
+        >>> from ramcache import RamCache
+        >>> cd = CacheDict()
+        >>> cd['l1'], cd['l2'] = RamCache(), RamCache()
+        >>> t = TieredCache({'tiers': 'l1, l2'})
+        >>> t.isCached(('a', (1, 2), ()))
+        False
+        >>> cd['l2'].putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> t.isCached(('a', (1, 2), ()))
+        True
+        """
+        for tier in self.tiers():
+            if tier.isCached(key):
+                return True
+        return False
+
+    def cached(self, key):
+        """
+        >>> from ramcache import RamCache
+        >>> cd = CacheDict()
+        >>> cd['l1'], cd['l2'] = RamCache(), RamCache()
+        >>> t = TieredCache({'tiers': 'l1, l2'})
+        >>> cd['l2'].putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> t.cached(('a', (1, 2), ()))
+        3
+        """
+        result = self.get(key)
+        if result is MISS:
+            raise KeyError(key)
+        return result
+
+    def putInCache(self, key, result, ttl=None):
+        """
+        Put result in every tier.
+
+        >>> from ramcache import RamCache
+        >>> cd = CacheDict()
+        >>> cd['l1'], cd['l2'] = RamCache(), RamCache()
+        >>> t = TieredCache({'tiers': 'l1, l2'})
+        >>> t.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> cd['l1']._cache, cd['l2']._cache
+        ({('a', (1, 2), ()): 3}, {('a', (1, 2), ()): 3})
+
+        With writeBehind the slower tiers are written in background.
+
+        >>> cd['l1'], cd['l2'] = RamCache(), RamCache()
+        >>> t = TieredCache({'tiers': 'l1, l2', 'writebehind': 'true'})
+        >>> t.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> cd['l1']._cache
+        {('a', (1, 2), ()): 3}
+        >>> t.flush()
+        >>> cd['l2']._cache
+        {('a', (1, 2), ()): 3}
+        """
+        tiers = self.tiers()
+        tiers[0].putInCache(key, result, ttl)
+        if self._writeBehind is not None:
+            self._writeBehind.put(key, result, ttl)
+        else:
+            self._writeSlower(key, result, ttl)
+        return result
+
+    def _writeSlower(self, key, result, ttl):
+        for tier in self.tiers()[1:]:
+            tier.putInCache(key, result, ttl)
+
+    def flush(self):
+        """
+        Wait for the pending background writes.
+        """
+        if self._writeBehind is not None:
+            self._writeBehind.flush()
+
+    @staticmethod
+    def checkConf(config):
+        """
+        Check configuration for Tiered Cache.
+
+        >>> TieredCache.checkConf({})
+        Traceback (most recent call last):
+        ...
+        IncoherentSectionConfig: not module TieredCache
+        >>> TieredCache.checkConf({'module': 'TieredCache'})
+        Traceback (most recent call last):
+        ...
+        MissingConfigException: no tiers in config
+        >>> TieredCache.checkConf({'module': 'TieredCache', 'tiers': ' , '})
+        Traceback (most recent call last):
+        ...
+        BadOptionValue: tiers must name at least one section
+        >>> TieredCache.checkConf({'module': 'TieredCache', 'tiers': 'ramlru, fscache', 'writebehind': 'yes'})
+        """
+        try:
+            if config['module'] != 'TieredCache':
+                raise IncoherentSectionConfig('not module TieredCache')
+        except KeyError:
+            raise IncoherentSectionConfig('not module TieredCache')
+
+        if not 'tiers' in config:
+            raise MissingConfigException('no tiers in config')
+        if not _tierNames(config):
+            raise BadOptionValue('tiers must name at least one section')
+        WriteBehind.checkConf(config)
+
+
+def _tierNames(config):
+    return [name.strip() for name in config['tiers'].split(',') if name.strip()]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
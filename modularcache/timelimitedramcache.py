@@ -1,8 +1,13 @@
 #!/usr/bin/env path
 
-import datetime
+import heapq
+import itertools
 
+from abstractcache import AbstractCache, MISS
+from clock import monotonic
+from configoptions import getInteger, getNumber
 from ramcache import RamCache
+import sizer
 
 
 from exceptionconfig import *
@@ -10,7 +15,16 @@ from exceptionconfig import *
 class TimeLimitedRamCache(RamCache):
     """
     Ram Cache.
+
+    Entries expire `duration` seconds after being put. Deadlines are kept
+    in a heap drained a few entries at a time on each get and put, so
+    expired entries are freed with bounded work per operation and memory
+    follows the live working set. `maxEntries` optionally caps the number
+    of entries, evicting the ones closest to expiry, as does `maxBytes`.
     """
+
+    # expired entries freed at most per operation
+    _drainBatch = 8
     
     def __init__(self, config):
         """
@@ -21,15 +35,21 @@ class TimeLimitedRamCache(RamCache):
         <__main__.TimeLimitedRamCache object at 0x...>
         >>> r._cache
         {}
-        >>> r._dateHit
+        >>> r._expiry
         {}
-        >>> r._timedelta
-        datetime.timedelta(0, 2)
+        >>> r._duration
+        2.0
+        >>> r._maxEntries is None
+        True
         """
-        RamCache.__init__(self)
+        RamCache.__init__(self, config)
 
-        self._timedelta = datetime.timedelta(seconds=config['duration'])
-        self._dateHit = {}
+        self._duration = float(config['duration'])
+        self._maxEntries = getInteger(config, 'maxentries')
+        # key -> (deadline, seq) ; heap of (deadline, seq, key)
+        self._expiry = {}
+        self._heap = []
+        self._seq = itertools.count()
         
     
     @staticmethod
@@ -50,7 +70,10 @@ class TimeLimitedRamCache(RamCache):
         ...
         MissingConfigException: no duration in config
         >>> TimeLimitedRamCache.checkConf({'module': 'TimeLimitedRamCache', 'duration': '2'})
-        
+        >>> TimeLimitedRamCache.checkConf({'module': 'TimeLimitedRamCache', 'duration': '2', 'maxentries': 'a'})
+        Traceback (most recent call last):
+        ...
+        BadOptionValue: maxentries must be an integer
         """
         try:
             if config['module'] == 'TimeLimitedRamCache':
@@ -63,57 +86,200 @@ class TimeLimitedRamCache(RamCache):
         except KeyError:
             raise IncoherentSectionConfig('not module TimeLimitedRamCache')
 
+        getNumber(config, 'duration')
+        getInteger(config, 'maxentries')
+        sizer.checkConf(config)
+
+
+
+    def get(self, key, default=MISS):
+        """
+        Return the cached result if it is still valid, else default.
+
+        >>> r = TimeLimitedRamCache({'duration' : 0.1})
+        >>> r.get(('a', (1, 2), ()))
+        MISS
+        >>> r.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> r.get(('a', (1, 2), ()))
+        3
+        >>> import time
+        >>> time.sleep(0.2)
+        >>> r.get(('a', (1, 2), ()))
+        MISS
+        >>> r._cache
+        {}
+        """
+        now = monotonic()
+        self._drain(now)
 
+        expiry = self._expiry.get(key)
+        if expiry is None:
+            return default
+        if expiry[0] <= now:
+            self._remove(key)
+            if self.stats is not None:
+                self.stats.incr('expirations')
+            return default
+        return self._cache[key]
 
-    def isCached(self, func, *args, **kwargs):
+    def isCached(self, key):
         """
         >>> r = TimeLimitedRamCache({'duration' : 2})
         >>> r._cache
         {}
-        >>> r.isCached('a',[1, 2], {})
+        >>> r.isCached(('a', (1, 2), ()))
         False
-        >>> r._cache =  {'a': {'([1, 2], {})': {'{}': 3}}}
-        >>> r.isCached('a',[1, 2], {})
+        >>> r._cache =  {('a', (1, 2), ()): 3}
+        >>> r.isCached(('a', (1, 2), ()))
         False
-        >>> import datetime
-        >>> now = datetime.datetime.now()
-        >>> r._dateHit = {'a': {'([1, 2], {})': {'{}': now}}}
-        >>> r.isCached('a',[1, 2], {})
+        >>> r._expiry = {('a', (1, 2), ()): (monotonic() + 2, 0)}
+        >>> r.isCached(('a', (1, 2), ()))
         True
+        >>> r._expiry = {('a', (1, 2), ()): (monotonic() - 1, 0)}
+        >>> r.isCached(('a', (1, 2), ()))
+        False
         """
-        return func in self._cache and str(args) in self._cache[func] and str(kwargs) in self._cache[func][str(args)] and  \
-               func in self._dateHit and str(args) in self._dateHit[func] and str(kwargs) in self._dateHit[func][str(args)] and \
-                self._dateHit[func][str(args)][str(kwargs)] - datetime.datetime.now() < self._timedelta
+        expiry = self._expiry.get(key)
+        return expiry is not None and key in self._cache and expiry[0] > monotonic()
 
-    def cached(self, func, *args, **kwargs):
+    def cached(self, key):
         """
         >>> r = TimeLimitedRamCache({'duration' : 2})
-        >>> r._cache =  {'a': {'([1, 2], {})': {'{}': 3}}}
-        >>> r.cached('a',[1, 2], {})
+        >>> r._cache =  {('a', (1, 2), ()): 3}
+        >>> r.cached(('a', (1, 2), ()))
         3
         """
-        return  self._cache[func][str(args)][str(kwargs)]
+        return self._cache[key]
+
+    def getMany(self, keys, default=MISS):
+        """
+        Expired entries are missing from batches too.
+
+        >>> r = TimeLimitedRamCache({'duration' : 2})
+        >>> r.putMany([(('a', (1,), ()), 3), (('a', (2,), ()), 4)])
+        >>> r.putMany([(('a', (3,), ()), 5)], ttl=0)
+        >>> r.getMany([('a', (1,), ()), ('a', (2,), ()), ('a', (3,), ())])
+        [3, 4, MISS]
+        """
+        return AbstractCache.getMany(self, keys, default)
+
+    def putMany(self, items, ttl=None):
+        AbstractCache.putMany(self, items, ttl)
 
-    def putInCache(self, func, result, *args, **kwargs):
+    def putInCache(self, key, result, ttl=None):
         """
         >>> r = TimeLimitedRamCache({'duration' : 2})
-        >>> r.putInCache('a', 3, [1, 2], {})
+        >>> r.putInCache(('a', (1, 2), ()), 3)
         3
         >>> r._cache
-        {'a': {'([1, 2], {})': {'{}': 3}}}
+        {('a', (1, 2), ()): 3}
+
+        ttl overrides the duration for one entry.
+
+        >>> r.putInCache(('b', (1, 2), ()), 4, ttl=0.1)
+        4
+        >>> import time
+        >>> time.sleep(0.2)
+        >>> r.get(('b', (1, 2), ()))
+        MISS
+        >>> r.get(('a', (1, 2), ()))
+        3
+
+        Expired entries are freed by later operations.
+
+        >>> r = TimeLimitedRamCache({'duration' : 0.1})
+        >>> for i in range(1000):
+        ...     _ = r.putInCache(('a', (i,), ()), i)
+        >>> time.sleep(0.2)
+        >>> for i in range(200):
+        ...     _ = r.putInCache(('b', (i,), ()), i)
+        >>> len(r._cache) <= 200
+        True
+
+        maxEntries evicts the entries closest to expiry.
+
+        >>> r = TimeLimitedRamCache({'duration' : 60, 'maxentries': '2'})
+        >>> for i in range(3):
+        ...     r.putInCache(('a', (i,), ()), i)
+        0
+        1
+        2
+        >>> sorted(r._cache.values())
+        [1, 2]
+
+        So does maxBytes.
+
+        >>> r = TimeLimitedRamCache({'duration' : 60, 'maxbytes': '10000'})
+        >>> for i in range(5):
+        ...     _ = r.putInCache(('a', (i,), ()), 'x' * 3000)
+        >>> sorted(k[1][0] for k in r._cache), r.memoryBytes() <= 10000
+        ([2, 3, 4], True)
         """
-        if func not in self._cache:
-            self._cache[func] = {}
-            self._dateHit[func] = {}
+        now = monotonic()
+        self._drain(now)
+
+        if key not in self._cache and self._maxEntries is not None:
+            while len(self._cache) >= self._maxEntries and self._heap:
+                if self._popHeap() and self.stats is not None:
+                    self.stats.incr('evictions')
+
+        if key in self._cache:
+            self._remove(key)
+        if not self._track(key, result):
+            return result
+
+        if ttl is None:
+            ttl = self._duration
+        expiry = (now + ttl, next(self._seq))
+        self._cache[key] = result
+        self._expiry[key] = expiry
+        heapq.heappush(self._heap, (expiry[0], expiry[1], key))
+        self._shrink()
 
-        if str(args) not in self._cache[func]:
-            self._cache[func][str(args)] = {}
-            self._dateHit[func][str(args)] = {}
-            
+        # rebuild the heap when superseded deadlines pile up
+        if len(self._heap) > 2 * len(self._expiry) + 64:
+            self._heap = [(d, s, k) for k, (d, s) in self._expiry.items()]
+            heapq.heapify(self._heap)
 
-        self._cache[func][str(args)][str(kwargs)] = result
-        self._dateHit[func][str(args)][str(kwargs)] = datetime.datetime.now()
         return result
+
+    def _drain(self, now):
+        """
+        Free at most _drainBatch expired entries.
+        """
+        heap = self._heap
+        for i in range(self._drainBatch):
+            if not heap or heap[0][0] > now:
+                return
+            if self._popHeap() and self.stats is not None:
+                self.stats.incr('expirations')
+
+    def _popHeap(self):
+        """
+        Pop the earliest deadline and remove its entry if still current.
+        Return True if an entry was removed.
+        """
+        deadline, seq, key = heapq.heappop(self._heap)
+        expiry = self._expiry.get(key)
+        if expiry is not None and expiry[1] == seq:
+            self._remove(key)
+            return True
+        return False
+
+    def _evictOne(self):
+        """
+        Evict the entry closest to expiry.
+        """
+        while not self._popHeap():
+            pass
+
+    def _remove(self, key):
+        """
+        Remove an entry, leaving its deadline in the heap.
+        """
+        self._discard(key)
+        del(self._expiry[key])
     
 if __name__ == "__main__":
     import doctest
@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+
+import atexit
+import collections
+import os
+import threading
+import weakref
+
+from abstractcache import AbstractCache, MISS
+from configoptions import getBoolean, getInteger
+
+from exceptionconfig import *
+
+
+POLICIES = ('block', 'drop', 'sync')
+
+# the WriteBehind instances alive, flushed at exit
+_live = weakref.WeakSet()
+
+
+class WriteBehind(object):
+    """
+    Bounded queue of writes drained by worker threads.
+
+    A key is queued once : a write to a key already queued replaces the
+    queued result. Two workers never write the same key at the same time,
+    so the last write wins. When the queue is full, the policy says what a
+    new write does : 'block' waits for room, 'drop' forgets it, 'sync'
+    writes it in the caller thread. Pending writes are flushed at exit.
+    A forked child starts with an empty queue and its own workers.
+    """
+
+    def __init__(self, write, size=1000, workers=1, policy='block', stats=None):
+        """
+        write : function(key, result, ttl) doing the slow write.
+        stats : the Stats of the cache, counting the failed writes.
+
+        >>> w = WriteBehind(lambda key, result, ttl: None, 10, 2)
+        >>> w._size, w._workers, w._policy
+        (10, 2, 'block')
+        >>> w._threads
+        []
+        >>> w in _live
+        True
+        """
+        self._write = write
+        self._size = size
+        self._workers = workers
+        self._policy = policy
+        self.stats = stats
+
+        self._cond = threading.Condition()
+        # key -> (result, ttl), keys in _order once each
+        self._pending = {}
+        self._order = collections.deque()
+        self._inFlight = {}
+        self._threads = []
+        self._pid = os.getpid()
+        self.dropped = 0
+
+        _live.add(self)
+
+    @staticmethod
+    def fromConfig(write, config, stats=None):
+        """
+        Return a WriteBehind if the section enables it, else None.
+
+        >>> WriteBehind.fromConfig(None, {'module': 'FsCache'}) is None
+        True
+        >>> w = WriteBehind.fromConfig(None, {'writebehind': 'yes', 'writebehindsize': '50', 'writebehindpolicy': 'drop'})
+        >>> w._size, w._workers, w._policy
+        (50, 1, 'drop')
+        """
+        if not getBoolean(config, 'writebehind'):
+            return None
+        return WriteBehind(write,
+                           getInteger(config, 'writebehindsize', 1000),
+                           getInteger(config, 'writebehindworkers', 1),
+                           config.get('writebehindpolicy', 'block'),
+                           stats)
+
+    @staticmethod
+    def checkConf(config):
+        """
+        Check write behind options of a section.
+
+        >>> WriteBehind.checkConf({'writebehind': 'yes', 'writebehindsize': '10', 'writebehindpolicy': 'sync'})
+        >>> WriteBehind.checkConf({'writebehind': 'yes', 'writebehindsize': '0'})
+        Traceback (most recent call last):
+        ...
+        BadOptionValue: writebehindsize must be at least 1
+        >>> WriteBehind.checkConf({'writebehind': 'yes', 'writebehindpolicy': 'later'})
+        Traceback (most recent call last):
+        ...
+        BadOptionValue: writebehindpolicy must be one of block, drop, sync
+        """
+        getBoolean(config, 'writebehind')
+        for option in ['writebehindsize', 'writebehindworkers']:
+            if getInteger(config, option, 1) < 1:
+                raise BadOptionValue('%s must be at least 1' % option)
+        if config.get('writebehindpolicy', 'block') not in POLICIES:
+            raise BadOptionValue('writebehindpolicy must be one of ' + ', '.join(POLICIES))
+
+    def lookup(self, key):
+        """
+        Return the result of a write not done yet, or MISS.
+
+        >>> w = WriteBehind(lambda key, result, ttl: None)
+        >>> w.lookup('k')
+        MISS
+        """
+        self._checkFork()
+        self._cond.acquire()
+        try:
+            if key in self._pending:
+                return self._pending[key][0]
+            if key in self._inFlight:
+                return self._inFlight[key][0]
+            return MISS
+        finally:
+            self._cond.release()
+
+    def put(self, key, result, ttl=None):
+        """
+        Queue a write. Return False if the policy dropped it.
+
+        >>> import time
+        >>> written = []
+        >>> def slowWrite(key, result, ttl):
+        ...     time.sleep(0.01)
+        ...     written.append((key, result))
+        >>> w = WriteBehind(slowWrite)
+        >>> for i in range(10):
+        ...     _ = w.put('k', i)
+        >>> w.flush()
+        >>> len(written) < 10, written[-1]
+        (True, ('k', 9))
+
+        A full queue blocks, drops or writes in the caller thread.
+
+        >>> release = threading.Event()
+        >>> def stuck(key, result, ttl):
+        ...     release.wait()
+        ...     written.append((key, result))
+        >>> def putStuck(key):
+        ...     w.put(key, key)
+        ...     while key not in w._inFlight:
+        ...         time.sleep(0.01)
+        >>> w = WriteBehind(stuck, size=2, policy='drop')
+        >>> putStuck(0)
+        >>> [w.put(i, i) for i in range(1, 4)]
+        [True, True, False]
+        >>> w.dropped
+        1
+        >>> release.set()
+        >>> w.flush()
+        >>> release.clear()
+        >>> w = WriteBehind(stuck, size=1, policy='sync')
+        >>> putStuck('a')
+        >>> w.put('b', 2)
+        True
+        >>> t = threading.Timer(0.1, release.set)
+        >>> t.start()
+        >>> w.put('c', 3)
+        True
+        >>> written[-1]
+        ('c', 3)
+        >>> w.flush()
+        """
+        self._checkFork()
+        self._cond.acquire()
+        try:
+            self._startWorkers()
+            while True:
+                if key in self._pending:
+                    self._pending[key] = (result, ttl)
+                    return True
+                if len(self._pending) < self._size:
+                    self._pending[key] = (result, ttl)
+                    self._order.append(key)
+                    self._cond.notify_all()
+                    return True
+                if self._policy == 'drop':
+                    self.dropped += 1
+                    return False
+                if self._policy == 'sync' and key not in self._inFlight:
+                    break
+                self._cond.wait()
+            # sync : written below by the caller, kept in flight meanwhile
+            self._inFlight[key] = (result, ttl)
+        finally:
+            self._cond.release()
+
+        self._writeOne(key, result, ttl)
+        return True
+
+    def _checkFork(self):
+        """
+        In a forked child, drop the queue, lock and workers inherited from
+        the parent, which writes its queue itself : the workers are
+        started again by the next put.
+
+        >>> import signal, time
+        >>> parent = os.getpid()
+        >>> release = threading.Event()
+        >>> def stuckInParent(key, result, ttl):
+        ...     if os.getpid() == parent:
+        ...         release.wait()
+        >>> w = WriteBehind(stuckInParent, size=1)
+        >>> w.put('a', 1)
+        True
+        >>> while 'a' not in w._inFlight:
+        ...     time.sleep(0.01)
+        >>> w.put('b', 2)
+        True
+        >>> pid = os.fork()
+        >>> if pid == 0:
+        ...     signal.alarm(5)
+        ...     w.put('c', 3), w.put('d', 4)
+        ...     w.flush()
+        ...     os._exit(0)
+        >>> os.waitpid(pid, 0)[1]
+        0
+        >>> release.set()
+        >>> w.flush()
+        """
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._order = collections.deque()
+        self._inFlight = {}
+        self._threads = []
+
+    def _startWorkers(self):
+        while len(self._threads) < self._workers:
+            worker = threading.Thread(target=self._work)
+            worker.setDaemon(True)
+            worker.start()
+            self._threads.append(worker)
+
+    def _next(self):
+        """
+        Pop the first queued key not being written, or None.
+        """
+        for i in range(len(self._order)):
+            key = self._order.popleft()
+            if key not in self._inFlight:
+                return key
+            self._order.append(key)
+        return None
+
+    def _work(self):
+        while True:
+            self._cond.acquire()
+            try:
+                key = self._next()
+                while key is None:
+                    self._cond.wait()
+                    key = self._next()
+                result, ttl = self._inFlight[key] = self._pending.pop(key)
+            finally:
+                self._cond.release()
+            self._writeOne(key, result, ttl)
+
+    def _writeOne(self, key, result, ttl):
+        """
+        Write one key, a failure is counted in stats.
+
+        >>> from stats import Stats
+        >>> def broken(key, result, ttl):
+        ...     raise IOError('disk full')
+        >>> w = WriteBehind(broken, stats=Stats())
+        >>> w.put('k', 1)
+        True
+        >>> w.flush()
+        >>> w.stats.snapshot()['errors']
+        1
+        """
+        try:
+            self._write(key, result, ttl)
+        except Exception:
+            # the result is lost for the cache only, the caller has it
+            if self.stats is not None:
+                self.stats.incr('errors')
+        finally:
+            self._cond.acquire()
+            try:
+                del self._inFlight[key]
+                self._cond.notify_all()
+            finally:
+                self._cond.release()
+
+    def flush(self):
+        """
+        Wait until every queued write is done.
+        """
+        self._checkFork()
+        self._cond.acquire()
+        try:
+            while self._pending or self._inFlight:
+                self._cond.wait()
+        finally:
+            self._cond.release()
+
+
+class WriteBehindCache(AbstractCache):
+    """
+    Cache writing to its backend from background threads.
+
+    Put returns at once, the backend write happens later. Reads of a key
+    still queued return the queued result.
+    """
+
+    def __init__(self, backend, config):
+        """
+        backend : the backend instance.
+        config : the Cache_* section, with writeBehind options.
+
+        >>> from ramcache import RamCache
+        >>> w = WriteBehindCache(RamCache(), {'module': 'RamCache', 'writebehind': 'yes'})
+        >>> w.backend #doctest: +ELLIPSIS
+        <ramcache.RamCache object at 0x...>
+        """
+        AbstractCache.__init__(self, config)
+
+        self.backend = backend
+        self.blocking = backend.blocking
+        self.stats = backend.stats
+        self._writeBehind = WriteBehind.fromConfig(backend.putInCache, config, self.stats)
+
+    def flush(self):
+        self._writeBehind.flush()
+
+    def get(self, key, default=MISS):
+        """
+        >>> from ramcache import RamCache
+        >>> release = threading.Event()
+        >>> backend = RamCache()
+        >>> def slowPut(key, result, ttl=None):
+        ...     release.wait()
+        ...     return RamCache.putInCache(backend, key, result, ttl)
+        >>> backend.putInCache = slowPut
+        >>> w = WriteBehindCache(backend, {'writebehind': 'yes'})
+        >>> w.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> w.get(('a', (1, 2), ())), backend.get(('a', (1, 2), ()))
+        (3, MISS)
+        >>> release.set()
+        >>> w.flush()
+        >>> backend.get(('a', (1, 2), ()))
+        3
+        """
+        result = self._writeBehind.lookup(key)
+        if result is not MISS:
+            return result
+        return self.backend.get(key, default)
+
+    def getMany(self, keys, default=MISS):
+        """
+        >>> from ramcache import RamCache
+        >>> w = WriteBehindCache(RamCache(), {'writebehind': 'yes'})
+        >>> w.putMany([(('a', (1, 2), ()), 3)])
+        >>> w.getMany([('a', (1, 2), ()), ('b', (1, 2), ())])
+        [3, MISS]
+        """
+        keys = list(keys)
+        results = [self._writeBehind.lookup(key) for key in keys]
+        missing = [position for position, result in enumerate(results) if result is MISS]
+        if missing:
+            found = self.backend.getMany([keys[p] for p in missing], default)
+            for position, result in zip(missing, found):
+                results[position] = result
+        return results
+
+    def isCached(self, key):
+        """
+        >>> from ramcache import RamCache
+        >>> w = WriteBehindCache(RamCache(), {'writebehind': 'yes'})
+        >>> w.isCached(('a', (1, 2), ()))
+        False
+        """
+        return self._writeBehind.lookup(key) is not MISS or self.backend.isCached(key)
+
+    def cached(self, key):
+        """
+        >>> from ramcache import RamCache
+        >>> w = WriteBehindCache(RamCache(), {'writebehind': 'yes'})
+        >>> w.putInCache(('a', (1, 2), ()), 3)
+        3
+        >>> w.cached(('a', (1, 2), ()))
+        3
+        """
+        result = self.get(key)
+        if result is MISS:
+            raise KeyError(key)
+        return result
+
+    def putInCache(self, key, result, ttl=None):
+        """
+        Queue result for the backend.
+        """
+        self._writeBehind.put(key, result, ttl)
+        return result
+
+
+def _flushAll():
+    """
+    Flush the pending writes of every live WriteBehind, at exit.
+
+    >>> written = []
+    >>> w = WriteBehind(lambda key, result, ttl: written.append(key))
+    >>> w.put('k', 1)
+    True
+    >>> _flushAll()
+    >>> written
+    ['k']
+    """
+    for writeBehind in list(_live):
+        writeBehind.flush()
+
+atexit.register(_flushAll)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()